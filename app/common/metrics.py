@@ -0,0 +1,280 @@
+# app/common/metrics.py
+"""
+In-process metrics with a Prometheus text endpoint (stdlib only).
+
+Counters, gauges and fixed-bucket histograms keyed by label values. An
+observe() is a bisect over the bucket bounds plus a few integer adds under
+a lock (~1us), cheap enough to leave on for every message.
+
+    from app.common.metrics import REGISTRY, serve_metrics
+    LAT = REGISTRY.histogram("ingest_latency_ms", "...", ("stage", "symbol"))
+    LAT.observe(12.5, "recv_to_commit", "BTC-USDT-SWAP")
+    serve_metrics(9108)     # GET http://127.0.0.1:9108/metrics
+
+Long-running services start the endpoint from local.yaml with
+serve_from_config(cfg, service); one-shot jobs write a final snapshot for
+a textfile collector with write_textfile(cfg, service).
+"""
+from __future__ import annotations
+
+import os
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# ms buckets: 1ms .. ~16min, roughly x2 per step
+LATENCY_MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 300000, 1000000)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+Labels = Tuple[str, ...]
+
+
+def _fmt(v: float) -> str:
+    v = float(v)
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if v.is_integer() else repr(v)
+
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels) -> Labels:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {labels}")
+        return tuple(labels)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Exposition lines after HELP / TYPE."""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._funcs: Dict[Labels, Callable[[], float]] = {}
+
+    def inc(self, amount: float = 1, *labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def set_function(self, fn: Callable[[], float], *labels) -> None:
+        """Read the value from fn() at scrape time (e.g. an existing counter attribute)."""
+        self._funcs[self._key(labels)] = fn
+
+    def get(self, *labels) -> float:
+        k = self._key(labels)
+        fn = self._funcs.get(k)
+        return fn() if fn else self._values.get(k, 0)
+
+    def _samples(self):
+        with self._lock:
+            vals = dict(self._values)
+        for k, fn in list(self._funcs.items()):
+            vals[k] = fn()
+        return [f"{self.name}{_label_str(self.labelnames, k)} {_fmt(v)}" for k, v in sorted(vals.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Sequence[float] = LATENCY_MS_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(float(b) for b in buckets))
+        # per label set: [count per bucket (+Inf last), sum]
+        self._data: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        k = self._key(labels)
+        i = bisect_left(self.bounds, value)
+        with self._lock:
+            d = self._data.get(k)
+            if d is None:
+                d = self._data[k] = ([0] * (len(self.bounds) + 1), [0.0])
+            d[0][i] += 1
+            d[1][0] += value
+
+    def snapshot(self, *labels) -> Optional[dict]:
+        """{count, sum, buckets: [(le, cumulative count), ...]} for one label set."""
+        k = self._key(labels)
+        with self._lock:
+            d = self._data.get(k)
+            if d is None:
+                return None
+            counts, total = list(d[0]), d[1][0]
+        cum, acc = [], 0
+        for le, c in zip(self.bounds + (float("inf"),), counts):
+            acc += c
+            cum.append((le, acc))
+        return {"count": acc, "sum": total, "buckets": cum}
+
+    def quantile(self, q: float, *labels) -> Optional[float]:
+        """Upper bucket bound containing the q-quantile (coarse, for log lines)."""
+        s = self.snapshot(*labels)
+        if not s or not s["count"]:
+            return None
+        target = q * s["count"]
+        for le, c in s["buckets"]:
+            if c >= target:
+                return le
+        return None
+
+    def _samples(self):
+        with self._lock:
+            keys = sorted(self._data)
+        out = []
+        for k in keys:
+            s = self.snapshot(*k)
+            for le, c in s["buckets"]:
+                le_label = 'le="' + _fmt(le) + '"'
+                out.append(f"{self.name}_bucket{_label_str(self.labelnames, k, le_label)} {c}")
+            out.append(f"{self.name}_sum{_label_str(self.labelnames, k)} {_fmt(s['sum'])}")
+            out.append(f"{self.name}_count{_label_str(self.labelnames, k)} {s['count']}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, labelnames, **kw):
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = cls(name, help, labelnames, **kw)
+            elif type(m) is not cls or m.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} already registered as {m.kind}{m.labelnames}")
+            return m
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_MS_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# end-to-end ingest latency (ms) by stage:
+#   close_to_recv      bar close time -> first ws message of the next bar
+#   recv_to_commit     ws receive -> bar committed by the writer
+#   close_to_commit    bar close time -> committed
+#   close_to_feature   bar close time -> features for that bar written
+INGEST_LATENCY = REGISTRY.histogram(
+    "quant_ingest_latency_ms", "Ingest latency per stage and symbol (ms)", ("stage", "symbol"),
+)
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve GET /metrics (Prometheus text format 0.0.4) from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[metrics] serving http://{host}:{server.server_address[1]}/metrics", flush=True)
+    return server
+
+
+def serve_from_config(cfg: Dict[str, Any], service: str, registry: Registry = REGISTRY) -> Optional[ThreadingHTTPServer]:
+    """
+    Start /metrics for `service` from local.yaml:
+
+        metrics:
+          port: 9108                  # default port
+          ports: {main_data_runner: 9109}   # per-service override
+          host: 127.0.0.1
+
+    No metrics section (or port 0) = off. A port already in use is logged,
+    not raised: metrics must not take the service down.
+    """
+    mcfg = cfg.get("metrics") or {}
+    port = (mcfg.get("ports") or {}).get(service, mcfg.get("port"))
+    if not port:
+        return None
+    try:
+        return serve_metrics(int(port), host=mcfg.get("host", "127.0.0.1"), registry=registry)
+    except OSError as e:
+        print(f"[metrics] {service}: cannot serve on port {port}: {e}", flush=True)
+        return None
+
+
+def write_textfile(cfg: Dict[str, Any], service: str, registry: Registry = REGISTRY) -> Optional[Path]:
+    """
+    One-shot jobs: write the registry to {metrics.textfile_dir}/{service}.prom
+    (atomic replace, node_exporter textfile-collector format). Off when
+    textfile_dir is not set.
+    """
+    d = (cfg.get("metrics") or {}).get("textfile_dir")
+    if not d:
+        return None
+    path = Path(d) / f"{service}.prom"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp, path)
+    print(f"[metrics] snapshot -> {path}", flush=True)
+    return path
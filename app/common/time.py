@@ -0,0 +1,40 @@
+# app/common/time.py
+import time
+
+MS_1M = 60_000
+MS_1H = 3_600_000
+MS_1D = 86_400_000
+
+# timeframe -> bar step (ms)
+TIMEFRAME_MS = {
+    "1m": MS_1M,
+    "3m": 3 * MS_1M,
+    "5m": 5 * MS_1M,
+    "15m": 15 * MS_1M,
+    "30m": 30 * MS_1M,
+    "1h": MS_1H,
+    "2h": 2 * MS_1H,
+    "4h": 4 * MS_1H,
+    "6h": 6 * MS_1H,
+    "12h": 12 * MS_1H,
+    "1d": MS_1D,
+    "1w": 7 * MS_1D,
+}
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def timeframe_ms(timeframe: str) -> int:
+    """'1m' / '1H' / '4h' / '1D' ... -> step in ms."""
+    tf = timeframe.strip()
+    # OKX style: 1H / 1D / 1W (minutes stay lowercase)
+    key = tf if tf.endswith("m") else tf.lower()
+    if key not in TIMEFRAME_MS:
+        raise ValueError(f"unknown timeframe: {timeframe}")
+    return TIMEFRAME_MS[key]
+
+
+def floor_ts(ts: int, step_ms: int) -> int:
+    return ts - ts % step_ms
@@ -1,5 +1,13 @@
 # app/common/types.py
+from __future__ import annotations
+
 from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+BAR_FIELDS = ("ts", "open", "high", "low", "close", "volume")
+
 
 @dataclass(frozen=True)
 class Bar:
@@ -12,3 +20,156 @@ class Bar:
     close: float
     volume: float
     source: str = "okx"
+
+
+class BarRow:
+    """
+    Lightweight view of one row of a BarBatch (no copy of the values).
+
+    Reads like a Bar (attributes), unpacks like the (ts, o, h, l, c, v) rows
+    the repository takes, and works as a mapping (dict(row)).
+    """
+
+    __slots__ = ("_batch", "_i")
+
+    def __init__(self, batch: "BarBatch", i: int):
+        self._batch = batch
+        self._i = i
+
+    symbol = property(lambda self: self._batch.symbol)
+    timeframe = property(lambda self: self._batch.timeframe)
+    source = property(lambda self: self._batch.source)
+    ts = property(lambda self: int(self._batch.ts[self._i]))
+    open = property(lambda self: float(self._batch.open[self._i]))
+    high = property(lambda self: float(self._batch.high[self._i]))
+    low = property(lambda self: float(self._batch.low[self._i]))
+    close = property(lambda self: float(self._batch.close[self._i]))
+    volume = property(lambda self: float(self._batch.volume[self._i]))
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self) -> int:
+        return len(BAR_FIELDS)
+
+    def keys(self):
+        return BAR_FIELDS
+
+    def __contains__(self, key) -> bool:
+        return key in BAR_FIELDS
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return self.as_tuple()[key]
+
+    def as_tuple(self) -> tuple:
+        return (self.ts, self.open, self.high, self.low, self.close, self.volume)
+
+    def as_bar(self) -> Bar:
+        return Bar(self.symbol, self.timeframe, *self.as_tuple(), source=self.source)
+
+    def __repr__(self) -> str:
+        return f"BarRow({self.symbol} {self.timeframe} ts={self.ts} o={self.open} h={self.high} l={self.low} c={self.close} v={self.volume})"
+
+
+class BarBatch:
+    """
+    Bars of one series as columns: ts int64 ms, OHLCV float64.
+
+    This is what the ingest paths pass around instead of lists of Bar /
+    list-of-lists. Indexing with an int gives a BarRow view; slices, masks
+    and index arrays give another BarBatch. columns() hands the arrays to
+    the repository / aggregator without copying.
+    """
+
+    __slots__ = ("symbol", "timeframe", "source") + BAR_FIELDS
+
+    def __init__(
+        self,
+        symbol: str,
+        timeframe: str,
+        ts,
+        open,
+        high,
+        low,
+        close,
+        volume,
+        source: str = "okx",
+    ):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.source = source
+        self.ts = np.asarray(ts, dtype=np.int64)
+        n = len(self.ts)
+        for name, a in zip(BAR_FIELDS[1:], (open, high, low, close, volume)):
+            a = np.asarray(a, dtype=np.float64)
+            if len(a) != n:
+                raise ValueError(f"column {name} has {len(a)} rows, ts has {n}")
+            setattr(self, name, a)
+
+    @classmethod
+    def empty(cls, symbol: str, timeframe: str, source: str = "okx") -> "BarBatch":
+        z = np.empty(0, dtype=np.float64)
+        return cls(symbol, timeframe, np.empty(0, dtype=np.int64), z, z, z, z, z, source=source)
+
+    @classmethod
+    def from_columns(cls, symbol: str, timeframe: str, cols: Dict[str, np.ndarray], source: str = "okx") -> "BarBatch":
+        return cls(symbol, timeframe, *(cols[c] for c in BAR_FIELDS), source=source)
+
+    @classmethod
+    def from_bars(cls, bars: Sequence[Bar]) -> "BarBatch":
+        if not bars:
+            raise ValueError("from_bars needs at least one bar (for symbol/timeframe)")
+        b0 = bars[0]
+        cols = [[getattr(b, c) for b in bars] for c in BAR_FIELDS]
+        return cls(b0.symbol, b0.timeframe, *cols, source=b0.source)
+
+    def __len__(self) -> int:
+        return len(self.ts)
+
+    def __iter__(self) -> Iterator[BarRow]:
+        return (BarRow(self, i) for i in range(len(self.ts)))
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            n = len(self.ts)
+            i = int(key) + n if key < 0 else int(key)
+            if not 0 <= i < n:
+                raise IndexError(key)
+            return BarRow(self, i)
+        return BarBatch(
+            self.symbol, self.timeframe,
+            *(getattr(self, c)[key] for c in BAR_FIELDS),
+            source=self.source,
+        )
+
+    def __repr__(self) -> str:
+        span = f" {int(self.ts[0])}..{int(self.ts[-1])}" if len(self.ts) else ""
+        return f"BarBatch({self.symbol} {self.timeframe} n={len(self.ts)}{span})"
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {c: getattr(self, c) for c in BAR_FIELDS}
+
+    def rows(self) -> List[tuple]:
+        """(ts, o, h, l, c, v) tuples with Python scalars (for execute_values)."""
+        return list(zip(self.ts.tolist(), self.open.tolist(), self.high.tolist(),
+                        self.low.tolist(), self.close.tolist(), self.volume.tolist()))
+
+    def latest_ts(self) -> Optional[int]:
+        return int(self.ts.max()) if len(self.ts) else None
+
+    def sorted(self) -> "BarBatch":
+        """Ascending ts, duplicate ts keep the last row."""
+        ts = self.ts
+        if len(ts) < 2 or (ts[1:] > ts[:-1]).all():
+            return self
+        if (ts[1:] < ts[:-1]).all():
+            return self[::-1]
+        order = np.argsort(ts, kind="stable")
+        s = ts[order]
+        return self[order[np.r_[s[1:] != s[:-1], True]]]
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns(), copy=False)
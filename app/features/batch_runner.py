@@ -1,26 +1,163 @@
 ﻿import argparse
+import multiprocessing
+import time
+from dataclasses import dataclass
 from pathlib import Path
+from typing import List, Optional
 
-from app.features.config import load_feature_config
-from app.features.service import compute_features
-from app.features.storage import save_features_csv
+from app.common.metrics import write_textfile
+from app.features.config import FeatureConfig, load_feature_config
+from app.features.pipeline import CHUNK_ROWS, observe_feature_lag, update_series
+from app.features.storage import ColumnarFeatureSink, ColumnarFeatureStore, CsvFeatureSink, FeatureSink
 from app.storage.db import load_config, make_conn
 from app.storage.bar_repo import BarRepository
 
 
+@dataclass(frozen=True)
+class BatchTask:
+    source: str
+    symbol: str
+    timeframe: str
+    start_ts: Optional[int] = None
+    end_ts: Optional[int] = None
+    limit: Optional[int] = None
+    full: bool = False
+    chunk_rows: int = CHUNK_ROWS
+
+
+@dataclass(frozen=True)
+class BatchResult:
+    task: BatchTask
+    bars: int
+    features: int
+    status: str
+    seconds: float
+    lag_ms: Optional[float] = None   # close_to_feature, observed by the parent process
+
+
+def make_sink(fcfg: FeatureConfig, source: str, symbol: str, timeframe: str) -> FeatureSink:
+    if fcfg.out_format == "columnar":
+        # data/features/okx/BTC-USDT-SWAP/1m/2024-01/*.bin
+        return ColumnarFeatureSink(ColumnarFeatureStore(fcfg.out_dir), source, symbol, timeframe)
+    # ===== 输出文件路径（改这里）=====
+    # data/features/okx/BTC-USDT-SWAP/1m.features.csv
+    return CsvFeatureSink(str(Path(fcfg.out_dir) / source / symbol / f"{timeframe}.features.csv"))
+
+
+def run_task(conn, fcfg: FeatureConfig, task: BatchTask) -> BatchResult:
+    t0 = time.perf_counter()
+    tag = f"{task.symbol} {task.timeframe}"
+
+    def done(bars_n, feat_n, status, lag_ms=None):
+        return BatchResult(task, bars_n, feat_n, status, time.perf_counter() - t0, lag_ms)
+
+    # ===== 从 DB 读取 bars（必须带 source）=====
+    repo = BarRepository(conn)
+    sink = make_sink(fcfg, task.source, task.symbol, task.timeframe)
+    try:
+        up = update_series(
+            repo, fcfg, sink,
+            source=task.source,
+            symbol=task.symbol,
+            timeframe=task.timeframe,
+            start_ts=task.start_ts,
+            end_ts=task.end_ts,
+            limit=task.limit,
+            full=task.full,
+            chunk_rows=task.chunk_rows,
+        )
+    except Exception as e:
+        conn.rollback()
+        print(f"[batch][fail] {tag}: err={e}", flush=True)
+        return done(0, 0, f"FAIL({e})")
+
+    if up.status != "OK":
+        print(f"[batch][skip] {tag}: {up.status} mode={up.mode}", flush=True)
+    else:
+        print(f"[batch][ok] {tag}: mode={up.mode} bars={up.bars} features={up.features} -> {sink}", flush=True)
+    return done(up.bars, up.features, up.status, up.lag_ms)
+
+
+# ===== process-pool worker: one DB connection per worker process =====
+_worker_conn = None
+_worker_cfg = None
+_worker_fcfg = None
+
+
+def _init_worker(cfg: dict, fcfg: FeatureConfig):
+    global _worker_conn, _worker_cfg, _worker_fcfg
+    _worker_cfg = cfg
+    _worker_fcfg = fcfg
+    # the connection is closed when the worker process exits
+    _worker_conn = make_conn(cfg)
+
+
+def _run_in_worker(task: BatchTask) -> BatchResult:
+    global _worker_conn
+    try:
+        if _worker_conn is None or _worker_conn.closed:
+            _worker_conn = make_conn(_worker_cfg)
+        return run_task(_worker_conn, _worker_fcfg, task)
+    except Exception as e:
+        print(f"[batch][fail] {task.symbol} {task.timeframe}: worker err={e}", flush=True)
+        return BatchResult(task, 0, 0, f"FAIL({e})", 0.0)
+
+
+def run_serial(cfg: dict, fcfg: FeatureConfig, tasks: List[BatchTask]) -> List[BatchResult]:
+    conn = make_conn(cfg)
+    try:
+        return [run_task(conn, fcfg, t) for t in tasks]
+    finally:
+        conn.close()
+
+
+def run_parallel(
+    cfg: dict,
+    fcfg: FeatureConfig,
+    tasks: List[BatchTask],
+    workers: int,
+    max_tasks_per_child: Optional[int] = None,
+) -> List[BatchResult]:
+    """
+    Fan tasks out over a process pool. Each worker holds at most one chunk of
+    one task's bars in memory at a time; max_tasks_per_child recycles workers to return memory
+    to the OS between large series.
+    """
+    # multiprocessing.Pool rather than ProcessPoolExecutor: the latter deadlocks
+    # with max_tasks_per_child on Python 3.11
+    with multiprocessing.Pool(
+        processes=workers,
+        initializer=_init_worker,
+        initargs=(cfg, fcfg),
+        maxtasksperchild=max_tasks_per_child,
+    ) as pool:
+        return pool.map(_run_in_worker, tasks, chunksize=1)
+
+
 def main():
-    ap = argparse.ArgumentParser(description="Batch feature runner (DB -> CSV, config-driven)")
+    ap = argparse.ArgumentParser(description="Batch feature runner (DB -> CSV/columnar, config-driven)")
     ap.add_argument("--config", default="app/config/features.yaml")
     ap.add_argument("--symbol", default=None)
+    ap.add_argument("--symbols", default=None, help="override config, e.g. BTC-USDT-SWAP,ETH-USDT-SWAP")
     ap.add_argument("--timeframes", default=None, help="override config, e.g. 1m,1h,4h")
     ap.add_argument("--start_ts", type=int, default=None)
     ap.add_argument("--end_ts", type=int, default=None)
     ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--full", action="store_true", help="ignore watermarks and rebuild every series")
+    ap.add_argument("--chunk_rows", type=int, default=CHUNK_ROWS, help="bars per DB read (bounds memory)")
+    ap.add_argument("--workers", type=int, default=1, help="process pool size; 1 = serial")
+    ap.add_argument("--max_tasks_per_child", type=int, default=4,
+                    help="recycle a worker after N tasks to bound its memory (0 = never)")
     args = ap.parse_args()
 
     # ===== feature config =====
     fcfg = load_feature_config(args.config)
-    symbol = args.symbol or fcfg.symbol
+    if args.symbols:
+        symbols = [x.strip() for x in args.symbols.split(",") if x.strip()]
+    elif args.symbol:
+        symbols = [args.symbol]
+    else:
+        symbols = list(fcfg.symbols)
 
     if args.timeframes:
         tfs = [x.strip() for x in args.timeframes.split(",") if x.strip()]
@@ -30,63 +167,40 @@ def main():
     # ===== source（先写死，后面你再配置化）=====
     source = "okx"
 
-    # ===== feature 输出目录（改这里）=====
-    # data/features/{source}/{symbol}/
-    base_out_dir = Path(fcfg.out_dir) / source / symbol
-    base_out_dir.mkdir(parents=True, exist_ok=True)
+    tasks = [
+        BatchTask(source, sym, tf, args.start_ts, args.end_ts, args.limit, args.full, args.chunk_rows)
+        for sym in symbols
+        for tf in tfs
+    ]
 
     # ===== DB =====
     cfg = load_config()
-    conn = make_conn(cfg)
-    repo = BarRepository(conn)
-
-    results = []
-
-    for tf in tfs:
-        # ===== 从 DB 读取 bars（必须带 source）=====
-        df = repo.fetch_bars_df(
-            source=source,
-            symbol=symbol,
-            timeframe=tf,
-            start_ts=args.start_ts,
-            end_ts=args.end_ts,
-            limit=args.limit,
-            asc=True,
-        )
 
-        bars_n = len(df)
-        if bars_n == 0:
-            print(f"[batch][skip] {tf}: bars=0")
-            results.append((tf, 0, 0, "SKIP(bars=0)"))
-            continue
+    workers = max(1, min(args.workers, len(tasks)))
+    print(f"[batch] tasks={len(tasks)} symbols={len(symbols)} timeframes={len(tfs)} workers={workers}", flush=True)
 
-        warmup = fcfg.warmup_for(tf)
-
-        try:
-            df_feat = compute_features(
-                df,
-                indicator_cfg=fcfg.indicators,
-                warmup=warmup,
-            )
-        except Exception as e:
-            print(f"[batch][fail] {tf}: bars={bars_n} warmup={warmup} err={e}")
-            results.append((tf, bars_n, 0, f"FAIL({e})"))
-            continue
-
-        # ===== 输出文件路径（改这里）=====
-        # data/features/okx/BTC-USDT-SWAP/1m.features.csv
-        out_path = base_out_dir / f"{tf}.features.csv"
-        save_features_csv(df_feat, str(out_path))
-
-        feat_n = len(df_feat)
-        print(f"[batch][ok] {tf}: bars={bars_n} warmup={warmup} features={feat_n} -> {out_path}")
-        results.append((tf, bars_n, feat_n, "OK"))
+    t0 = time.perf_counter()
+    if workers == 1:
+        results = run_serial(cfg, fcfg, tasks)
+    else:
+        results = run_parallel(cfg, fcfg, tasks, workers, args.max_tasks_per_child or None)
+    wall = time.perf_counter() - t0
 
-    conn.close()
+    # latencies are recorded here, not in the workers, so the snapshot has them all
+    for r in results:
+        observe_feature_lag(r.task.symbol, r.lag_ms)
+    write_textfile(cfg, "batch_runner")
 
     print("\n=== batch summary ===")
-    for tf, b, f, st in results:
-        print(f"{tf:>5}  bars={b:<6}  features={f:<6}  {st}")
+    for r in results:
+        print(f"{r.task.symbol:<20} {r.task.timeframe:>5}  bars={r.bars:<8}  features={r.features:<8}  "
+              f"{r.seconds:7.2f}s  {r.status}")
+
+    n_ok = sum(1 for r in results if r.status == "OK")
+    n_skip = sum(1 for r in results if r.status.startswith("SKIP"))
+    n_fail = len(results) - n_ok - n_skip
+    task_secs = sum(r.seconds for r in results)
+    print(f"\nok={n_ok} skip={n_skip} fail={n_fail}  wall={wall:.2f}s  task_sum={task_secs:.2f}s")
 
 
 if __name__ == "__main__":
@@ -1,11 +1,15 @@
 ﻿from __future__ import annotations
-from dataclasses import dataclass
+import hashlib
+import json
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
 import yaml
 
 
+OUTPUT_FORMATS = ("csv", "columnar")
+
 DEFAULT_CONFIG_PATHS = [
     "app/config/features.yaml",
     "app/config/features.yml",
@@ -20,10 +24,18 @@ class FeatureConfig:
     warmup_overrides: Dict[str, int]
     indicators: Dict[str, Any]
     out_dir: str
+    out_format: str = "csv"
+    symbols: List[str] = field(default_factory=list)
 
     def warmup_for(self, timeframe: str) -> int:
         return int(self.warmup_overrides.get(timeframe, self.warmup_default))
 
+    def fingerprint(self, timeframe: str) -> str:
+        """Hash of everything that changes feature values for this timeframe."""
+        payload = {"indicators": self.indicators, "warmup": self.warmup_for(timeframe)}
+        raw = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
 
 def _deep_get(d: Dict[str, Any], path: List[str], default=None):
     cur = d
@@ -59,6 +71,7 @@ def load_feature_config(config_path: Optional[str] = None) -> FeatureConfig:
 
     fc = raw.get("features", {})
     symbol = str(fc.get("symbol", "BTC-USDT-SWAP"))
+    symbols = [str(x) for x in (fc.get("symbols") or [symbol])]
     timeframes = list(fc.get("timeframes", ["1h"]))
 
     warmup = fc.get("warmup", {}) or {}
@@ -67,6 +80,9 @@ def load_feature_config(config_path: Optional[str] = None) -> FeatureConfig:
 
     indicators = fc.get("indicators", {}) or {}
     out_dir = str(_deep_get(fc, ["output", "out_dir"], "data/features"))
+    out_format = str(_deep_get(fc, ["output", "format"], "csv")).lower()
+    if out_format not in OUTPUT_FORMATS:
+        raise ValueError(f"output.format must be one of {OUTPUT_FORMATS}, got {out_format!r}")
 
     return FeatureConfig(
         symbol=symbol,
@@ -75,4 +91,6 @@ def load_feature_config(config_path: Optional[str] = None) -> FeatureConfig:
         warmup_overrides={str(k): int(v) for k, v in warmup_overrides.items()},
         indicators=indicators,
         out_dir=out_dir,
+        out_format=out_format,
+        symbols=symbols,
     )
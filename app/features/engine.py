@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import math
+from collections import deque
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import pandas as pd
+
+from app.common.types import BarBatch
+from app.features.service import IndicatorParams, indicator_params
+
+NAN = float("nan")
+
+SeriesKey = Tuple[str, str, str]  # (source, symbol, timeframe)
+
+
+class _PrefixWindows:
+    """
+    Streaming counterpart of `kernels.PrefixSum`: the same running sum (shifted
+    by the first finite value when `center`, NaN summed as 0 and counted
+    apart) and the same window difference, so every window mean is
+    bit-identical to `PrefixSum(values).window_mean(w)` over the same history.
+    """
+
+    __slots__ = ("center", "offset", "csum", "cnt", "hist")
+
+    def __init__(self, max_window: int, center: bool = True):
+        self.center = center
+        self.offset: Optional[float] = None if center else 0.0
+        self.csum = 0.0
+        self.cnt = 0
+        # (csum, cnt) after each of the last max_window + 1 values, plus the leading 0
+        self.hist: deque = deque([(0.0, 0)], maxlen=int(max_window) + 1)
+
+    def push(self, val: float) -> None:
+        if val == val:
+            if self.offset is None:
+                self.offset = val
+            self.csum += val - self.offset if self.offset else val
+            self.cnt += 1
+        else:
+            self.csum += 0.0
+        self.hist.append((self.csum, self.cnt))
+
+    def mean(self, window: int) -> float:
+        w = int(window)
+        if w <= 0 or len(self.hist) <= w:
+            return NAN
+        s0, c0 = self.hist[-1 - w]
+        s1, c1 = self.hist[-1]
+        m = (s1 - s0) / w
+        if self.offset:
+            m += self.offset
+        if c1 - c0 != w:
+            return NAN
+        return m
+
+
+class _Ema:
+    """
+    O(1) EMA, equivalent to `Series.ewm(span=span, adjust=False).mean()`.
+    A NaN input keeps the value but keeps decaying its weight (ignore_na=False).
+    """
+
+    __slots__ = ("alpha", "old_wt_factor", "old_wt", "weighted")
+
+    def __init__(self, span: int):
+        self.alpha = 2.0 / (float(span) + 1.0)
+        self.old_wt_factor = 1.0 - self.alpha
+        self.old_wt = 1.0
+        self.weighted = NAN
+
+    def update(self, cur: float) -> float:
+        w = self.weighted
+        if w == w:
+            self.old_wt *= self.old_wt_factor
+            if cur == cur:
+                if w != cur:
+                    w = (self.old_wt * w + self.alpha * cur) / (self.old_wt + self.alpha)
+                self.old_wt = 1.0
+        elif cur == cur:
+            w = cur
+        self.weighted = w
+        return w
+
+
+class _SeriesState:
+    """Running indicator state for a single (source, symbol, timeframe)."""
+
+    def __init__(self, p: IndicatorParams):
+        self.n = 0
+        self.last_ts: Optional[int] = None
+        self.prev_close = NAN
+        # one shared running sum per input series, like compute_features' kernels
+        self.ma_windows = list(p.ma_windows)
+        self.atr_windows = list(p.atr_windows)
+        self.rsi_windows = list(p.rsi_windows)
+        self.close_sum = _PrefixWindows(max(self.ma_windows, default=0), center=True)
+        self.tr_sum = _PrefixWindows(max(self.atr_windows, default=0), center=False)
+        self.gain_sum = _PrefixWindows(max(self.rsi_windows, default=0), center=False)
+        self.loss_sum = _PrefixWindows(max(self.rsi_windows, default=0), center=False)
+        self.ema_fast = _Ema(p.macd_fast)
+        self.ema_slow = _Ema(p.macd_slow)
+        self.ema_signal = _Ema(p.macd_signal)
+
+    def step(self, high: float, low: float, close: float) -> Dict[str, float]:
+        out: Dict[str, float] = {}
+        prev_close = self.prev_close
+
+        self.close_sum.push(close)
+        for w in self.ma_windows:
+            out[f"ma_{w}"] = self.close_sum.mean(w)
+
+        # true range: row-wise max skipping NaN (first bar has no prev_close)
+        terms = [v for v in (high - low, abs(high - prev_close), abs(low - prev_close)) if v == v]
+        tr = max(terms) if terms else NAN
+        self.tr_sum.push(tr)
+        for w in self.atr_windows:
+            out[f"atr_{w}"] = _clamp0(self.tr_sum.mean(w))
+
+        # kernels.gains_losses: the first bar counts as 0 gain / 0 loss
+        if self.n == 0:
+            gain = loss = 0.0
+        else:
+            delta = close - prev_close
+            gain = max(delta, 0.0) if delta == delta else NAN
+            loss = -min(delta, 0.0) if delta == delta else NAN
+        self.gain_sum.push(gain)
+        self.loss_sum.push(loss)
+        for w in self.rsi_windows:
+            if self.n < w:
+                out[f"rsi_{w}"] = NAN  # a full window needs w deltas, i.e. w + 1 closes
+                continue
+            avg_gain = _clamp0(self.gain_sum.mean(w))
+            avg_loss = _clamp0(self.loss_sum.mean(w))
+            out[f"rsi_{w}"] = _rsi_value(avg_gain, avg_loss)
+
+        dif = self.ema_fast.update(close) - self.ema_slow.update(close)
+        dea = self.ema_signal.update(dif)
+        out["macd_dif"] = dif
+        out["macd_dea"] = dea
+        out["macd_hist"] = dif - dea
+
+        self.prev_close = close
+        self.n += 1
+        return out
+
+
+def _clamp0(v: float) -> float:
+    # np.maximum(v, 0.0): NaN stays NaN
+    return v if v != v or v > 0.0 else 0.0
+
+
+def _rsi_value(avg_gain: float, avg_loss: float) -> float:
+    # same semantics as `100 - 100 / (1 + avg_gain / avg_loss)` on float64 arrays
+    if avg_loss == 0.0:
+        if avg_gain != avg_gain or avg_gain == 0.0:
+            return NAN
+        rs = math.copysign(math.inf, avg_gain) * math.copysign(1.0, avg_loss)
+    else:
+        rs = avg_gain / avg_loss
+    return 100 - (100 / (1 + rs))
+
+
+class IncrementalFeatureEngine:
+    """
+    Stateful counterpart of `compute_features`.
+
+    Keeps running sums / EMA state per (source, symbol, timeframe), so each new
+    bar costs O(1) per indicator. `update()` returns only the feature rows that
+    became available with the given bars; feeding a whole history bar by bar
+    yields the same rows as `compute_features(history, indicator_cfg, warmup)`,
+    bit for bit: rolling windows use the same running-sum arithmetic as
+    app/features/kernels.py, MACD the same recursion as pandas ewm
+    (app/scripts/bench_features.py --check compares the two).
+
+    Bars must arrive in ts order; bars with ts <= the last seen ts are ignored.
+    """
+
+    REQUIRED_COLS = ["ts", "open", "high", "low", "close", "volume"]
+
+    def __init__(self, indicator_cfg: dict | None = None, warmup: int = 26):
+        self.params = indicator_params(indicator_cfg)
+        self.warmup = int(warmup)
+        self.feature_columns = self.params.feature_columns()
+        self._states: Dict[SeriesKey, _SeriesState] = {}
+
+    def reset(self, source: str, symbol: str, timeframe: str) -> None:
+        self._states.pop((source, symbol, timeframe), None)
+
+    def last_ts(self, source: str, symbol: str, timeframe: str) -> Optional[int]:
+        st = self._states.get((source, symbol, timeframe))
+        return st.last_ts if st else None
+
+    def update(
+        self,
+        source: str,
+        symbol: str,
+        timeframe: str,
+        bars: BarBatch | pd.DataFrame | Mapping[str, Any] | Iterable[Mapping[str, Any]],
+    ) -> pd.DataFrame:
+        """
+        bars: one bar (dict), a list of dicts, a BarBatch, or a DataFrame with
+              ts, open, high, low, close, volume (extra columns are passed through)
+        Returns a DataFrame of new feature rows (possibly empty).
+        """
+        key = (source, symbol, timeframe)
+        st = self._states.get(key)
+        if st is None:
+            st = _SeriesState(self.params)
+            self._states[key] = st
+
+        rows: List[Dict[str, Any]] = []
+        for bar in _iter_bars(bars):
+            for c in self.REQUIRED_COLS:
+                if c not in bar:
+                    raise ValueError(f"missing column: {c}")
+            ts = int(bar["ts"])
+            if st.last_ts is not None and ts <= st.last_ts:
+                continue
+            st.last_ts = ts
+
+            feats = st.step(float(bar["high"]), float(bar["low"]), float(bar["close"]))
+            if st.n <= self.warmup:
+                continue
+            if not all(math.isfinite(v) for v in feats.values()):
+                continue
+            if not all(math.isfinite(float(bar[c])) for c in self.REQUIRED_COLS[1:]):
+                continue
+
+            row = dict(bar)
+            row["ts"] = ts
+            row.update(feats)
+            rows.append(row)
+
+        if not rows:
+            return pd.DataFrame(columns=self._empty_columns(bars))
+        return pd.DataFrame(rows)
+
+    def _empty_columns(self, bars) -> List[str]:
+        if isinstance(bars, pd.DataFrame):
+            base = list(bars.columns)
+        else:
+            base = list(self.REQUIRED_COLS)
+        return base + [c for c in self.feature_columns if c not in base]
+
+
+def _iter_bars(bars) -> Iterable[Dict[str, Any]]:
+    if isinstance(bars, BarBatch):
+        return bars.sorted()
+    if isinstance(bars, pd.DataFrame):
+        x = bars if bars["ts"].is_monotonic_increasing else bars.sort_values("ts")
+        return x.to_dict("records")
+    if isinstance(bars, Mapping):
+        return [dict(bars)]
+    return sorted((dict(b) for b in bars), key=lambda b: int(b["ts"]))
@@ -0,0 +1,129 @@
+"""
+Vectorized NumPy kernels for the feature library.
+
+All kernels take contiguous float64 arrays and compute every requested window
+from one shared prefix-sum buffer, instead of one pandas rolling pass per
+window. NaN inputs are allowed: a window containing NaN yields NaN (same as
+`rolling(w, min_periods=w)`).
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+
+def as_f64(a) -> np.ndarray:
+    return np.ascontiguousarray(a, dtype=np.float64)
+
+
+class PrefixSum:
+    """
+    Shared prefix-sum buffer: `window_mean(w)` is O(n) per window with no re-scan.
+
+    Values are shifted by a reference level before summing, which keeps the
+    running sum small and the window differences accurate on long price series.
+    """
+
+    def __init__(self, values: np.ndarray, center: bool = True):
+        x = as_f64(values)
+        nan = np.isnan(x)
+        self.has_nan = bool(nan.any())
+        self.n = len(x)
+
+        self.offset = 0.0
+        if center and self.n:
+            finite = x[~nan] if self.has_nan else x
+            if len(finite):
+                self.offset = float(finite[0])
+
+        y = x - self.offset if self.offset else x.copy()
+        if self.has_nan:
+            y[nan] = 0.0
+            self.cnt = np.empty(self.n + 1, dtype=np.int64)
+            self.cnt[0] = 0
+            np.cumsum(~nan, out=self.cnt[1:])
+        else:
+            self.cnt = None
+
+        self.csum = np.empty(self.n + 1, dtype=np.float64)
+        self.csum[0] = 0.0
+        np.cumsum(y, out=self.csum[1:])
+
+    def window_mean(self, window: int) -> np.ndarray:
+        w = int(window)
+        out = np.full(self.n, np.nan, dtype=np.float64)
+        if w <= 0 or w > self.n:
+            return out
+
+        tail = out[w - 1:]
+        np.subtract(self.csum[w:], self.csum[:-w], out=tail)
+        tail /= w
+        if self.offset:
+            tail += self.offset
+        if self.cnt is not None:
+            full = (self.cnt[w:] - self.cnt[:-w]) == w
+            tail[~full] = np.nan
+        return out
+
+
+def rolling_means(values, windows: Iterable[int]) -> Dict[int, np.ndarray]:
+    ps = PrefixSum(values)
+    return {int(w): ps.window_mean(w) for w in windows}
+
+
+def true_range(high, low, close) -> np.ndarray:
+    h = as_f64(high)
+    l = as_f64(low)
+    c = as_f64(close)
+    tr = h - l
+    if len(tr) > 1:
+        prev = c[:-1]
+        # fmax skips NaN, like the row-wise max(axis=1) it replaces
+        np.fmax(tr[1:], np.abs(h[1:] - prev), out=tr[1:])
+        np.fmax(tr[1:], np.abs(l[1:] - prev), out=tr[1:])
+    return tr
+
+
+def atr_window(ps_tr: PrefixSum, window: int) -> np.ndarray:
+    """ATR of one window from a PrefixSum over true_range (shareable across windows)."""
+    return np.maximum(ps_tr.window_mean(window), 0.0)
+
+
+def atr_many(high, low, close, windows: Iterable[int]) -> Dict[int, np.ndarray]:
+    ps = PrefixSum(true_range(high, low, close), center=False)
+    return {int(w): atr_window(ps, w) for w in windows}
+
+
+def gains_losses(close) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-bar gain / loss of close; the first bar (no previous close) is 0 here."""
+    c = as_f64(close)
+    gain = np.zeros_like(c)
+    loss = np.zeros_like(c)
+    if len(c) > 1:
+        delta = c[1:] - c[:-1]
+        np.maximum(delta, 0.0, out=gain[1:])
+        np.minimum(delta, 0.0, out=loss[1:])
+        np.negative(loss[1:], out=loss[1:])
+    return gain, loss
+
+
+def rsi_window(ps_gain: PrefixSum, ps_loss: PrefixSum, window: int) -> np.ndarray:
+    """RSI of one window from PrefixSums over gains_losses (shareable across windows)."""
+    w = int(window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # clamp tiny negative rounding residue, like pandas does for non-negative windows
+        avg_gain = np.maximum(ps_gain.window_mean(w), 0.0)
+        avg_loss = np.maximum(ps_loss.window_mean(w), 0.0)
+        rs = avg_gain / avg_loss
+        r = 100 - (100 / (1 + rs))
+    # a full window needs w deltas, i.e. w + 1 closes
+    r[:w] = np.nan
+    return r
+
+
+def rsi_many(close, windows: Iterable[int]) -> Dict[int, np.ndarray]:
+    gain, loss = gains_losses(close)
+    ps_gain = PrefixSum(gain, center=False)
+    ps_loss = PrefixSum(loss, center=False)
+    return {int(w): rsi_window(ps_gain, ps_loss, w) for w in windows}
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+import pandas as pd
+
+from app.common.metrics import INGEST_LATENCY
+from app.common.time import now_ms, timeframe_ms
+from app.features.config import FeatureConfig
+from app.features.service import compute_features, lookback_bars
+from app.features.storage import FeatureSink
+from app.storage.bar_repo import BarRepository
+
+
+# bars per DB read; the series is streamed so memory stays bounded by this
+CHUNK_ROWS = 500_000
+
+
+@dataclass(frozen=True)
+class SeriesUpdate:
+    bars: int        # bars loaded from DB (incl. lookback)
+    features: int    # feature rows written
+    status: str      # OK / SKIP(...) ; mode is "full" or "incremental"
+    mode: str
+    # incremental runs: bar close -> its features written (ms); callers
+    # record it with observe_feature_lag (pool workers return it to the parent)
+    lag_ms: Optional[float] = None
+
+
+def observe_feature_lag(symbol: str, lag_ms: Optional[float]) -> None:
+    if lag_ms is not None:
+        INGEST_LATENCY.observe(lag_ms, "close_to_feature", symbol)
+
+
+def update_series(
+    repo: BarRepository,
+    fcfg: FeatureConfig,
+    sink: FeatureSink,
+    source: str,
+    symbol: str,
+    timeframe: str,
+    start_ts: Optional[int] = None,
+    end_ts: Optional[int] = None,
+    limit: Optional[int] = None,
+    full: bool = False,
+    chunk_rows: int = CHUNK_ROWS,
+) -> SeriesUpdate:
+    """
+    Bring one feature series up to date.
+
+    With a watermark (last bar ts already processed) and the same config
+    fingerprint, only bars after the watermark are fetched, together with the
+    `lookback_bars` bars before it that the indicators need; only the new feature
+    rows are appended. Without a watermark, after a config change, with --full,
+    or when an explicit start_ts/limit is given, the series is rebuilt.
+
+    Bars are streamed from the DB in chunks of `chunk_rows`; each chunk is
+    computed with the previous chunk's last `lookback_bars` bars as history, and
+    the watermark advances after every chunk.
+
+    compute_features errors propagate to the caller.
+    """
+    warmup = fcfg.warmup_for(timeframe)
+    fp = fcfg.fingerprint(timeframe)
+    lookback = lookback_bars(fcfg.indicators, warmup)
+    chunk_rows = max(int(chunk_rows), 2 * lookback)
+
+    wm = None
+    if not full and start_ts is None and limit is None:
+        wm = sink.read_watermark()
+        if wm is not None and wm.get("fingerprint") != fp:
+            print(f"[feature][rebuild] {symbol} {timeframe}: config changed "
+                  f"({wm.get('fingerprint')} -> {fp})", flush=True)
+            wm = None
+
+    if wm is not None:
+        wm_ts = int(wm["ts"])
+        df_hist = repo.fetch_bars_df(
+            source=source, symbol=symbol, timeframe=timeframe,
+            end_ts=wm_ts, limit=lookback, asc=False,
+        )
+        if len(df_hist) >= warmup:
+            chunks = repo.iter_bars_chunks(
+                source, symbol, timeframe,
+                start_ts=wm_ts + 1, end_ts=end_ts, chunk_rows=chunk_rows,
+            )
+            bars, written, last_ts = _stream(
+                chunks, df_hist.iloc[::-1].reset_index(drop=True),
+                fcfg, sink, fp, warmup, lookback, replace_first=False,
+            )
+            if bars == 0:
+                return SeriesUpdate(0, 0, "SKIP(up-to-date)", "incremental")
+            # live path: how long after the bar closed its features were written
+            lag = float(now_ms() - (last_ts + timeframe_ms(timeframe)))
+            return SeriesUpdate(bars + len(df_hist), written, "OK", "incremental", lag)
+        # history shorter than warmup: nothing was emitted before, rebuild
+
+    chunks = repo.iter_bars_chunks(
+        source, symbol, timeframe,
+        start_ts=start_ts, end_ts=end_ts, chunk_rows=chunk_rows, limit=limit,
+    )
+    bars, written, _ = _stream(chunks, None, fcfg, sink, fp, warmup, lookback, replace_first=True)
+    if bars == 0:
+        return SeriesUpdate(0, 0, "SKIP(bars=0)", "full")
+    return SeriesUpdate(bars, written, "OK", "full")
+
+
+def _stream(
+    chunks: Iterable[dict],
+    tail: Optional[pd.DataFrame],
+    fcfg: FeatureConfig,
+    sink: FeatureSink,
+    fp: str,
+    warmup: int,
+    lookback: int,
+    replace_first: bool,
+) -> Tuple[int, int, Optional[int]]:
+    """Compute and write features chunk by chunk. Returns (new bars read, feature rows written, last bar ts)."""
+    bars = 0
+    written = 0
+    last_ts = None
+    first = True
+    for cols in chunks:
+        df_chunk = pd.DataFrame(cols)
+        bars += len(df_chunk)
+
+        if tail is None or tail.empty:
+            df = df_chunk
+            w = warmup
+        else:
+            # every tail row is history: output starts at the first bar of the chunk
+            df = pd.concat([tail, df_chunk], ignore_index=True)
+            w = len(tail)
+
+        df_feat = compute_features(df, indicator_cfg=fcfg.indicators, warmup=w)
+        if first and replace_first:
+            written += sink.replace(df_feat)
+        else:
+            written += sink.append(df_feat)
+        last_ts = int(df_chunk["ts"].iloc[-1])
+        sink.write_watermark(last_ts, fp)
+
+        first = False
+        tail = df.iloc[-lookback:].reset_index(drop=True)
+    return bars, written, last_ts
@@ -1,10 +1,12 @@
 ﻿import argparse
 from pathlib import Path
 
+from app.common.metrics import write_textfile
 from app.features.config import load_feature_config
+from app.features.pipeline import observe_feature_lag, update_series
 from app.features.service import compute_features
-from app.features.storage import save_features_csv
-from app.storage.db import load_config
+from app.features.storage import ColumnarFeatureSink, ColumnarFeatureStore, CsvFeatureSink
+from app.storage.db import load_config, make_conn
 from app.storage.bar_repo import BarRepository
 
 
@@ -19,6 +21,7 @@ def main():
     ap.add_argument("--limit", type=int, default=None)
     ap.add_argument("--bars_csv", default=None)
     ap.add_argument("--out_csv", default=None)
+    ap.add_argument("--full", action="store_true", help="ignore the watermark and rebuild")
     args = ap.parse_args()
 
     fcfg = load_feature_config(args.config)
@@ -26,42 +29,51 @@ def main():
     timeframe = args.timeframe or (fcfg.timeframes[0] if fcfg.timeframes else "1h")
     warmup = fcfg.warmup_for(timeframe)
     indicators = fcfg.indicators
+    source = "okx"
+
+    if fcfg.out_format == "columnar" and not args.out_csv:
+        sink = ColumnarFeatureSink(ColumnarFeatureStore(fcfg.out_dir), source, symbol, timeframe)
+    else:
+        out_csv = args.out_csv or str(Path(fcfg.out_dir) / f"{symbol}_{timeframe}.features.csv")
+        sink = CsvFeatureSink(out_csv)
 
     if args.source == "csv":
         if not args.bars_csv:
             raise ValueError("--bars_csv is required when --source=csv")
         import pandas as pd
         df = pd.read_csv(args.bars_csv)
-    else:
-        cfg = load_config()
-        repo = BarRepository(cfg)
-        df = repo.fetch_bars_df(
-            symbol=symbol,
-            timeframe=timeframe,
-            start_ts=args.start_ts,
-            end_ts=args.end_ts,
-            limit=args.limit,
-            asc=True,
-        )
+        if df.empty:
+            raise RuntimeError(f"no bars loaded. source={args.source} symbol={symbol} timeframe={timeframe}")
 
-    if df.empty:
-        raise RuntimeError(f"no bars loaded. source={args.source} symbol={symbol} timeframe={timeframe}")
-
-    df_feat = compute_features(df, indicator_cfg=indicators, warmup=warmup)
-
-    out_csv = args.out_csv
-    if not out_csv:
-        out_dir = Path(fcfg.out_dir)
-        out_dir.mkdir(parents=True, exist_ok=True)
-        out_csv = str(out_dir / f"{symbol}_{timeframe}.features.csv")
+        df_feat = compute_features(df, indicator_cfg=indicators, warmup=warmup)
+        sink.replace(df_feat)
+        input_rows, output_rows, mode = len(df), len(df_feat), "full"
     else:
-        Path(out_csv).parent.mkdir(parents=True, exist_ok=True)
+        cfg = load_config()
+        conn = make_conn(cfg)
+        try:
+            up = update_series(
+                BarRepository(conn), fcfg, sink,
+                source=source,
+                symbol=symbol,
+                timeframe=timeframe,
+                start_ts=args.start_ts,
+                end_ts=args.end_ts,
+                limit=args.limit,
+                full=args.full,
+            )
+        finally:
+            conn.close()
+        observe_feature_lag(symbol, up.lag_ms)
+        write_textfile(cfg, "features_runner")
 
-    save_features_csv(df_feat, out_csv)
+        if up.status == "SKIP(bars=0)":
+            raise RuntimeError(f"no bars loaded. source={args.source} symbol={symbol} timeframe={timeframe}")
+        input_rows, output_rows, mode = up.bars, up.features, up.mode
 
     print(
-        f"[feature] source={args.source} symbol={symbol} timeframe={timeframe} "
-        f"input_rows={len(df)} warmup={warmup} output_rows={len(df_feat)} out={out_csv}"
+        f"[feature] source={args.source} symbol={symbol} timeframe={timeframe} mode={mode} "
+        f"input_rows={input_rows} warmup={warmup} output_rows={output_rows} out={sink}"
     )
 
 
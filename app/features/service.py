@@ -1,40 +1,84 @@
-﻿import pandas as pd
+﻿import math
+from dataclasses import dataclass
+from typing import List
+
+import pandas as pd
 import numpy as np
 
+from app.common.types import BarBatch
+from app.features import kernels
+
+
+@dataclass(frozen=True)
+class IndicatorParams:
+    ma_windows: List[int]
+    atr_windows: List[int]
+    rsi_windows: List[int]
+    macd_fast: int
+    macd_slow: int
+    macd_signal: int
+
+    def feature_columns(self) -> List[str]:
+        cols = [f"ma_{w}" for w in self.ma_windows]
+        cols += [f"atr_{w}" for w in self.atr_windows]
+        cols += [f"rsi_{w}" for w in self.rsi_windows]
+        cols += ["macd_dif", "macd_dea", "macd_hist"]
+        return cols
+
+
+def indicator_params(indicator_cfg: dict | None = None) -> IndicatorParams:
+    """Resolve the `indicators` section of features.yaml (with defaults)."""
+    ind = indicator_cfg or {}
+    ma_cfg = ind.get("ma", {}) or {}
+    atr_cfg = ind.get("atr", {}) or {}
+    rsi_cfg = ind.get("rsi", {}) or {}
+    macd_cfg = ind.get("macd", {}) or {}
+    return IndicatorParams(
+        ma_windows=[int(w) for w in ma_cfg.get("windows", [5, 10, 20])],
+        atr_windows=[int(w) for w in atr_cfg.get("windows", [14])],
+        rsi_windows=[int(w) for w in rsi_cfg.get("windows", [14])],
+        macd_fast=int(macd_cfg.get("fast", 12)),
+        macd_slow=int(macd_cfg.get("slow", 26)),
+        macd_signal=int(macd_cfg.get("signal", 9)),
+    )
+
 
-def _ema(series: pd.Series, span: int) -> pd.Series:
-    return series.ewm(span=span, adjust=False).mean()
+def _ema_settle_bars(span: int, tol: float = 1e-9) -> int:
+    # bars until the seed's weight (1 - alpha) ** n drops below tol
+    alpha = 2.0 / (span + 1.0)
+    return int(math.ceil(math.log(tol) / math.log(1.0 - alpha)))
 
 
-def _rsi(close: pd.Series, window: int) -> pd.Series:
-    delta = close.diff()
-    gain = delta.clip(lower=0)
-    loss = -delta.clip(upper=0)
-    avg_gain = gain.rolling(window=window, min_periods=window).mean()
-    avg_loss = loss.rolling(window=window, min_periods=window).mean()
-    rs = avg_gain / avg_loss
-    return 100 - (100 / (1 + rs))
+def lookback_bars(indicator_cfg: dict | None = None, warmup: int = 26) -> int:
+    """
+    Bars of history needed before the first output row (for incremental runs).
+    Rolling windows need their length; MACD's EMAs need enough bars for the
+    re-seeded state to converge to the full-history value.
+    """
+    p = indicator_params(indicator_cfg)
+    need = [int(warmup)]
+    need += p.ma_windows + p.atr_windows
+    need += [w + 1 for w in p.rsi_windows]
+    need.append(_ema_settle_bars(max(p.macd_fast, p.macd_slow)) + _ema_settle_bars(p.macd_signal))
+    return max(need)
 
 
-def _atr(high: pd.Series, low: pd.Series, close: pd.Series, window: int) -> pd.Series:
-    prev_close = close.shift(1)
-    tr = pd.concat([
-        (high - low),
-        (high - prev_close).abs(),
-        (low - prev_close).abs()
-    ], axis=1).max(axis=1)
-    return tr.rolling(window=window, min_periods=window).mean()
+def _ema(values: np.ndarray, span: int) -> np.ndarray:
+    return pd.Series(values, copy=False).ewm(span=span, adjust=False).mean().to_numpy()
 
 
 def compute_features(
-    df: pd.DataFrame,
+    df: pd.DataFrame | BarBatch,
     indicator_cfg: dict | None = None,
     warmup: int = 26,
 ) -> pd.DataFrame:
     """
-    Input df columns: ts, open, high, low, close, volume
+    Input df columns: ts, open, high, low, close, volume (or a BarBatch)
     Output: df with features, dropping warmup rows.
     """
+    if isinstance(df, BarBatch):
+        # zero-copy frame over the batch arrays
+        df = df.sorted().to_frame()
     if df is None or len(df) == 0:
         raise ValueError("empty bars")
 
@@ -46,50 +90,54 @@ def compute_features(
     if len(df) <= warmup:
         raise ValueError(f"not enough rows: {len(df)} <= warmup({warmup})")
 
-    x = df.sort_values("ts").copy()
+    # fetch_bars_df already returns ascending ts; only sort when needed
+    x = df if df["ts"].is_monotonic_increasing else df.sort_values("ts")
 
-    ind = indicator_cfg or {}
-    close = x["close"].astype(float)
-    high = x["high"].astype(float)
-    low = x["low"].astype(float)
+    p = indicator_params(indicator_cfg)
+    close = kernels.as_f64(x["close"].to_numpy())
+    high = kernels.as_f64(x["high"].to_numpy())
+    low = kernels.as_f64(x["low"].to_numpy())
+
+    feats = {}
 
     # ===== MA =====
-    ma_cfg = ind.get("ma", {}) or {}
-    ma_windows = ma_cfg.get("windows", [5, 10, 20])
-    for w in ma_windows:
-        w = int(w)
-        x[f"ma_{w}"] = close.rolling(window=w, min_periods=w).mean()
+    for w, v in kernels.rolling_means(close, p.ma_windows).items():
+        feats[f"ma_{w}"] = v
 
     # ===== ATR =====
-    atr_cfg = ind.get("atr", {}) or {}
-    atr_windows = atr_cfg.get("windows", [14])
-    for w in atr_windows:
-        w = int(w)
-        x[f"atr_{w}"] = _atr(high, low, close, w)
+    for w, v in kernels.atr_many(high, low, close, p.atr_windows).items():
+        feats[f"atr_{w}"] = v
 
     # ===== RSI =====
-    rsi_cfg = ind.get("rsi", {}) or {}
-    rsi_windows = rsi_cfg.get("windows", [14])
-    for w in rsi_windows:
-        w = int(w)
-        x[f"rsi_{w}"] = _rsi(close, w)
+    for w, v in kernels.rsi_many(close, p.rsi_windows).items():
+        feats[f"rsi_{w}"] = v
 
     # ===== MACD =====
-    macd_cfg = ind.get("macd", {}) or {}
-    fast = int(macd_cfg.get("fast", 12))
-    slow = int(macd_cfg.get("slow", 26))
-    signal = int(macd_cfg.get("signal", 9))
-
-    dif = _ema(close, fast) - _ema(close, slow)
-    dea = _ema(dif, signal)
-    hist = dif - dea
-    x["macd_dif"] = dif
-    x["macd_dea"] = dea
-    x["macd_hist"] = hist
-
-    # drop warmup rows and any NaN/inf
-    x = x.iloc[warmup:].copy()
-    x.replace([np.inf, -np.inf], np.nan, inplace=True)
-    x.dropna(inplace=True)
-    x.reset_index(drop=True, inplace=True)
-    return x
+    dif = _ema(close, p.macd_fast) - _ema(close, p.macd_slow)
+    dea = _ema(dif, p.macd_signal)
+    feats["macd_dif"] = dif
+    feats["macd_dea"] = dea
+    feats["macd_hist"] = dif - dea
+
+    # drop warmup rows and any NaN/inf; features go in as one float block
+    names = list(feats)
+    mat = np.empty((len(x) - warmup, len(names)), dtype=np.float64, order="F")
+    for j, k in enumerate(names):
+        mat[:, j] = feats[k][warmup:]
+
+    base = x.iloc[warmup:].drop(columns=[c for c in names if c in x.columns])
+    keep = np.isfinite(mat).all(axis=1)
+    keep &= base.replace([np.inf, -np.inf], np.nan).notna().all(axis=1).to_numpy()
+
+    if not keep.all():
+        base = base[keep]
+        mat = np.asfortranarray(mat[keep])
+
+    out = pd.concat(
+        [
+            base.reset_index(drop=True),
+            pd.DataFrame(mat, columns=names, copy=False),
+        ],
+        axis=1,
+    )
+    return out
@@ -1,7 +1,328 @@
-﻿from pathlib import Path
+﻿import json
+import os
+import shutil
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
 
 
 def save_features_csv(df, path: str):
     p = Path(path)
     p.parent.mkdir(parents=True, exist_ok=True)
     df.to_csv(p, index=False)
+
+
+def append_features_csv(df, path: str):
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(p, mode="a", header=not p.exists(), index=False)
+
+
+META_FILE = "_meta.json"
+
+
+def _month_keys(ts: np.ndarray) -> np.ndarray:
+    # ms -> "YYYY-MM" (UTC)
+    return ts.astype("datetime64[ms]").astype("datetime64[M]").astype(str)
+
+
+class ColumnarFeatureStore:
+    """
+    Append-only columnar feature store.
+
+    Layout (one raw little-endian array per column, memory-mappable):
+      {root}/{source}/{symbol}/{timeframe}/{YYYY-MM}/{column}.bin
+      {root}/{source}/{symbol}/{timeframe}/{YYYY-MM}/_meta.json
+
+    _meta.json holds the row count and column dtypes; it is replaced atomically
+    after the column files are appended, so a crash mid-append leaves trailing
+    bytes that are ignored on read and truncated on the next append.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def series_dir(self, source: str, symbol: str, timeframe: str) -> Path:
+        return self.root / source / symbol / timeframe
+
+    def drop(self, source: str, symbol: str, timeframe: str) -> None:
+        shutil.rmtree(self.series_dir(source, symbol, timeframe), ignore_errors=True)
+
+    def partitions(self, source: str, symbol: str, timeframe: str) -> List[str]:
+        d = self.series_dir(source, symbol, timeframe)
+        if not d.exists():
+            return []
+        return sorted(p.name for p in d.iterdir() if (p / META_FILE).exists())
+
+    def _read_meta(self, part_dir: Path) -> Dict:
+        with open(part_dir / META_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, part_dir: Path, meta: Dict) -> None:
+        tmp = part_dir / (META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, part_dir / META_FILE)
+
+    def columns(self, source: str, symbol: str, timeframe: str) -> Optional[List[str]]:
+        parts = self.partitions(source, symbol, timeframe)
+        if not parts:
+            return None
+        meta = self._read_meta(self.series_dir(source, symbol, timeframe) / parts[-1])
+        return list(meta["columns"])
+
+    def last_ts(self, source: str, symbol: str, timeframe: str) -> Optional[int]:
+        parts = self.partitions(source, symbol, timeframe)
+        if not parts:
+            return None
+        meta = self._read_meta(self.series_dir(source, symbol, timeframe) / parts[-1])
+        return meta.get("max_ts")
+
+    def append(self, source: str, symbol: str, timeframe: str, df: pd.DataFrame) -> int:
+        """Append rows newer than the stored last ts. Returns rows written."""
+        if df is None or len(df) == 0:
+            return 0
+        if "ts" not in df.columns:
+            raise ValueError("missing column: ts")
+
+        x = df if df["ts"].is_monotonic_increasing else df.sort_values("ts")
+        ts = x["ts"].to_numpy(dtype=np.int64)
+
+        last = self.last_ts(source, symbol, timeframe)
+        if last is not None:
+            start = int(np.searchsorted(ts, last, side="right"))
+            x = x.iloc[start:]
+            ts = ts[start:]
+        if len(x) == 0:
+            return 0
+
+        stored = self.columns(source, symbol, timeframe)
+        cols = list(x.columns)
+        if stored is not None and stored != cols:
+            raise ValueError(f"schema mismatch: stored={stored} new={cols}")
+
+        arrays = {}
+        for c in cols:
+            a = x[c].to_numpy()
+            if a.dtype.kind not in "biuf":
+                raise ValueError(f"column {c} is not numeric (dtype={a.dtype})")
+            arrays[c] = np.ascontiguousarray(a, dtype=a.dtype.newbyteorder("<"))
+
+        months = _month_keys(ts)
+        bounds = np.flatnonzero(months[1:] != months[:-1]) + 1
+        starts = np.r_[0, bounds]
+        ends = np.r_[bounds, len(ts)]
+
+        base = self.series_dir(source, symbol, timeframe)
+        for s, e in zip(starts, ends):
+            self._append_partition(base / str(months[s]), {c: a[s:e] for c, a in arrays.items()}, ts[s:e])
+        return len(ts)
+
+    def _append_partition(self, part_dir: Path, arrays: Dict[str, np.ndarray], ts: np.ndarray) -> None:
+        part_dir.mkdir(parents=True, exist_ok=True)
+        if (part_dir / META_FILE).exists():
+            meta = self._read_meta(part_dir)
+        else:
+            meta = {
+                "rows": 0,
+                "columns": {c: a.dtype.str for c, a in arrays.items()},
+                "min_ts": int(ts[0]),
+                "max_ts": None,
+            }
+
+        rows = int(meta["rows"])
+        for c, dt in meta["columns"].items():
+            path = part_dir / f"{c}.bin"
+            a = np.ascontiguousarray(arrays[c], dtype=np.dtype(dt))
+            with open(path, "ab") as f:
+                # drop bytes left behind by an interrupted append
+                f.truncate(rows * a.itemsize)
+                f.write(a.tobytes())
+
+        meta["rows"] = rows + len(ts)
+        meta["max_ts"] = int(ts[-1])
+        self._write_meta(part_dir, meta)
+
+    def read(
+        self,
+        source: str,
+        symbol: str,
+        timeframe: str,
+        columns: Optional[Sequence[str]] = None,
+        start_ts: int | None = None,
+        end_ts: int | None = None,
+    ) -> pd.DataFrame:
+        """
+        Read a column subset over [start_ts, end_ts] (ms, inclusive).
+        Only partitions overlapping the range are touched; columns are memory-mapped
+        and sliced by a binary search on ts, so unread rows are never loaded.
+        """
+        base = self.series_dir(source, symbol, timeframe)
+        first_month = str(_month_keys(np.array([start_ts], dtype=np.int64))[0]) if start_ts is not None else None
+        last_month = str(_month_keys(np.array([end_ts], dtype=np.int64))[0]) if end_ts is not None else None
+
+        frames = []
+        for part in self.partitions(source, symbol, timeframe):
+            if first_month is not None and part < first_month:
+                continue
+            if last_month is not None and part > last_month:
+                continue
+
+            part_dir = base / part
+            meta = self._read_meta(part_dir)
+            rows = int(meta["rows"])
+            if rows == 0:
+                continue
+
+            want = list(columns) if columns is not None else list(meta["columns"])
+            missing = [c for c in want if c not in meta["columns"]]
+            if missing:
+                raise KeyError(f"unknown columns: {missing}")
+
+            ts = self._memmap(part_dir, "ts", meta["columns"]["ts"], rows)
+            lo = int(np.searchsorted(ts, start_ts, side="left")) if start_ts is not None else 0
+            hi = int(np.searchsorted(ts, end_ts, side="right")) if end_ts is not None else rows
+            if hi <= lo:
+                continue
+
+            frames.append(pd.DataFrame({
+                c: np.array(self._memmap(part_dir, c, meta["columns"][c], rows)[lo:hi])
+                for c in want
+            }))
+
+        if not frames:
+            return pd.DataFrame(columns=list(columns) if columns is not None else (self.columns(source, symbol, timeframe) or []))
+        return pd.concat(frames, ignore_index=True)
+
+    def _memmap(self, part_dir: Path, column: str, dtype: str, rows: int) -> np.ndarray:
+        return np.memmap(part_dir / f"{column}.bin", dtype=np.dtype(dtype), mode="r", shape=(rows,))
+
+
+# ===== output targets with a watermark (for incremental runs) =====
+
+def _write_json_atomic(path: Path, obj: Dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+class FeatureSink(ABC):
+    """
+    Output target of one feature series, plus its watermark file:
+      {"ts": last bar ts processed, "fingerprint": FeatureConfig.fingerprint(tf)}
+
+    The watermark is written after the rows, so append() must be idempotent:
+    rows at or before the output's own last ts are skipped (a crash between
+    the two re-sends them).
+    """
+
+    watermark_path: Path
+
+    def read_watermark(self) -> Optional[Dict]:
+        if not self.watermark_path.exists():
+            return None
+        with open(self.watermark_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_watermark(self, ts: int, fingerprint: str) -> None:
+        _write_json_atomic(self.watermark_path, {
+            "ts": int(ts),
+            "fingerprint": fingerprint,
+            "updated_at": int(time.time() * 1000),
+        })
+
+    @abstractmethod
+    def reset(self) -> None:
+        """Drop all output and the watermark."""
+
+    @abstractmethod
+    def append(self, df: pd.DataFrame) -> int:
+        """Append rows newer than the output's last ts. Returns rows written."""
+
+    def replace(self, df: pd.DataFrame) -> int:
+        self.reset()
+        return self.append(df)
+
+
+class CsvFeatureSink(FeatureSink):
+    def __init__(self, path: str):
+        self.path = Path(path)
+        # data/features/okx/BTC-USDT-SWAP/1m.features.csv -> 1m.features.watermark.json
+        self.watermark_path = self.path.with_suffix(".watermark.json")
+
+    def __str__(self):
+        return str(self.path)
+
+    def reset(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.watermark_path.unlink(missing_ok=True)
+
+    def last_ts(self) -> Optional[int]:
+        """
+        ts of the last complete row in the CSV. A partial last line (crash
+        mid-write) is truncated away here.
+        """
+        if not self.path.exists():
+            return None
+        with open(self.path, "rb+") as f:
+            header = f.readline().decode("utf-8-sig").rstrip("\r\n").split(",")
+            body_start = f.tell()
+            size = f.seek(0, os.SEEK_END)
+            if size <= body_start:
+                return None
+            # read back from the end until one full line is covered
+            block = 4096
+            while True:
+                start = max(body_start, size - block)
+                f.seek(start)
+                buf = f.read(size - start)
+                if buf.count(b"\n") >= 2 or start == body_start:
+                    break
+                block *= 2
+            if not buf.endswith(b"\n"):
+                cut = buf.rfind(b"\n")
+                keep = start + cut + 1 if cut >= 0 else body_start
+                f.truncate(keep)
+                buf = buf[: max(cut + 1, 0)]
+        lines = [ln for ln in buf.split(b"\n") if ln.strip()]
+        if not lines:
+            return None
+        return int(float(lines[-1].decode("utf-8").split(",")[header.index("ts")]))
+
+    def append(self, df: pd.DataFrame) -> int:
+        if df is None or len(df) == 0:
+            return 0
+        last = self.last_ts()
+        if last is not None:
+            df = df[df["ts"].to_numpy() > last]
+            if len(df) == 0:
+                return 0
+        append_features_csv(df, str(self.path))
+        return len(df)
+
+    def replace(self, df: pd.DataFrame) -> int:
+        save_features_csv(df, str(self.path))
+        self.watermark_path.unlink(missing_ok=True)
+        return len(df)
+
+
+class ColumnarFeatureSink(FeatureSink):
+    def __init__(self, store: ColumnarFeatureStore, source: str, symbol: str, timeframe: str):
+        self.store = store
+        self.key = (source, symbol, timeframe)
+        self.watermark_path = store.series_dir(*self.key) / "_watermark.json"
+
+    def __str__(self):
+        return str(self.store.series_dir(*self.key))
+
+    def reset(self) -> None:
+        self.store.drop(*self.key)
+
+    def append(self, df: pd.DataFrame) -> int:
+        return self.store.append(*self.key, df)
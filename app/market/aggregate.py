@@ -0,0 +1,251 @@
+"""
+Timeframe aggregation (any finer -> any coarser timeframe).
+
+Buckets are computed with integer arithmetic on ms timestamps and reduced with
+NumPy `reduceat`, so there is no per-row Python. Several targets are produced
+from one pass over the source: each target is built from the coarsest
+already-built level that divides it (1m -> 5m -> 15m -> 1h -> 4h -> 1d -> 1w).
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.common.time import MS_1D, timeframe_ms
+from app.storage.bar_repo import BAR_COLS, bars_to_columns
+
+# bucket origin (ms) per timeframe; everything else is aligned to the epoch (UTC)
+# weeks start Monday 00:00 UTC (1970-01-01 was a Thursday)
+TF_OFFSET_MS = {"1w": 4 * MS_1D}
+
+
+def tf_offset(timeframe: str) -> int:
+    return TF_OFFSET_MS.get(timeframe.strip().lower(), 0)
+
+
+def bucket_start(ts: np.ndarray, step_ms: int, offset_ms: int = 0) -> np.ndarray:
+    ts = np.asarray(ts, dtype=np.int64)
+    return ts - (ts - offset_ms) % step_ms
+
+
+def aggregate_columns(
+    cols: Dict[str, np.ndarray],
+    step_ms: int,
+    offset_ms: int = 0,
+    counts: Optional[np.ndarray] = None,
+) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    cols: ascending, unique ts. Returns (bucketed columns, source bars per bucket).
+    `counts` carries the bar count of each input row when cascading levels.
+    """
+    ts = cols["ts"]
+    if len(ts) == 0:
+        return {c: a[:0] for c, a in cols.items()}, np.empty(0, dtype=np.int64)
+
+    b = bucket_start(ts, step_ms, offset_ms)
+    starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+    ends = np.r_[starts[1:], len(ts)]
+
+    out = {
+        "ts": b[starts],
+        "open": cols["open"][starts],
+        "high": np.maximum.reduceat(cols["high"], starts),
+        "low": np.minimum.reduceat(cols["low"], starts),
+        "close": cols["close"][ends - 1],
+        "volume": np.add.reduceat(cols["volume"], starts),
+    }
+    n = ends - starts if counts is None else np.add.reduceat(counts, starts)
+    return out, n
+
+
+def _slice(cols: Dict[str, np.ndarray], mask_or_slice) -> Dict[str, np.ndarray]:
+    return {c: a[mask_or_slice] for c, a in cols.items()}
+
+
+def _target_steps(source_tf: str, targets: Sequence[str]) -> Tuple[list, Dict[str, int]]:
+    src_ms = timeframe_ms(source_tf)
+    steps = {}
+    for tf in targets:
+        ms = timeframe_ms(tf)
+        if ms <= src_ms or ms % src_ms:
+            raise ValueError(f"cannot aggregate {source_tf} -> {tf}")
+        steps[tf] = ms
+    return sorted(steps, key=lambda tf: steps[tf]), steps
+
+
+@dataclass
+class TargetStats:
+    bars: int = 0
+    incomplete: int = 0     # buckets with fewer source bars than expected
+    last_ts: Optional[int] = None
+
+
+class MultiAggregator:
+    """
+    Streaming multi-target aggregator over ascending source chunks.
+
+    push() returns, per target, only buckets that are closed (the source has
+    data up to the bucket's end) and not emitted before. Source rows of the
+    still-open bucket of the coarsest target are carried into the next chunk,
+    so chunk boundaries never split a bucket.
+    """
+
+    def __init__(self, source_tf: str, targets: Sequence[str]):
+        self.source_tf = source_tf
+        self.src_ms = timeframe_ms(source_tf)
+        # finest first, so each level can be built from a finer one
+        self.order, self.steps = _target_steps(source_tf, targets)
+        steps = self.steps
+        self.plan: Dict[str, Optional[str]] = {}
+        for i, tf in enumerate(self.order):
+            base = None
+            for prev in reversed(self.order[:i]):
+                if steps[tf] % steps[prev] == 0 and (tf_offset(tf) - tf_offset(prev)) % steps[prev] == 0:
+                    base = prev
+                    break
+            self.plan[tf] = base
+        self.stats = {tf: TargetStats() for tf in self.order}
+        self._carry: Optional[Dict[str, np.ndarray]] = None
+        self._emitted: Dict[str, Optional[int]] = {tf: None for tf in self.order}
+
+    def _build(self, cols: Dict[str, np.ndarray]) -> Dict[str, Tuple[Dict[str, np.ndarray], np.ndarray]]:
+        levels = {}
+        for tf in self.order:
+            base = self.plan[tf]
+            if base is None:
+                levels[tf] = aggregate_columns(cols, self.steps[tf], tf_offset(tf))
+            else:
+                bcols, bn = levels[base]
+                levels[tf] = aggregate_columns(bcols, self.steps[tf], tf_offset(tf), counts=bn)
+        return levels
+
+    def _emit(self, levels, covered_until: Optional[int]) -> Dict[str, Dict[str, np.ndarray]]:
+        out = {}
+        for tf in self.order:
+            cols, n = levels[tf]
+            step = self.steps[tf]
+            keep = np.ones(len(cols["ts"]), dtype=bool)
+            if covered_until is not None:
+                keep &= cols["ts"] + step <= covered_until
+            if self._emitted[tf] is not None:
+                keep &= cols["ts"] > self._emitted[tf]
+            if not keep.any():
+                continue
+            cols = _slice(cols, keep)
+            n = n[keep]
+            st = self.stats[tf]
+            st.bars += len(n)
+            st.incomplete += int((n < step // self.src_ms).sum())
+            st.last_ts = int(cols["ts"][-1])
+            self._emitted[tf] = st.last_ts
+            out[tf] = cols
+        return out
+
+    def push(self, data) -> Dict[str, Dict[str, np.ndarray]]:
+        cols = bars_to_columns(data)
+        if self._carry is not None and len(self._carry["ts"]):
+            cols = {c: np.concatenate([self._carry[c], cols[c]]) for c in BAR_COLS}
+        if len(cols["ts"]) == 0:
+            return {}
+        ts = cols["ts"]
+        if len(ts) > 1 and not (ts[1:] > ts[:-1]).all():
+            # sort, duplicate ts keep the last row
+            order = np.argsort(ts, kind="stable")
+            ts_sorted = ts[order]
+            cols = _slice(cols, order[np.r_[ts_sorted[1:] != ts_sorted[:-1], True]])
+
+        levels = self._build(cols)
+        # the source covers every bucket that ends at or before last ts + one source bar
+        out = self._emit(levels, int(cols["ts"][-1]) + self.src_ms)
+
+        coarse = self.order[-1]
+        open_from = int(bucket_start(cols["ts"][-1:], self.steps[coarse], tf_offset(coarse))[0])
+        i = int(np.searchsorted(cols["ts"], open_from, side="left"))
+        self._carry = _slice(cols, slice(i, None))
+        return out
+
+    def finish(self, include_partial: bool = False) -> Dict[str, Dict[str, np.ndarray]]:
+        """Emit the open buckets left at the end of the stream (only with include_partial)."""
+        carry, self._carry = self._carry, None
+        if not include_partial or carry is None or len(carry["ts"]) == 0:
+            return {}
+        return self._emit(self._build(carry), None)
+
+
+def aggregate_bars(data, source_tf: str, targets: Iterable[str], include_partial: bool = False) -> Dict[str, Dict[str, np.ndarray]]:
+    """One-shot helper: all closed buckets of every target for an in-memory series."""
+    agg = MultiAggregator(source_tf, list(targets))
+    out = agg.push(data)
+    for tf, cols in agg.finish(include_partial).items():
+        out[tf] = {c: np.concatenate([out[tf][c], cols[c]]) for c in BAR_COLS} if tf in out else cols
+    return out
+
+
+# ===== live rollups (one closed source bar at a time) =====
+
+@dataclass
+class RollupBar:
+    timeframe: str
+    ts: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    n: int          # source bars in the bucket
+
+    def row(self) -> tuple:
+        return (self.ts, self.open, self.high, self.low, self.close, self.volume)
+
+
+class LiveRollup:
+    """
+    Rolling coarser bars of one series, updated on every closed source bar.
+
+    update() returns the buckets that closed: either the source bar that ends
+    a bucket arrived, or a bar of a later bucket arrived (the stream skipped
+    the end of the previous one). After a restart, feed the source bars from
+    recover_from(latest source ts) on; that is the open bucket of the coarsest
+    target, the only state that is lost.
+    """
+
+    def __init__(self, source_tf: str, targets: Sequence[str]):
+        self.source_tf = source_tf
+        self.src_ms = timeframe_ms(source_tf)
+        self.order, self.steps = _target_steps(source_tf, targets)
+        self.current: Dict[str, Optional[RollupBar]] = {tf: None for tf in self.order}
+        self.last_ts: Optional[int] = None
+
+    def recover_from(self, latest_ts: int) -> int:
+        coarse = self.order[-1]
+        return int(latest_ts - (latest_ts - tf_offset(coarse)) % self.steps[coarse])
+
+    def update(self, ts: int, open: float, high: float, low: float, close: float, volume: float) -> list:
+        ts = int(ts)
+        if self.last_ts is not None and ts <= self.last_ts:
+            return []
+        self.last_ts = ts
+
+        closed = []
+        for tf in self.order:
+            step = self.steps[tf]
+            b = ts - (ts - tf_offset(tf)) % step
+            cur = self.current[tf]
+            if cur is not None and cur.ts != b:
+                closed.append(cur)
+                cur = None
+            if cur is None:
+                cur = RollupBar(tf, b, open, high, low, close, volume, 1)
+            else:
+                cur.high = max(cur.high, high)
+                cur.low = min(cur.low, low)
+                cur.close = close
+                cur.volume += volume
+                cur.n += 1
+            if ts + self.src_ms >= b + step:
+                closed.append(cur)
+                cur = None
+            self.current[tf] = cur
+        return closed
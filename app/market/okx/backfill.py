@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.common.time import timeframe_ms
+from app.market.okx.client import OKXMarketClient, to_okx_bar
+from app.market.okx.normalizer import OKXNormalizer
+from app.storage.bar_repo import BarRepository, BAR_COLS
+
+# OKX public market data limits (per IP): requests / 2s
+OKX_RATE_LIMITS = {
+    "candles": 40 / 2.0,
+    "history-candles": 20 / 2.0,
+}
+OKX_PAGE_LIMIT = {
+    "candles": 300,
+    "history-candles": 100,
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError(f"rate must be > 0, got {rate}")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, n: float = 1.0) -> float:
+        """Block until n tokens are available. Returns seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return waited
+                need = (n - self._tokens) / self.rate
+            time.sleep(need)
+            waited += need
+
+
+@dataclass(frozen=True)
+class FetchRange:
+    """Bars of one series to fetch: start_ts <= ts < end_ts."""
+    symbol: str
+    timeframe: str
+    start_ts: int
+    end_ts: int
+
+
+@dataclass
+class SeriesProgress:
+    symbol: str
+    timeframe: str
+    windows: int = 0
+    windows_done: int = 0
+    windows_failed: int = 0
+    pages: int = 0
+    fetched: int = 0     # confirmed bars received
+    written: int = 0     # bars sent to the DB
+    inserted: int = 0
+    updated: int = 0
+    oldest_ts: Optional[int] = None
+    newest_ts: Optional[int] = None
+
+    def add_bars(self, ts: np.ndarray) -> None:
+        self.fetched += len(ts)
+        lo, hi = int(ts.min()), int(ts.max())
+        self.oldest_ts = lo if self.oldest_ts is None else min(self.oldest_ts, lo)
+        self.newest_ts = hi if self.newest_ts is None else max(self.newest_ts, hi)
+
+
+def split_windows(start_ts: int, end_ts: int, step_ms: int, window_bars: int) -> List[Tuple[int, int]]:
+    """[start, end) -> [(ws, we), ...] newest first, each at most window_bars bars."""
+    span = step_ms * max(1, int(window_bars))
+    out = []
+    we = end_ts
+    while we > start_ts:
+        ws = max(start_ts, we - span)
+        out.append((ws, we))
+        we = ws
+    return out
+
+
+def _pages(bars: int, page_limit: int) -> int:
+    return -(-bars // page_limit)
+
+
+def plan_fill_ranges(
+    symbol: str,
+    timeframe: str,
+    gaps: Sequence[Tuple[int, int]],
+    page_limit: int = OKX_PAGE_LIMIT["history-candles"],
+) -> List[FetchRange]:
+    """
+    Merge missing-bar runs [(first_missing_ts, last_missing_ts), ...] of one
+    series into the fewest paged requests.
+
+    Two neighbouring runs are fetched as one range when paging across the
+    bars between them costs no more requests than paging each run alone;
+    the stored bars in between are re-received and left untouched by the
+    merge (unchanged rows are not rewritten).
+    """
+    step = timeframe_ms(timeframe)
+    out: List[FetchRange] = []
+    cur_first = cur_last = None
+    for first, last in sorted(gaps):
+        if cur_first is None:
+            cur_first, cur_last = first, last
+            continue
+        alone = _pages((cur_last - cur_first) // step + 1, page_limit) + _pages((last - first) // step + 1, page_limit)
+        merged = _pages((max(last, cur_last) - cur_first) // step + 1, page_limit)
+        if merged <= alone:
+            cur_last = max(cur_last, last)
+        else:
+            out.append(FetchRange(symbol, timeframe, cur_first, cur_last + step))
+            cur_first, cur_last = first, last
+    if cur_first is not None:
+        out.append(FetchRange(symbol, timeframe, cur_first, cur_last + step))
+    return out
+
+
+def rows_to_columns(rows: list, normalizer: OKXNormalizer, confirmed_only: bool) -> Dict[str, np.ndarray]:
+    """Raw OKX candle rows (strings) -> column arrays, without building Bar objects."""
+    return normalizer.to_batch("", "", rows, confirmed_only=confirmed_only).columns()
+
+
+class BackfillCancelled(Exception):
+    """Raised inside a worker when the run was aborted."""
+
+
+class BackfillEngine:
+    """
+    Concurrent history fetcher.
+
+    Each FetchRange is split into windows of `window_bars` bars. Worker threads
+    page backwards through a window with the `after` cursor; every request first
+    takes a token from the endpoint's bucket, so the whole run stays under the
+    OKX limit no matter how many workers or series are active.
+
+    Pages go through a bounded queue to the calling thread, which batches them
+    per series into BarRepository.bulk_upsert_bars calls of ~`batch_rows`.
+    Finished windows are counted from the futures, not through the queue, so
+    nothing but workers ever blocks on it. If the writer fails, the run is
+    cancelled: workers stop at their next page, the queue is drained until
+    they exit, and the error is re-raised.
+    Progress is counted in memory (SeriesProgress); the DB is never re-counted.
+    """
+
+    def __init__(
+        self,
+        client: OKXMarketClient,
+        repo: BarRepository,
+        workers: int = 8,
+        history: bool = True,
+        rate: Optional[float] = None,
+        page_limit: Optional[int] = None,
+        window_bars: int = 2000,
+        batch_rows: int = 20_000,
+        confirmed_only: bool = True,
+        max_retries: int = 5,
+        source: str = "okx",
+        progress_seconds: float = 5.0,
+        normalizer: Optional[OKXNormalizer] = None,
+    ):
+        endpoint = "history-candles" if history else "candles"
+        self.client = client
+        self.repo = repo
+        self.workers = max(1, int(workers))
+        self.history = history
+        r = rate if rate is not None else OKX_RATE_LIMITS[endpoint]
+        self.bucket = TokenBucket(r, capacity=r)
+        self.page_limit = min(int(page_limit or OKX_PAGE_LIMIT[endpoint]), OKX_PAGE_LIMIT[endpoint])
+        self.window_bars = window_bars
+        self.batch_rows = batch_rows
+        self.confirmed_only = confirmed_only
+        self.max_retries = max_retries
+        self.source = source
+        self.progress_seconds = progress_seconds
+        self.normalizer = normalizer or OKXNormalizer()
+
+        self.requests = 0
+        self.throttled_s = 0.0
+        self._stats_lock = threading.Lock()
+
+    # ===== worker side =====
+
+    def _get_page(self, symbol: str, bar: str, after: int, cancel: threading.Event) -> list:
+        for attempt in range(self.max_retries + 1):
+            if cancel.is_set():
+                raise BackfillCancelled()
+            waited = self.bucket.acquire()
+            with self._stats_lock:
+                self.requests += 1
+                self.throttled_s += waited
+            try:
+                # the engine owns retries so every attempt goes through the bucket
+                return self.client.fetch_candles(
+                    inst_id=symbol, bar=bar, limit=self.page_limit,
+                    after=after, history=self.history, retry=False,
+                )
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"[backfill][retry] {symbol} {bar} after={after} in {delay:.1f}s: {e}", flush=True)
+                if cancel.wait(delay):
+                    raise BackfillCancelled()
+        return []
+
+    @staticmethod
+    def _put(out: "queue.Queue", item, cancel: threading.Event) -> None:
+        # never block forever on a full queue: the consumer may be gone
+        while True:
+            try:
+                out.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if cancel.is_set():
+                    raise BackfillCancelled() from None
+
+    def _fetch_window(self, key: Tuple[str, str], ws: int, we: int, out: "queue.Queue",
+                      cancel: threading.Event) -> int:
+        symbol, timeframe = key
+        bar = to_okx_bar(timeframe)
+        after = we
+        pages = 0
+        while after > ws:
+            rows = self._get_page(symbol, bar, after, cancel)
+            pages += 1
+            if not rows:
+                break
+            cols = rows_to_columns(rows, self.normalizer, self.confirmed_only)
+            keep = cols["ts"] >= ws
+            if not keep.all():
+                cols = {c: a[keep] for c, a in cols.items()}
+            self._put(out, (key, cols), cancel)
+
+            oldest = min(int(r[0]) for r in rows)
+            if oldest >= after:
+                break    # no progress: never loop on a stuck cursor
+            after = oldest
+        return pages
+
+    # ===== writer side =====
+
+    def run(self, ranges: Sequence[FetchRange]) -> Dict[Tuple[str, str], SeriesProgress]:
+        progress: Dict[Tuple[str, str], SeriesProgress] = {}
+        jobs = []
+        for r in ranges:
+            key = (r.symbol, r.timeframe)
+            p = progress.setdefault(key, SeriesProgress(r.symbol, r.timeframe))
+            wins = split_windows(r.start_ts, r.end_ts, timeframe_ms(r.timeframe), self.window_bars)
+            p.windows += len(wins)
+            jobs.extend((key, ws, we) for ws, we in wins)
+
+        # interleave series so every symbol advances from the first second
+        jobs.sort(key=lambda j: -j[2])
+
+        pending: Dict[Tuple[str, str], List[Dict[str, np.ndarray]]] = {k: [] for k in progress}
+        pending_rows = {k: 0 for k in progress}
+        out: "queue.Queue" = queue.Queue(maxsize=self.workers * 8)
+        t0 = time.monotonic()
+        last_report = t0
+
+        def flush(key):
+            if pending_rows[key] == 0:
+                return
+            cols = {c: np.concatenate([p[c] for p in pending[key]]) for c in BAR_COLS}
+            res = self.repo.bulk_upsert_bars(key[0], key[1], cols, source=self.source)
+            p = progress[key]
+            p.written += res.rows
+            p.inserted += res.inserted
+            p.updated += res.updated
+            pending[key] = []
+            pending_rows[key] = 0
+
+        cancel = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="backfill")
+        live = {}
+        try:
+            for key, ws, we in jobs:
+                live[pool.submit(self._fetch_window, key, ws, we, out, cancel)] = key
+
+            # run until every window finished and its pages are consumed
+            while live or not out.empty():
+                try:
+                    key, cols = out.get(timeout=0.2)
+                except queue.Empty:
+                    pass
+                else:
+                    p = progress[key]
+                    p.pages += 1
+                    if len(cols["ts"]):
+                        p.add_bars(cols["ts"])
+                        pending[key].append(cols)
+                        pending_rows[key] += len(cols["ts"])
+                        if pending_rows[key] >= self.batch_rows:
+                            flush(key)
+
+                done, _ = wait(list(live), timeout=0)
+                for fut in done:
+                    key = live.pop(fut)
+                    p = progress[key]
+                    p.windows_done += 1
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        p.windows_failed += 1
+                        print(f"[backfill][fail] {key[0]} {key[1]}: {e}", flush=True)
+
+                now = time.monotonic()
+                if now - last_report >= self.progress_seconds:
+                    last_report = now
+                    self._report(progress, now - t0)
+
+            for key in progress:
+                flush(key)
+        except BaseException:
+            # stop the workers and keep the queue moving until they exit
+            cancel.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            while any(not f.done() for f in live):
+                try:
+                    out.get(timeout=0.2)
+                except queue.Empty:
+                    pass
+            raise
+        finally:
+            pool.shutdown(wait=True)
+
+        self._report(progress, time.monotonic() - t0)
+        return progress
+
+    def _report(self, progress: Dict[Tuple[str, str], SeriesProgress], elapsed: float) -> None:
+        fetched = sum(p.fetched for p in progress.values())
+        done = sum(p.windows_done for p in progress.values())
+        total = sum(p.windows for p in progress.values())
+        print(
+            f"[backfill] {elapsed:7.1f}s windows={done}/{total} requests={self.requests} "
+            f"({self.requests / max(elapsed, 1e-9):.1f}/s, throttled {self.throttled_s:.1f}s) "
+            f"bars={fetched} ({fetched / max(elapsed, 1e-9):.0f}/s)",
+            flush=True,
+        )
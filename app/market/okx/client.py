@@ -1,37 +1,108 @@
-﻿import requests
+﻿import asyncio
+import random
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.common.types import BAR_FIELDS, BarBatch
+from app.market.okx.normalizer import OKXNormalizer
+
+# OKX codes worth retrying: 50011 rate limit, 50001/50004/50013 service busy / timeout
+RETRY_CODES = {"50001", "50004", "50011", "50013"}
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class OKXAPIError(RuntimeError):
+    def __init__(self, code, msg, status: Optional[int] = None):
+        super().__init__(f"OKX error: code={code} msg={msg}" + (f" http={status}" if status else ""))
+        self.code = code
+        self.status = status
+
+
+def to_okx_bar(timeframe: str) -> str:
+    # OKX uses "1H", "5m", etc. It is case-insensitive in practice, but keep canonical.
+    tf = timeframe.strip()
+    # accept "1h" / "1H"
+    if tf.lower().endswith("h"):
+        return tf[:-1] + "H"
+    if tf.lower().endswith("m"):
+        return tf[:-1] + "m"
+    if tf.lower().endswith("d"):
+        return tf[:-1] + "D"
+    if tf.lower().endswith("w"):
+        return tf[:-1] + "W"
+    if tf.lower().endswith("mo"):
+        return tf[:-2] + "M"
+    return tf
+
 
 class OKXMarketClient:
     """
-    Minimal OKX public market client.
+    OKX public market client (candles / history-candles).
 
-    fetch_ohlcv(symbol, timeframe, limit) -> list[list]:
-        returns rows: [ts_ms, open, high, low, close, volume]
+    fetch_candles()  one raw page (newest first)
+    iter_candles()   pages through [start_ts, end_ts), newest page first
+    fetch_range()    the whole range as one ascending BarBatch
+    fetch_ohlcv(symbol, timeframe, limit) -> BarBatch:
+        rows: [ts_ms, open, high, low, close, volume]
+
+    One keep-alive Session with a connection pool of `pool_size` is shared
+    by all threads using the client. 429 / 5xx / OKX busy codes and network
+    errors are retried with jittered exponential backoff (Retry-After is
+    honoured). An optional `limiter` (anything with .acquire(), e.g.
+    backfill.TokenBucket) is taken before every request, retries included.
     """
 
     BASE_URL = "https://www.okx.com"
+    PAGE_LIMIT = {"candles": 300, "history-candles": 100}
 
-    def __init__(self, timeout=10):
+    def __init__(
+        self,
+        timeout=10,
+        base_url: str | None = None,
+        pool_size: int = 16,
+        max_retries: int = 4,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        limiter=None,
+    ):
         self.timeout = timeout
+        self.base_url = (base_url or self.BASE_URL).rstrip("/")
+        self.max_retries = int(max_retries)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.limiter = limiter
+        self.pool_size = int(pool_size)
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": "quant-app/1.0"})
+        # keep-alive: reuse up to pool_size connections per host across threads
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.normalizer = OKXNormalizer()
+
+        self.requests = 0
+        self.retries = 0
+
+    @classmethod
+    def from_config(cls, cfg: dict, **kw) -> "OKXMarketClient":
+        """local.yaml market: base_url / timeout / pool_size / max_retries"""
+        m = (cfg or {}).get("market") or {}
+        for k in ("base_url", "timeout", "pool_size", "max_retries"):
+            if m.get(k) is not None:
+                kw.setdefault(k, m[k])
+        return cls(**kw)
+
+    def close(self):
+        self.session.close()
 
     def _bar_to_okx(self, timeframe: str) -> str:
-        # OKX uses "1H", "5m", etc. It is case-insensitive in practice, but keep canonical.
-        tf = timeframe.strip()
-        # accept "1h" / "1H"
-        if tf.lower().endswith("h"):
-            return tf[:-1] + "H"
-        if tf.lower().endswith("m"):
-            return tf[:-1] + "m"
-        if tf.lower().endswith("d"):
-            return tf[:-1] + "D"
-        if tf.lower().endswith("w"):
-            return tf[:-1] + "W"
-        if tf.lower().endswith("mo"):
-            return tf[:-2] + "M"
-        return tf
-
-    def fetch_ohlcv(self, symbol: str, timeframe: str = "1h", limit: int = 100):
+        return to_okx_bar(timeframe)
+
+    def fetch_ohlcv(self, symbol: str, timeframe: str = "1h", limit: int = 100) -> BarBatch:
         """
         Fetch recent candles from OKX public REST API.
 
@@ -46,30 +117,179 @@ class OKXMarketClient:
 
         Returns
         -------
-        list[list]
-            [ [ts_ms, open, high, low, close, volume], ... ] sorted ascending by ts
+        BarBatch
+            sorted ascending by ts; iterating yields (ts, open, high, low, close, volume) rows
         """
         bar = self._bar_to_okx(timeframe)
 
-        url = f"{self.BASE_URL}/api/v5/market/candles"
-        params = {"instId": symbol, "bar": bar, "limit": str(int(limit))}
+        data = self.fetch_candles(inst_id=symbol, bar=bar, limit=limit)
+        # OKX returns newest-first; to_batch parses in bulk and sorts ascending
+        return self.normalizer.to_batch(symbol, timeframe, data)
+
+    def fetch_candles(
+        self,
+        inst_id: str,
+        bar: str,
+        limit: int = 100,
+        after: int | None = None,
+        before: int | None = None,
+        history: bool = False,
+        retry: bool = True,
+    ) -> list:
+        """
+        One page of raw OKX candles, newest first:
+          [[ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm], ...]  (strings)
+
+        after  : only bars with ts < after  (page towards the past)
+        before : only bars with ts > before
+        history: /history-candles (full history, max 100 per page)
+                 instead of /candles (recent bars only, max 300 per page)
+        retry  : False = single attempt (callers with their own retry loop)
+        """
+        path = "/api/v5/market/history-candles" if history else "/api/v5/market/candles"
+        params = {"instId": inst_id, "bar": bar, "limit": str(int(limit))}
+        if after is not None:
+            params["after"] = str(int(after))
+        if before is not None:
+            params["before"] = str(int(before))
+        return self._get(path, params, retry=retry)
+
+    def _get(self, path: str, params: dict, retry: bool = True) -> list:
+        attempts = self.max_retries + 1 if retry else 1
+        for attempt in range(attempts):
+            if self.limiter is not None:
+                self.limiter.acquire()
+            self.requests += 1
+            retry_after = None
+            try:
+                r = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+                if r.status_code in RETRY_STATUS:
+                    retry_after = r.headers.get("Retry-After")
+                    raise OKXAPIError(None, r.reason, status=r.status_code)
+                r.raise_for_status()
+                payload = r.json()
+                code = payload.get("code")
+                if code not in (None, "0"):
+                    raise OKXAPIError(code, payload.get("msg"), status=r.status_code)
+                return payload.get("data", [])
+            except (requests.ConnectionError, requests.Timeout, OKXAPIError) as e:
+                retriable = not isinstance(e, OKXAPIError) or e.status in RETRY_STATUS or e.code in RETRY_CODES
+                if not retriable or attempt + 1 >= attempts:
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                self.retries += 1
+                print(f"[okx][retry] {path} {params.get('instId')} in {delay:.1f}s: {e}", flush=True)
+                time.sleep(delay)
+        return []
+
+    def iter_candles(
+        self,
+        inst_id: str,
+        bar: str,
+        start_ts: int,
+        end_ts: Optional[int] = None,
+        history: Optional[bool] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[list]:
+        """
+        Raw pages covering start_ts <= ts < end_ts (end_ts None = now), walking
+        back from end_ts with the `after` cursor. Rows older than start_ts are
+        dropped. history=None starts on /candles and switches to
+        /history-candles once the recent endpoint runs dry.
+        """
+        use_history = bool(history)
+        after = int(end_ts) if end_ts is not None else None
+        while after is None or after > start_ts:
+            endpoint = "history-candles" if use_history else "candles"
+            page_limit = min(int(limit or self.PAGE_LIMIT[endpoint]), self.PAGE_LIMIT[endpoint])
+            rows = self.fetch_candles(inst_id, bar, limit=page_limit, after=after, history=use_history)
+            if not rows:
+                if history is None and not use_history:
+                    use_history = True
+                    continue
+                return
+            oldest = min(int(r[0]) for r in rows)
+            keep = [r for r in rows if int(r[0]) >= start_ts]
+            if keep:
+                yield keep
+            if after is not None and oldest >= after:
+                return    # cursor did not move
+            after = oldest
+
+    def fetch_range(
+        self,
+        symbol: str,
+        timeframe: str,
+        start_ts: int,
+        end_ts: Optional[int] = None,
+        history: Optional[bool] = None,
+        confirmed_only: bool = True,
+    ) -> BarBatch:
+        """All bars of [start_ts, end_ts) as one ascending BarBatch."""
+        pages = [
+            self.normalizer.to_batch(symbol, timeframe, rows, confirmed_only=confirmed_only)
+            for rows in self.iter_candles(symbol, to_okx_bar(timeframe), start_ts, end_ts, history=history)
+        ]
+        return _concat(symbol, timeframe, pages)
+
+
+def _concat(symbol: str, timeframe: str, pages: list) -> BarBatch:
+    if not pages:
+        return BarBatch.empty(symbol, timeframe)
+    cols = {c: np.concatenate([getattr(p, c) for p in pages]) for c in BAR_FIELDS}
+    return BarBatch.from_columns(symbol, timeframe, cols).sorted()
+
+
+class AsyncOKXMarketClient:
+    """
+    asyncio front for OKXMarketClient.
+
+    Requests run on worker threads over the same pooled keep-alive session
+    (no extra HTTP dependency); at most `concurrency` are in flight, so many
+    series can be paged concurrently from one event loop.
+    """
 
-        r = self.session.get(url, params=params, timeout=self.timeout)
-        r.raise_for_status()
-        payload = r.json()
+    def __init__(self, client: Optional[OKXMarketClient] = None, concurrency: Optional[int] = None, **kw):
+        self.client = client or OKXMarketClient(**kw)
+        self._sem = asyncio.Semaphore(concurrency or self.client.pool_size)
 
-        if payload.get("code") not in (None, "0"):
-            raise RuntimeError(f"OKX error: code={payload.get('code')} msg={payload.get('msg')}")
+    async def fetch_candles(self, inst_id: str, bar: str, **kw) -> list:
+        async with self._sem:
+            return await asyncio.to_thread(self.client.fetch_candles, inst_id, bar, **kw)
 
-        data = payload.get("data", [])
-        rows = []
-        for item in data:
-            # item: [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]
-            ts = int(float(item[0]))
-            o = float(item[1]); h = float(item[2]); l = float(item[3]); c = float(item[4])
-            v = float(item[5]) if len(item) > 5 and item[5] is not None else 0.0
-            rows.append([ts, o, h, l, c, v])
+    async def iter_candles(
+        self,
+        inst_id: str,
+        bar: str,
+        start_ts: int,
+        end_ts: Optional[int] = None,
+        history: Optional[bool] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[list]:
+        it = self.client.iter_candles(inst_id, bar, start_ts, end_ts, history=history, limit=limit)
+        done = object()
+        while True:
+            async with self._sem:
+                rows = await asyncio.to_thread(next, it, done)
+            if rows is done:
+                return
+            yield rows
 
-        # OKX returns newest-first; normalize to ascending
-        rows.sort(key=lambda x: x[0])
-        return rows
+    async def fetch_range(
+        self,
+        symbol: str,
+        timeframe: str,
+        start_ts: int,
+        end_ts: Optional[int] = None,
+        history: Optional[bool] = None,
+        confirmed_only: bool = True,
+    ) -> BarBatch:
+        pages = []
+        async for rows in self.iter_candles(symbol, to_okx_bar(timeframe), start_ts, end_ts, history=history):
+            pages.append(self.client.normalizer.to_batch(symbol, timeframe, rows, confirmed_only=confirmed_only))
+        return _concat(symbol, timeframe, pages)
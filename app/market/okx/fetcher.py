@@ -1,8 +1,8 @@
 ﻿from __future__ import annotations
 
-from typing import List, Optional
+from typing import Optional
 
-from app.common.types import Bar
+from app.common.types import BarBatch
 from app.market.okx.client import OKXMarketClient
 from app.market.okx.normalizer import OKXNormalizer
 
@@ -22,7 +22,7 @@ class MarketFetcher:
         before: Optional[int] = None,
         history: bool = False,
         confirmed_only: bool = True,
-    ) -> List[Bar]:
+    ) -> BarBatch:
         rows = self.client.fetch_candles(
             inst_id=symbol,
             bar=bar,
@@ -32,9 +32,5 @@ class MarketFetcher:
             history=history,
         )
 
-        if confirmed_only:
-            rows = [r for r in rows if self.normalizer.is_confirmed(r)]
-
-        bars = [self.normalizer.to_bar(symbol, timeframe, r) for r in rows]
-        bars.sort(key=lambda b: b.ts)
-        return bars
+        # ascending, one columnar batch (iterating it yields Bar-like rows)
+        return self.normalizer.to_batch(symbol, timeframe, rows, confirmed_only=confirmed_only)
@@ -1,11 +1,13 @@
 ﻿import time
 
+from app.common.metrics import serve_from_config
 from app.market.okx.client import OKXMarketClient
 from app.market.okx.streamer import IncrementalStreamer
 
+from app.storage.bar_cache import BarCache
 from app.storage.bar_repo import BarRepository
-from app.storage.heartbeat_repo import HeartbeatRepository
-from app.storage.db import load_config, make_conn
+from app.storage.heartbeat_repo import HeartbeatRepository, HeartbeatService
+from app.storage.db import close_pool, get_pool, load_config
 
 
 def main():
@@ -19,15 +21,19 @@ def main():
 
     service_name = f"main_data_runner:{symbol}:{timeframe}"
 
-    # ===== DB connection (关键修复点) =====
-    conn = make_conn(cfg)
+    # /metrics（close_to_commit 等；local.yaml: metrics.ports.main_data_runner）
+    serve_from_config(cfg, "main_data_runner")
 
-    # ===== repositories（只吃 conn）=====
-    repo = BarRepository(conn)
-    hb = HeartbeatRepository(conn, source="okx")
+    # ===== DB connection pool (sized by database.pool in local.yaml) =====
+    pool = get_pool(cfg)
 
-    # ===== market client =====
-    client = OKXMarketClient()
+    # ===== repositories（吃 conn 或 pool）=====
+    repo = BarRepository(pool)
+    # 心跳：内存里记，后台定时 upsert 一行
+    hb = HeartbeatService(HeartbeatRepository(pool, source="okx")).start()
+
+    # ===== market client (local.yaml market.base_url / pool_size / max_retries) =====
+    client = OKXMarketClient.from_config(cfg)
 
     # ===== streamer =====
     streamer = IncrementalStreamer(
@@ -35,6 +41,8 @@ def main():
         repo=repo,
         poll_seconds=int(data_cfg.get("poll_seconds", 60)),
         on_heartbeat=lambda: hb.beat(service_name),
+        # 新收盘的 bar 同时进进程内缓存（local.yaml: cache）
+        cache=BarCache.from_config(repo, cfg),
     )
 
     try:
@@ -47,7 +55,8 @@ def main():
     except KeyboardInterrupt:
         print("[runner] KeyboardInterrupt received, exiting gracefully.")
     finally:
-        conn.close()
+        hb.close()
+        close_pool()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,34 @@
 ﻿import asyncio
 import time
 
+from app.common.metrics import INGEST_LATENCY, REGISTRY, serve_from_config
+from app.common.time import timeframe_ms
+from app.market.aggregate import LiveRollup
 from app.market.okx.ws_client import OKXWSClient
+from app.storage.bar_cache import BarCache
 from app.storage.bar_repo import BarRepository
-from app.storage.heartbeat_repo import HeartbeatRepository
-from app.storage.db import load_config, make_conn
+from app.storage.bar_writer import BarWriter
+from app.storage.heartbeat_repo import HeartbeatRepository, HeartbeatService
+from app.storage.db import close_pool, get_pool, load_config
 
 
-
-SYMBOL = "BTC-USDT-SWAP"
 TIMEFRAME = "1m"  # 存库用的 timeframe
+ROLLUP_TIMEFRAMES = ("5m", "15m", "1h", "4h")  # 由 1m 实时合成，收盘即落库
+WRITER_STATS_EVERY_MS = 60_000  # 写库队列指标打印间隔
 
 
 def now_ms() -> int:
     return int(time.time() * 1000)
 
 
+def ws_symbols(cfg: dict) -> list:
+    # local.yaml: ws.symbols（多合约共用少量连接）；没配就用 data.symbol
+    syms = (cfg.get("ws") or {}).get("symbols")
+    if not syms:
+        syms = [(cfg.get("data") or {}).get("symbol", "BTC-USDT-SWAP")]
+    return list(dict.fromkeys(syms))
+
+
 def candle_to_row(c: dict) -> list:
     # BarRepository.upsert_bars 需要: [ts_ms, open, high, low, close, volume]
     return [int(c["ts"]), float(c["open"]), float(c["high"]), float(c["low"]), float(c["close"]), float(c["volume"])]
@@ -25,24 +38,53 @@ def candle_to_row(c: dict) -> list:
 
 async def runner():
     cfg = load_config()
-    conn = make_conn(cfg)
-
-    repo = BarRepository(conn)
-    hb = HeartbeatRepository(conn, source="okx")
-
-    service_name = f"main_ws_runner:{SYMBOL}:{TIMEFRAME}"
-
-    state = {
-        "last_ts": None,
-        "buffer": None,
-        "last_beat": 0,
-    }
+    # bar upserts 和 heartbeat 各自从池里借连接，不再共用一个 conn
+    pool = get_pool(cfg)
+
+    repo = BarRepository(pool)
+    # 心跳只在内存里更新，后台线程定时 upsert（每个 service 一行）
+    hb = HeartbeatService(HeartbeatRepository(pool, source="okx")).start()
+    # on_candle 只入队；写库在后台线程里批量做，ws.recv() 不再等数据库
+    writer = BarWriter(repo).start()
+    # 进程内最近 N 根 K 线缓存：收盘即写入，读最近数据不用回库（local.yaml: cache）
+    cache = BarCache.from_config(repo, cfg)
+
+    symbols = ws_symbols(cfg)
+    service_name = f"main_ws_runner:{TIMEFRAME}"
+    step_ms = timeframe_ms(TIMEFRAME)
+
+    # local.yaml: metrics.port / metrics.ports（Prometheus 文本格式 /metrics）；不配就不开
+    serve_from_config(cfg, "main_ws_runner")
+
+    # 每个合约一份状态：形成中的 K + 实时合成的高周期
+    states = {sym: {"last_ts": None, "buffer": None} for sym in symbols}
+    rollups = {sym: LiveRollup(TIMEFRAME, ROLLUP_TIMEFRAMES) for sym in symbols}
+    last_stats = {"ts": now_ms()}
+
+    def save_rollups(symbol, closed, recv_ts=None):
+        for b in closed:
+            writer.put(symbol, b.timeframe, b.row(), recv_ts_ms=recv_ts)
+            cache.put(symbol, b.timeframe, b.row())
+            print(f"[ws_runner] {symbol} rollup {b.timeframe} closed ts={b.ts} bars={b.n}", flush=True)
+
+    def recover_rollups(symbol):
+        # 重启：只重读当前未收盘的最大周期 bucket 内的 1m（其余周期状态都在它里面）
+        have = cache.get_ts_range("okx", symbol, TIMEFRAME)
+        if have is None:
+            return
+        rollup = rollups[symbol]
+        start = rollup.recover_from(have[1])
+        df = cache.fetch_bars_df(source="okx", symbol=symbol, timeframe=TIMEFRAME, start_ts=start, asc=True)
+        for r in df.itertuples(index=False):
+            save_rollups(symbol, rollup.update(r.ts, r.open, r.high, r.low, r.close, r.volume))
+        print(f"[ws_runner] {symbol} rollups recovered from ts={start} bars_1m={len(df)}", flush=True)
 
     def beat():
-        # 心跳每 30 秒一次即可，避免刷库
-        if now_ms() - state["last_beat"] >= 30_000:
-            hb.beat(service_name, now_ms())
-            state["last_beat"] = now_ms()
+        hb.beat(service_name)
+        if now_ms() - last_stats["ts"] >= WRITER_STATS_EVERY_MS:
+            last_stats["ts"] = now_ms()
+            print(f"[ws_runner] writer {writer.stats()}", flush=True)
+            print(f"[ws_runner] cache {cache.stats()}", flush=True)
 
     def on_candle(c: dict):
         """
@@ -54,12 +96,16 @@ async def runner():
         """
         beat()
 
+        symbol = c["symbol"]
+        state = states.get(symbol)
+        if state is None:
+            return
         ts = int(c["ts"])
 
         if state["last_ts"] is None:
             state["last_ts"] = ts
             state["buffer"] = c
-            print(f"[ws_runner] init ts={ts}", flush=True)
+            print(f"[ws_runner] {symbol} init ts={ts}", flush=True)
             return
 
         if ts == state["last_ts"]:
@@ -72,23 +118,42 @@ async def runner():
             prev = state["buffer"]
             if prev:
                 row = candle_to_row(prev)
-                n, latest = repo.upsert_bars(SYMBOL, TIMEFRAME, [row])
-                print(f"[ws_runner] close&save upsert={n} closed_ts={row[0]} latest_ts={latest}", flush=True)
+                # 收盘时刻 -> 收到下一根第一条推送
+                recv_ts = int(c.get("recv_ts_ms") or now_ms())
+                INGEST_LATENCY.observe(recv_ts - (row[0] + step_ms), "close_to_recv", symbol)
+                writer.put(symbol, TIMEFRAME, row, recv_ts_ms=recv_ts)
+                cache.put(symbol, TIMEFRAME, row)
+                print(f"[ws_runner] {symbol} close&queue closed_ts={row[0]} queue={writer.q.qsize()}", flush=True)
+                save_rollups(symbol, rollups[symbol].update(*row), recv_ts)
 
             state["last_ts"] = ts
             state["buffer"] = c
             return
 
         # ts < last_ts：异常乱序（一般不会发生），忽略
-        print(f"[ws_runner] WARN out_of_order ts={ts} last_ts={state['last_ts']}", flush=True)
+        print(f"[ws_runner] {symbol} WARN out_of_order ts={ts} last_ts={state['last_ts']}", flush=True)
 
+    for sym in symbols:
+        recover_rollups(sym)
+
+    # 所有合约共用少量连接（按 MAX_SUBS_PER_CONN 分片），消息按 (channel, instId) 分发
     client = OKXWSClient(
-        inst_id=SYMBOL,
+        subscriptions=[(f"candle{TIMEFRAME}", sym) for sym in symbols],
         on_candle=on_candle,
         logger=lambda s: print(s, flush=True),
     )
+    REGISTRY.counter("quant_ws_reconnects_total", "Websocket reconnects (all shards)").set_function(lambda: client.reconnects)
+    REGISTRY.counter("quant_ws_messages_total", "Websocket messages received").set_function(lambda: client.messages)
+    REGISTRY.gauge("quant_ws_connections", "Websocket connections (shards)").set_function(lambda: len(client.shards()))
 
-    await client.run()
+    try:
+        await client.run()
+    finally:
+        # 退出前把队列里没写完的 bar 刷进库；库挂了最多等 10s，剩余行数记在 stats 的 unflushed
+        writer.close(timeout=10.0)
+        print(f"[ws_runner] writer flushed {writer.stats()}", flush=True)
+        hb.close()
+        close_pool()
 
 
 def main():
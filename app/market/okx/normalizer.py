@@ -1,6 +1,8 @@
 ﻿from __future__ import annotations
 
-from app.common.types import Bar
+import numpy as np
+
+from app.common.types import BAR_FIELDS, Bar, BarBatch
 
 
 class OKXNormalizer:
@@ -34,3 +36,29 @@ class OKXNormalizer:
             volume=v,
             source="okx",
         )
+
+    def to_batch(
+        self,
+        symbol: str,
+        timeframe: str,
+        rows: list,
+        confirmed_only: bool = False,
+        source: str = "okx",
+    ) -> BarBatch:
+        """
+        Raw OKX candle rows (strings, newest first) -> ascending BarBatch,
+        parsed in one NumPy call instead of a Bar per row.
+        """
+        if confirmed_only:
+            rows = [r for r in rows if self.is_confirmed(r)]
+        if not rows:
+            return BarBatch.empty(symbol, timeframe, source=source)
+        a = np.array([r[:6] for r in rows], dtype=np.float64)
+        if a.shape[1] < len(BAR_FIELDS):
+            raise ValueError(f"expected [ts,o,h,l,c,vol,...] rows, got width {a.shape[1]}")
+        batch = BarBatch(
+            symbol, timeframe,
+            a[:, 0].astype(np.int64), a[:, 1], a[:, 2], a[:, 3], a[:, 4], a[:, 5],
+            source=source,
+        )
+        return batch.sorted()
@@ -1,31 +1,118 @@
 ﻿import time
+from typing import Optional
+
+from app.common.metrics import INGEST_LATENCY
+from app.common.time import floor_ts, now_ms, timeframe_ms
+from app.market.okx.client import to_okx_bar
+
 
 class IncrementalStreamer:
-    def __init__(self, client, repo, poll_seconds=60, on_heartbeat=None):
+    """
+    REST poller that follows one series bar by bar.
+
+    Polls are scheduled just after each expected bar close (close + close_delay)
+    and only ask for bars newer than the last stored ts (`before` cursor), so a
+    cycle is normally one request returning one row. Nothing new -> no DB write.
+    The closed bar can show up unconfirmed for a moment; it is re-polled with a
+    short backoff. After downtime (more than one page behind) the missing range
+    is paged in with fetch_range().
+
+    poll_seconds caps the idle sleep so heartbeats keep flowing on long bars.
+    Written bars are also put into `cache` (a BarCache) when one is given.
+    """
+
+    def __init__(self, client, repo, poll_seconds=60, on_heartbeat=None,
+                 source: str = "okx", close_delay: float = 1.0, max_confirm_wait: float = 30.0,
+                 confirm_retry: float = 2.0, cache=None):
         self.client = client
         self.repo = repo
         self.poll_seconds = poll_seconds
         self.on_heartbeat = on_heartbeat
+        self.source = source
+        self.close_delay = close_delay
+        self.max_confirm_wait = max_confirm_wait
+        self.confirm_retry = confirm_retry
+        self.cache = cache
+
+        self.polls = 0
+        self.empty_polls = 0
+        self.written = 0
 
     def _heartbeat(self):
         if self.on_heartbeat:
             self.on_heartbeat()
 
+    def _sleep_until(self, wake_ms: int):
+        # 长周期也要按 poll_seconds 打心跳
+        while True:
+            left = (wake_ms - now_ms()) / 1000.0
+            if left <= 0:
+                return
+            time.sleep(min(left, max(self.poll_seconds, 1)))
+            if wake_ms - now_ms() > 0:
+                self._heartbeat()
+
+    def _last_ts(self, symbol, bar) -> Optional[int]:
+        have = self.repo.get_ts_range(self.source, symbol, bar)
+        return have[1] if have else None
+
+    def _fetch_new(self, symbol, timeframe, last_ts: Optional[int], limit: int):
+        step = timeframe_ms(timeframe)
+        if last_ts is None:
+            # 空库：按 limit 回补最近一段
+            start = floor_ts(now_ms(), step) - limit * step
+            return self.client.fetch_range(symbol, timeframe, start, None, history=None)
+
+        page = self.client.PAGE_LIMIT["candles"]
+        rows = self.client.fetch_candles(inst_id=symbol, bar=to_okx_bar(timeframe), limit=page, before=last_ts)
+        if len(rows) >= page:
+            # 落后超过一页（停机过）：整段补
+            return self.client.fetch_range(symbol, timeframe, last_ts + step, None, history=None)
+        return self.client.normalizer.to_batch(symbol, timeframe, rows, confirmed_only=True)
+
+    def poll_once(self, symbol, timeframe, bar, last_ts: Optional[int], limit: int = 100):
+        """One delta poll. Returns (new last_ts, rows written)."""
+        self.polls += 1
+        batch = self._fetch_new(symbol, timeframe, last_ts, limit)
+        if last_ts is not None and len(batch):
+            batch = batch[batch.ts > last_ts]
+        if len(batch) == 0:
+            self.empty_polls += 1
+            return last_ts, 0
+
+        n, latest = self.repo.upsert_bars(symbol, bar, batch, source=self.source)
+        self.written += n
+        if self.cache is not None:
+            self.cache.put_many(symbol, bar, batch, source=self.source)
+        INGEST_LATENCY.observe(now_ms() - (latest + timeframe_ms(timeframe)), "close_to_commit", symbol)
+        return latest, n
+
     def run(self, symbol, timeframe, bar, limit=100):
-        print(f"[stream] start symbol={symbol} timeframe={timeframe}")
+        step = timeframe_ms(timeframe)
+        print(f"[stream] start symbol={symbol} timeframe={timeframe} step={step}ms")
+        last_ts = None
+        loaded = False
         while True:
             try:
-                bars = self.client.fetch_ohlcv(
-                    symbol=symbol,
-                    timeframe=timeframe,
-                    limit=limit,
-                )
-                n, latest = self.repo.upsert_bars(symbol, bar, bars)
-                self._heartbeat()
-                print(f"[stream] upsert={n} latest_ts={latest}")
+                if not loaded:
+                    last_ts = self._last_ts(symbol, bar)
+                    loaded = True
+
+                now = now_ms()
+                expected = floor_ts(now, step) - step   # 最近一根已收盘 bar 的 ts
+                if last_ts is None or last_ts < expected:
+                    last_ts, n = self.poll_once(symbol, timeframe, bar, last_ts, limit)
+                    self._heartbeat()
+                    if n:
+                        print(f"[stream] upsert={n} latest_ts={last_ts} polls={self.polls} empty={self.empty_polls}")
+                    behind = last_ts is None or last_ts < expected
+                    if behind and now < expected + step + self.max_confirm_wait * 1000:
+                        # 收盘了但交易所还没给 confirm=1：短间隔重试
+                        time.sleep(self.confirm_retry)
+                        continue
+
+                # 睡到下一根收盘后 close_delay 秒
+                self._sleep_until(floor_ts(now_ms(), step) + step + int(self.close_delay * 1000))
             except Exception as e:
                 print(f"[stream] ERROR {type(e).__name__}: {e}")
-                time.sleep(max(self.poll_seconds, 10))
-                continue
-
-            time.sleep(self.poll_seconds)
+                time.sleep(max(min(self.poll_seconds, 60), 10))
@@ -1,82 +1,187 @@
 ﻿import asyncio
 import json
+import random
 import time
-from typing import Callable, Dict, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import websockets
 
+from app.common.time import TIMEFRAME_MS
+from app.market.okx.client import to_okx_bar
+
 OKX_PUBLIC_WS = "wss://ws.okx.com:8443/ws/v5/business"
 
+# per-connection sizing: OKX caps the subscribe payload (64KB) and the
+# request rate per connection, and new connections to ~3/s per IP
+MAX_SUBS_PER_CONN = 200
+SUB_BATCH = 50
+CONNECT_STAGGER_S = 0.4
+
+Handler = Callable[[Dict], None]
+
+# OKX bar code -> our timeframe ("1H" -> "1h"); the inverse of to_okx_bar.
+# Case matters: "1m" is a minute, "1M" a month (not a supported timeframe).
+OKX_BAR_TIMEFRAME = {to_okx_bar(tf): tf for tf in TIMEFRAME_MS}
+
+
+def channel_timeframe(channel: str) -> str:
+    # candle1m -> 1m ; candle1H -> 1h ; candle1Dutc -> 1d ; candle1M -> ValueError
+    bar = channel[len("candle"):] if channel.startswith("candle") else ""
+    if bar.endswith("utc"):
+        bar = bar[:-3]
+    tf = OKX_BAR_TIMEFRAME.get(bar)
+    if tf is None:
+        raise ValueError(f"unsupported candle channel: {channel!r}")
+    return tf
+
 
 class OKXWSClient:
     """
-    Minimal OKX public websocket client.
-    Subscribes candle1m and calls on_candle(candle_dict) with normalized fields.
+    Multiplexed OKX public websocket client.
+
+    Many (channel, instId) subscriptions share a few connections: they are
+    sharded MAX_SUBS_PER_CONN per socket, each shard reconnects on its own
+    (jittered backoff) and resubscribes in batches of SUB_BATCH args.
+
+    Messages are routed through a dispatch table keyed by (arg.channel,
+    arg.instId); candle channels get a normalized candle dict per row.
+    The old single-instrument form OKXWSClient(inst_id=..., on_candle=...)
+    still works.
     """
 
-    def __init__(self, inst_id: str, on_candle: Callable[[Dict], None], logger: Optional[Callable[[str], None]] = None):
-        self.inst_id = inst_id
+    def __init__(
+        self,
+        inst_id: Optional[str] = None,
+        on_candle: Optional[Handler] = None,
+        logger: Optional[Callable[[str], None]] = None,
+        subscriptions: Optional[Iterable[Tuple[str, str]]] = None,
+        url: str = OKX_PUBLIC_WS,
+        max_subs_per_conn: int = MAX_SUBS_PER_CONN,
+        sub_batch: int = SUB_BATCH,
+    ):
+        self.url = url
         self.on_candle = on_candle
         self.log = logger or (lambda s: None)
+        self.max_subs_per_conn = max(1, int(max_subs_per_conn))
+        self.sub_batch = max(1, int(sub_batch))
+
+        # (channel, instId) -> handler ; None = default (on_candle)
+        self._handlers: Dict[Tuple[str, str], Optional[Handler]] = {}
+        if inst_id is not None:
+            self.subscribe("candle1m", inst_id)
+        for channel, iid in subscriptions or ():
+            self.subscribe(channel, iid)
 
+        self.reconnects = 0
+        self.messages = 0
         self._stop = False
 
+    def subscribe(self, channel: str, inst_id: str, handler: Optional[Handler] = None) -> None:
+        """Register before run(); `handler` overrides on_candle for this pair."""
+        if channel.startswith("candle"):
+            channel_timeframe(channel)  # unknown bar codes fail here, not at the first message
+        self._handlers[(channel, inst_id)] = handler
+
     def stop(self):
         self._stop = True
 
+    def shards(self) -> List[List[Tuple[str, str]]]:
+        keys = list(self._handlers)
+        n = self.max_subs_per_conn
+        return [keys[i:i + n] for i in range(0, len(keys), n)]
+
     async def run(self):
+        shards = self.shards()
+        if not shards:
+            raise ValueError("no subscriptions")
+        self.log(f"[ws] subscriptions={len(self._handlers)} connections={len(shards)}")
+        await asyncio.gather(*(self._run_shard(i, keys) for i, keys in enumerate(shards)))
+
+    async def _run_shard(self, shard: int, keys: List[Tuple[str, str]]):
+        # stagger the first connects to stay under the per-IP connect rate
+        await asyncio.sleep(shard * CONNECT_STAGGER_S)
+        backoff = 1.0
         while not self._stop:
+            started = time.monotonic()
             try:
-                await self._run_once()
+                await self._run_once(shard, keys)
             except Exception as e:
-                self.log(f"[ws] ERROR {type(e).__name__}: {e}")
-                # backoff
-                await asyncio.sleep(3)
+                self.log(f"[ws][{shard}] ERROR {type(e).__name__}: {e}")
+            if self._stop:
+                break
+            self.reconnects += 1
+            # a connection that stayed up a while resets the backoff
+            if time.monotonic() - started > 60:
+                backoff = 1.0
+            delay = backoff * random.uniform(0.5, 1.0)
+            backoff = min(backoff * 2, 30.0)
+            await asyncio.sleep(delay)
 
-    async def _run_once(self):
-        async with websockets.connect(OKX_PUBLIC_WS, ping_interval=20, ping_timeout=10, close_timeout=5) as ws:
-            self.log(f"[ws] connected {OKX_PUBLIC_WS}")
+    async def _run_once(self, shard: int, keys: List[Tuple[str, str]]):
+        async with websockets.connect(self.url, ping_interval=20, ping_timeout=10, close_timeout=5) as ws:
+            self.log(f"[ws][{shard}] connected {self.url}")
 
-            sub = {
-                "op": "subscribe",
-                "args": [{"channel": "candle1m", "instId": self.inst_id}],
-            }
-            await ws.send(json.dumps(sub))
-            self.log(f"[ws] subscribed candle1m instId={self.inst_id}")
+            for i in range(0, len(keys), self.sub_batch):
+                batch = keys[i:i + self.sub_batch]
+                sub = {
+                    "op": "subscribe",
+                    "args": [{"channel": ch, "instId": iid} for ch, iid in batch],
+                }
+                await ws.send(json.dumps(sub))
+            self.log(f"[ws][{shard}] subscribed {len(keys)} args in {-(-len(keys) // self.sub_batch)} batches")
 
             while not self._stop:
                 raw = await ws.recv()
-                msg = json.loads(raw)
-
-                # ignore event acks
-                if isinstance(msg, dict) and msg.get("event"):
-                    self.log(f"[ws] event={msg.get('event')} full={msg}")
-                    continue
-
-                data = msg.get("data") if isinstance(msg, dict) else None
-                if not data:
-                    continue
-
-                # OKX candle data format: [[ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm], ...]
-                # Some fields may vary; we only use first 6.
-                arr = data[0]
-                try:
-                    ts = int(arr[0])
-                    o = float(arr[1]); h = float(arr[2]); l = float(arr[3]); c = float(arr[4])
-                    v = float(arr[5])
-                except Exception:
-                    continue
-
-                candle = {
-                    "symbol": self.inst_id,
-                    "timeframe": "1m",
-                    "ts": ts,
-                    "open": o,
-                    "high": h,
-                    "low": l,
-                    "close": c,
-                    "volume": v,
-                    "source": "okx_ws",
-                    "recv_ts_ms": int(time.time() * 1000),
-                }
-                self.on_candle(candle)
+                self.messages += 1
+                self.dispatch(json.loads(raw))
+
+    def dispatch(self, msg: Any) -> None:
+        if not isinstance(msg, dict):
+            return
+
+        # ignore event acks
+        if msg.get("event"):
+            if msg.get("event") == "error":
+                self.log(f"[ws] event=error full={msg}")
+            return
+
+        arg = msg.get("arg") or {}
+        data = msg.get("data")
+        if not data:
+            return
+
+        key = (arg.get("channel"), arg.get("instId"))
+        if key not in self._handlers:
+            return
+        handler = self._handlers[key] or self.on_candle
+        if handler is None:
+            return
+
+        channel = key[0] or ""
+        if not channel.startswith("candle"):
+            handler(msg)
+            return
+
+        tf = channel_timeframe(channel)
+        recv_ts = int(time.time() * 1000)
+        # OKX candle data format: [[ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm], ...]
+        for arr in data:
+            try:
+                ts = int(arr[0])
+                o = float(arr[1]); h = float(arr[2]); l = float(arr[3]); c = float(arr[4])
+                v = float(arr[5])
+            except Exception:
+                continue
+
+            handler({
+                "symbol": key[1],
+                "timeframe": tf,
+                "ts": ts,
+                "open": o,
+                "high": h,
+                "low": l,
+                "close": c,
+                "volume": v,
+                "source": "okx_ws",
+                "recv_ts_ms": recv_ts,
+            })
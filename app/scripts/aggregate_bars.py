@@ -1,86 +1,97 @@
 ﻿import argparse
-from datetime import datetime, timezone
-import pandas as pd
+import time
 
-from app.storage.db import load_config
+from app.market.aggregate import MultiAggregator, bucket_start, tf_offset
+from app.common.time import timeframe_ms
+from app.storage.db import close_pool, get_pool, load_config
 from app.storage.bar_repo import BarRepository
 
+DEFAULT_TARGETS = "5m,15m,1h,4h,1d,1w"
 
-def floor_4h_utc(ts_ms: int) -> int:
-    """Floor timestamp (ms) to 4-hour boundary in UTC."""
-    # seconds
-    ts_s = ts_ms // 1000
-    dt = datetime.fromtimestamp(ts_s, tz=timezone.utc)
-    hour = dt.hour - (dt.hour % 4)
-    dt0 = dt.replace(hour=hour, minute=0, second=0, microsecond=0)
-    return int(dt0.timestamp() * 1000)
 
-
-def aggregate_1m_to_4h(df_1m: pd.DataFrame) -> pd.DataFrame:
+def resume_from(repo: BarRepository, source: str, symbol: str, targets) -> int | None:
     """
-    Input df columns: ts, open, high, low, close, volume (ts ms, ascending)
-    Output df columns same, timeframe implied by caller ('4h')
+    Re-aggregate from the oldest "latest bar" among the targets, so the last
+    (possibly partial at write time) bucket of each target is rebuilt.
+    None when some target has no bars yet (full run).
     """
-    if df_1m.empty:
-        return df_1m
-
-    df = df_1m.sort_values("ts").drop_duplicates(subset=["ts"], keep="last").copy()
-    df["bucket_ts"] = df["ts"].astype("int64").apply(floor_4h_utc)
-
-    # groupby bucket_ts and aggregate OHLCV
-    g = df.groupby("bucket_ts", sort=True)
-
-    out = pd.DataFrame({
-        "ts": g["bucket_ts"].first(),
-        "open": g["open"].first(),
-        "high": g["high"].max(),
-        "low": g["low"].min(),
-        "close": g["close"].last(),
-        "volume": g["volume"].sum(),
-    })
-
-    out = out.sort_values("ts").reset_index(drop=True)
-    return out
+    starts = []
+    for tf in targets:
+        have = repo.get_ts_range(source, symbol, tf)
+        if have is None:
+            return None
+        starts.append(have[1])
+    return min(starts)
 
 
 def main():
-    ap = argparse.ArgumentParser()
+    ap = argparse.ArgumentParser(description="Aggregate bars into coarser timeframes (vectorized, streaming)")
     ap.add_argument("--symbol", default="BTC-USDT-SWAP")
+    ap.add_argument("--source_tf", default="1m")
+    ap.add_argument("--targets", default=DEFAULT_TARGETS, help=f"default: {DEFAULT_TARGETS}")
     ap.add_argument("--start_ts", type=int, default=None, help="ms inclusive")
     ap.add_argument("--end_ts", type=int, default=None, help="ms inclusive")
-    ap.add_argument("--limit", type=int, default=None, help="limit 1m bars fetched")
+    ap.add_argument("--limit", type=int, default=None, help="limit source bars fetched")
+    ap.add_argument("--full", action="store_true", help="rebuild from the first source bar")
+    ap.add_argument("--chunk_rows", type=int, default=1_000_000, help="source bars per DB read")
+    ap.add_argument("--include_partial", action="store_true", help="also write the still-open last bucket")
     ap.add_argument("--dry_run", action="store_true", help="do not write to DB")
     args = ap.parse_args()
 
+    source = "okx"
+    targets = [x.strip() for x in args.targets.split(",") if x.strip()]
+
     cfg = load_config()
-    repo = BarRepository(cfg)
-
-    # fetch 1m bars
-    df_1m = repo.fetch_bars_df(
-        symbol=args.symbol,
-        timeframe="1m",
-        start_ts=args.start_ts,
-        end_ts=args.end_ts,
-        limit=args.limit,
-        asc=True,
-    )
-    if df_1m.empty:
-        raise RuntimeError("no 1m bars loaded")
-
-    df_4h = aggregate_1m_to_4h(df_1m)
-
-    print(f"[agg] symbol={args.symbol} 1m_rows={len(df_1m)} -> 4h_rows={len(df_4h)}")
-    print(df_4h.head(3).to_string(index=False))
-    print(df_4h.tail(3).to_string(index=False))
-
-    if args.dry_run:
-        print("[agg] dry_run=True, not writing to DB")
-        return
-
-    # write 4h bars back using existing upsert (expects list[list])
-    bars = df_4h[["ts", "open", "high", "low", "close", "volume"]].values.tolist()
-    n, latest = repo.upsert_bars(args.symbol, "4h", bars)
-    print(f"[agg] upserted={n} latest_ts={latest}")
+    pool = get_pool(cfg)
+    repo = BarRepository(pool)
+
+    try:
+        agg = MultiAggregator(args.source_tf, targets)
+
+        start_ts = args.start_ts
+        if start_ts is None and args.limit is None and not args.full:
+            start_ts = resume_from(repo, source, args.symbol, targets)
+        if start_ts is not None:
+            # begin on a bucket boundary of the coarsest target: no partial first bucket
+            coarse = agg.order[-1]
+            start_ts = int(bucket_start([start_ts], timeframe_ms(coarse), tf_offset(coarse))[0])
+
+        print(f"[agg] symbol={args.symbol} {args.source_tf} -> {','.join(agg.order)} start_ts={start_ts}", flush=True)
+
+        t0 = time.perf_counter()
+        src_rows = 0
+        written = {tf: 0 for tf in agg.order}
+
+        def write(out):
+            for tf, cols in out.items():
+                if args.dry_run:
+                    continue
+                res = repo.bulk_upsert_bars(args.symbol, tf, cols, source=source)
+                written[tf] += res.inserted + res.updated
+
+        for chunk in repo.iter_bars_chunks(
+            source, args.symbol, args.source_tf,
+            start_ts=start_ts, end_ts=args.end_ts,
+            chunk_rows=args.chunk_rows, limit=args.limit,
+        ):
+            src_rows += len(chunk["ts"])
+            write(agg.push(chunk))
+            print(f"[agg] read={src_rows} {time.perf_counter() - t0:.1f}s", flush=True)
+        write(agg.finish(include_partial=args.include_partial))
+
+        if src_rows == 0:
+            raise RuntimeError(f"no {args.source_tf} bars loaded")
+
+        secs = time.perf_counter() - t0
+        print(f"\n[agg] {args.source_tf}_rows={src_rows} in {secs:.1f}s ({src_rows / max(secs, 1e-9) * 60 / 1e6:.1f}M/min)")
+        for tf in agg.order:
+            st = agg.stats[tf]
+            print(f"  {tf:>4}: buckets={st.bars:<8} incomplete={st.incomplete:<6} "
+                  f"written={written[tf]:<8} last_ts={st.last_ts}")
+        if args.dry_run:
+            print("[agg] dry_run=True, not writing to DB")
+    finally:
+        close_pool()
 
 
 if __name__ == "__main__":
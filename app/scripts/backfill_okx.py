@@ -1,65 +1,99 @@
 ﻿from __future__ import annotations
 
-from app.storage.db import load_config, make_conn, migrate
+import argparse
+from typing import List
+
+from app.common.time import floor_ts, now_ms, timeframe_ms
+from app.storage.db import close_pool, get_pool, load_config, migrate
 from app.storage.bar_repo import BarRepository
 
 from app.market.okx.client import OKXMarketClient
 from app.market.okx.normalizer import OKXNormalizer
-from app.market.okx.fetcher import MarketFetcher
+from app.market.okx.backfill import BackfillEngine, FetchRange
 
 
-def main():
-    cfg = load_config("app/config/local.yaml")
+def _split(s: str | None) -> List[str]:
+    return [x.strip() for x in (s or "").split(",") if x.strip()]
+
 
-    conn = make_conn(cfg)
-    migrate(conn)
-    repo = BarRepository(conn)
+def plan_ranges(repo: BarRepository, source: str, symbol: str, timeframe: str,
+                start_ts: int, end_ts: int, skip_existing: bool) -> List[FetchRange]:
+    """
+    [start_ts, end_ts) minus what the DB already covers at either end.
+    Holes inside the stored range are left to fill_gaps.
+    """
+    if skip_existing:
+        have = repo.get_ts_range(source, symbol, timeframe)
+        if have is not None:
+            lo, hi = have
+            step = timeframe_ms(timeframe)
+            out = []
+            if start_ts < lo:
+                out.append(FetchRange(symbol, timeframe, start_ts, min(lo, end_ts)))
+            if hi + step < end_ts:
+                out.append(FetchRange(symbol, timeframe, max(hi + step, start_ts), end_ts))
+            return out
+    return [FetchRange(symbol, timeframe, start_ts, end_ts)]
 
-    market_cfg = cfg.get("market", {})
-    base_url = market_cfg.get("base_url", "https://www.okx.com")
 
+def main():
+    cfg = load_config()
     data_cfg = cfg.get("data", {})
-    symbol = data_cfg.get("symbol", "BTC-USDT-SWAP")
-    timeframe = data_cfg.get("timeframe", "1h")
-    bar = data_cfg.get("bar", "1H")
-
-    target_rows = int(data_cfg.get("backfill_target_rows", 5000))
-    batch_limit = int(data_cfg.get("limit", 100))
-
-    client = OKXMarketClient(base_url=base_url)
-    normalizer = OKXNormalizer(ts_unit=data_cfg.get("ts_unit", "ms"))
-    fetcher = MarketFetcher(client, normalizer)
-
-    latest = repo.get_latest_ts(symbol, timeframe)
-    total = repo.count(symbol, timeframe)
-    print(f"[backfill] start count={total} latest_ts={latest}")
-
-    # 关键：用 after 向过去翻页（返回早于 after_ts 的数据）
-    after_ts = latest
-
-    while total < target_rows:
-        bars = fetcher.fetch(
-            symbol=symbol,
-            timeframe=timeframe,
-            bar=bar,
-            limit=batch_limit,
-            after=after_ts,
-            history=True,
-            confirmed_only=True,
-        )
-
-        if not bars:
-            print("[backfill] no more data returned, stop.")
-            break
-
-        repo.upsert_many(bars)
-        total = repo.count(symbol, timeframe)
-
-        # 下一页：用本批次最早 ts 继续向更早翻
-        after_ts = bars[0].ts
-        print(f"[backfill] fetched={len(bars)} total={total} next_after={after_ts}")
-
-    conn.close()
+
+    ap = argparse.ArgumentParser(description="Concurrent OKX history backfill -> bars")
+    ap.add_argument("--symbols", default=None, help="e.g. BTC-USDT-SWAP,ETH-USDT-SWAP (default: data.symbol)")
+    ap.add_argument("--timeframes", default=None, help="e.g. 1m,1h (default: data.timeframe)")
+    ap.add_argument("--target_rows", type=int, default=int(data_cfg.get("backfill_target_rows", 5000)),
+                    help="bars back from end_ts per series (ignored with --start_ts)")
+    ap.add_argument("--start_ts", type=int, default=None)
+    ap.add_argument("--end_ts", type=int, default=None, help="exclusive; default: current bar open")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--rate", type=float, default=None, help="requests/s (default: OKX limit of the endpoint)")
+    ap.add_argument("--window_bars", type=int, default=2000, help="bars per parallel work unit")
+    ap.add_argument("--batch_rows", type=int, default=20000, help="bars per DB write")
+    ap.add_argument("--refetch", action="store_true", help="also refetch ranges already in the DB")
+    args = ap.parse_args()
+
+    symbols = _split(args.symbols) or [data_cfg.get("symbol", "BTC-USDT-SWAP")]
+    timeframes = _split(args.timeframes) or [data_cfg.get("timeframe", "1h")]
+    source = "okx"
+
+    pool = get_pool(cfg)
+    migrate(pool)
+    repo = BarRepository(pool)
+
+    ranges: List[FetchRange] = []
+    for symbol in symbols:
+        for tf in timeframes:
+            step = timeframe_ms(tf)
+            end_ts = args.end_ts if args.end_ts is not None else floor_ts(now_ms(), step)
+            start_ts = args.start_ts if args.start_ts is not None else end_ts - args.target_rows * step
+            rs = plan_ranges(repo, source, symbol, tf, start_ts, end_ts, skip_existing=not args.refetch)
+            todo = sum((r.end_ts - r.start_ts) // step for r in rs)
+            print(f"[backfill] plan {symbol} {tf}: ranges={len(rs)} bars<={todo}", flush=True)
+            ranges.extend(rs)
+
+    client = OKXMarketClient.from_config(cfg)
+    engine = BackfillEngine(
+        client, repo,
+        workers=args.workers,
+        rate=args.rate,
+        window_bars=args.window_bars,
+        batch_rows=args.batch_rows,
+        normalizer=OKXNormalizer(ts_unit=data_cfg.get("ts_unit", "ms")),
+        source=source,
+    )
+
+    try:
+        progress = engine.run(ranges)
+    finally:
+        close_pool()
+
+    print("\n=== backfill summary ===")
+    for p in progress.values():
+        print(f"{p.symbol:<20} {p.timeframe:>5}  pages={p.pages:<6} fetched={p.fetched:<9} "
+              f"inserted={p.inserted:<9} updated={p.updated:<7} oldest_ts={p.oldest_ts}"
+              + (f"  FAILED windows={p.windows_failed}" if p.windows_failed else ""))
     print("[backfill] done")
 
 
@@ -0,0 +1,110 @@
+"""
+Backtest one strategy on stored bars.
+
+    python -m app.scripts.backtest --symbol BTC-USDT-SWAP --timeframe 1m \
+        --strategy ma_cross --params fast=20,slow=120 --fee_bps 5 --slippage_bps 1
+
+Bars come from the DB (or --bars_csv); features are computed once with the
+indicators the strategy reads, then the whole series runs through the
+vectorized engine.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from app.strategy.engine import BacktestConfig, prepare_features, run_backtest
+from app.strategy.strategies import STRATEGIES, make_strategy
+from app.storage.bar_repo import BarRepository
+from app.storage.db import load_config, make_conn
+
+
+def parse_params(s: str | None) -> dict:
+    """"fast=10,slow=50,long_only=true" -> {"fast": 10, "slow": 50, "long_only": True}"""
+    out = {}
+    for item in (s or "").split(","):
+        if not item.strip():
+            continue
+        k, _, v = item.partition("=")
+        v = v.strip()
+        if v.lower() in ("true", "false"):
+            out[k.strip()] = v.lower() == "true"
+            continue
+        for cast in (int, float):
+            try:
+                out[k.strip()] = cast(v)
+                break
+            except ValueError:
+                pass
+        else:
+            out[k.strip()] = v
+    return out
+
+
+def load_bars(args) -> pd.DataFrame:
+    if args.bars_csv:
+        return pd.read_csv(args.bars_csv)
+    conn = make_conn(load_config())
+    try:
+        return BarRepository(conn).fetch_bars_df(
+            source=args.source, symbol=args.symbol, timeframe=args.timeframe,
+            start_ts=args.start_ts, end_ts=args.end_ts, asc=True,
+        )
+    finally:
+        conn.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Vectorized backtest of one strategy")
+    ap.add_argument("--symbol", default="BTC-USDT-SWAP")
+    ap.add_argument("--timeframe", default="1h")
+    ap.add_argument("--source", default="okx")
+    ap.add_argument("--start_ts", type=int, default=None)
+    ap.add_argument("--end_ts", type=int, default=None)
+    ap.add_argument("--bars_csv", default=None, help="read bars from CSV instead of the DB")
+    ap.add_argument("--strategy", default="ma_cross", choices=sorted(STRATEGIES))
+    ap.add_argument("--params", default=None, help="e.g. fast=10,slow=50")
+    ap.add_argument("--fee_bps", type=float, default=5.0)
+    ap.add_argument("--slippage_bps", type=float, default=1.0)
+    ap.add_argument("--capital", type=float, default=10_000.0)
+    ap.add_argument("--no_short", action="store_true")
+    ap.add_argument("--warmup", type=int, default=26)
+    ap.add_argument("--out_csv", default=None, help="write the equity curve")
+    ap.add_argument("--trades_csv", default=None, help="write the trade list")
+    args = ap.parse_args()
+
+    strategy = make_strategy(args.strategy, **parse_params(args.params))
+    cfg = BacktestConfig(
+        fee_bps=args.fee_bps,
+        slippage_bps=args.slippage_bps,
+        initial_capital=args.capital,
+        allow_short=not args.no_short,
+    )
+
+    t0 = time.perf_counter()
+    bars = load_bars(args)
+    if bars.empty:
+        raise RuntimeError(f"no bars loaded. symbol={args.symbol} timeframe={args.timeframe}")
+    t1 = time.perf_counter()
+    feats = prepare_features(bars, [strategy], warmup=args.warmup)
+    t2 = time.perf_counter()
+    res = run_backtest(feats, strategy, cfg, timeframe=args.timeframe)
+    t3 = time.perf_counter()
+
+    print(f"[backtest] {args.symbol} {args.timeframe} {res.label} bars={len(bars)} "
+          f"load={t1 - t0:.2f}s features={t2 - t1:.2f}s run={t3 - t2:.2f}s")
+    for k, v in res.stats.items():
+        print(f"  {k:<14} {v:.6g}" if isinstance(v, float) else f"  {k:<14} {v}")
+
+    for path, df in ((args.out_csv, res.to_frame()), (args.trades_csv, res.trades)):
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            df.to_csv(path, index=False)
+            print(f"[backtest] -> {path}")
+
+
+if __name__ == "__main__":
+    main()
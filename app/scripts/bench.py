@@ -0,0 +1,263 @@
+"""
+Benchmark suite for the data and feature paths.
+
+Synthetic 1m OHLCV series (10k / 1M / 10M rows) are pushed through each
+stage; every stage is timed best-of-N and written as JSON, keyed
+"<stage>@<size>", so runs can be compared across commits:
+
+    python -m app.scripts.bench --sizes 10k,1m --out data/bench/base.json
+    python -m app.scripts.bench --sizes 10k,1m --compare data/bench/base.json --threshold 0.15
+
+DB stages run in a throwaway database (quant_bench_<pid>) created on the
+server from local.yaml, brought to the latest schema with migrate() and
+dropped at the end.
+--no_db skips them.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from app.common.types import BarBatch
+from app.features.service import compute_features
+from app.market.aggregate import aggregate_bars
+from app.market.okx.normalizer import OKXNormalizer
+from app.market.okx.ws_client import OKXWSClient
+from app.scripts.bench_features import make_bars
+from app.storage.bar_repo import BarRepository
+from app.storage.db import _connect_kwargs, get_db_cfg, load_config, migrate
+
+SIZES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "10m": 10_000_000}
+
+# stages that build per-row Python objects are capped (rows recorded in the result)
+MAX_ROWS = {
+    "normalize.to_batch": 1_000_000,
+    "ws.decode": 200_000,
+    "db.upsert_bars": 200_000,
+}
+
+SYMBOL = "BENCH"
+
+
+def _git_rev() -> Dict[str, object]:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "-uno"], capture_output=True, text=True).stdout.strip())
+        return {"commit": rev, "dirty": dirty}
+    except Exception:
+        return {"commit": None, "dirty": None}
+
+
+def best_of(fn: Callable[[], object], repeat: int, setup: Optional[Callable[[], None]] = None) -> float:
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def okx_rows(df: pd.DataFrame) -> list:
+    """Raw OKX REST rows (strings, newest first) for the normalizer."""
+    a = df[["ts", "open", "high", "low", "close", "volume"]].to_numpy()
+    return [[str(int(r[0])), *(f"{x:.2f}" for x in r[1:]), "0", "0", "1"] for r in a[::-1]]
+
+
+def ws_messages(df: pd.DataFrame) -> List[str]:
+    """One candle push per message, as OKX sends them."""
+    rows = okx_rows(df)
+    return [
+        json.dumps({"arg": {"channel": "candle1m", "instId": SYMBOL}, "data": [r]})
+        for r in rows
+    ]
+
+
+def _record(out: Dict[str, dict], stage: str, secs: float, rows: int) -> None:
+    out[stage] = {"seconds": secs, "rows": rows, "rows_per_s": rows / secs if secs > 0 else None}
+    print(f"[bench] {stage:<24} rows={rows:<9} {secs:9.4f}s  {rows / max(secs, 1e-12):>14,.0f} rows/s", flush=True)
+
+
+# ===== throwaway database =====
+
+@contextmanager
+def throwaway_db(cfg: dict):
+    db = get_db_cfg(cfg)
+    name = f"quant_bench_{os.getpid()}"
+    admin = psycopg2.connect(**{**_connect_kwargs(db), "dbname": "postgres"})
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'CREATE DATABASE "{name}"')
+    conn = psycopg2.connect(**{**_connect_kwargs(db), "dbname": name})
+    try:
+        migrate(conn)
+        print(f"[bench] throwaway database {name}", flush=True)
+        yield conn
+    finally:
+        conn.close()
+        with admin.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        admin.close()
+
+
+# ===== stages =====
+
+def cpu_stages(df: pd.DataFrame, repeat: int) -> Dict[str, dict]:
+    n = len(df)
+    out = {}
+    batch = BarBatch.from_columns(SYMBOL, "1m", {c: df[c].to_numpy() for c in df.columns})
+
+    record = partial(_record, out)
+
+    record("features.compute", best_of(lambda: compute_features(df), repeat), n)
+    record("aggregate.1m_to_4h", best_of(lambda: aggregate_bars(batch, "1m", ["4h"]), repeat), n)
+    record("aggregate.multi", best_of(lambda: aggregate_bars(batch, "1m", ["5m", "15m", "1h", "4h", "1d", "1w"]), repeat), n)
+
+    m = min(n, MAX_ROWS["normalize.to_batch"])
+    raw = okx_rows(df.iloc[-m:])
+    norm = OKXNormalizer()
+    record("normalize.to_batch", best_of(lambda: norm.to_batch(SYMBOL, "1m", raw, confirmed_only=True), repeat), m)
+    del raw
+
+    m = min(n, MAX_ROWS["ws.decode"])
+    msgs = ws_messages(df.iloc[-m:])
+    client = OKXWSClient(subscriptions=[("candle1m", SYMBOL)], on_candle=lambda c: None)
+
+    def decode():
+        for raw in msgs:
+            client.dispatch(json.loads(raw))
+
+    record("ws.decode", best_of(decode, repeat), m)
+    return out
+
+
+def db_stages(conn, df: pd.DataFrame, repeat: int) -> Dict[str, dict]:
+    n = len(df)
+    out = {}
+    repo = BarRepository(conn)
+    batch = BarBatch.from_columns(SYMBOL, "1m", {c: df[c].to_numpy() for c in df.columns})
+
+    record = partial(_record, out)
+
+    def truncate():
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE bars")
+        conn.commit()
+
+    m = min(n, MAX_ROWS["db.upsert_bars"])
+    part = batch[-m:]
+    record("db.upsert_bars", best_of(lambda: repo.upsert_bars(SYMBOL, "1m", part), repeat, setup=truncate), m)
+
+    record("db.bulk_upsert.insert", best_of(lambda: repo.bulk_upsert_bars(SYMBOL, "1m", batch), repeat, setup=truncate), n)
+    # table now holds the series: same rows again are all "unchanged"
+    record("db.bulk_upsert.noop", best_of(lambda: repo.bulk_upsert_bars(SYMBOL, "1m", batch), repeat), n)
+
+    with conn.cursor() as cur:
+        cur.execute("ANALYZE bars")
+    conn.commit()
+
+    record("db.fetch_bars_df", best_of(lambda: repo.fetch_bars_df(source="okx", symbol=SYMBOL, timeframe="1m", asc=True), repeat), n)
+
+    def chunks():
+        for _ in repo.iter_bars_chunks("okx", SYMBOL, "1m", None, None):
+            pass
+
+    record("db.iter_bars_chunks", best_of(chunks, repeat), n)
+    truncate()
+    return out
+
+
+# ===== compare =====
+
+def compare(current: dict, baseline: dict, threshold: float, min_seconds: float) -> List[str]:
+    """Stages slower than baseline * (1 + threshold); stages faster than min_seconds are noise."""
+    regressions = []
+    base = baseline.get("results", {})
+    print(f"\n[bench] vs {baseline.get('meta', {}).get('commit')} (threshold +{threshold:.0%})")
+    for key, cur in current["results"].items():
+        old = base.get(key)
+        if not old:
+            continue
+        ratio = cur["seconds"] / old["seconds"] if old["seconds"] > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold and max(cur["seconds"], old["seconds"]) >= min_seconds:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"[bench] {key:<34} {old['seconds']:9.4f}s -> {cur['seconds']:9.4f}s  x{ratio:5.2f}{flag}")
+    return regressions
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Benchmark the data and feature paths on synthetic bars")
+    ap.add_argument("--sizes", default="10k,1m", help=f"comma list of {','.join(SIZES)} or row counts")
+    ap.add_argument("--repeat", type=int, default=3, help="best of N per stage")
+    ap.add_argument("--no_db", action="store_true", help="skip the DB stages")
+    ap.add_argument("--out", default=None, help="result JSON (default data/bench/<commit>.json)")
+    ap.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    ap.add_argument("--threshold", type=float, default=0.20, help="allowed slowdown before failing")
+    ap.add_argument("--min_seconds", type=float, default=0.005, help="ignore stages faster than this")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    sizes = []
+    for s in args.sizes.split(","):
+        s = s.strip().lower()
+        if s:
+            sizes.append((s, SIZES[s] if s in SIZES else int(s)))
+
+    meta = {
+        **_git_rev(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+    }
+    results: Dict[str, dict] = {}
+
+    with ExitStack() as stack:
+        conn = None if args.no_db else stack.enter_context(throwaway_db(load_config()))
+        for label, n in sizes:
+            print(f"[bench] ===== {label} ({n} rows) =====", flush=True)
+            df = make_bars(n, seed=args.seed)
+            for stage, r in cpu_stages(df, args.repeat).items():
+                results[f"{stage}@{label}"] = r
+            if conn is not None:
+                for stage, r in db_stages(conn, df, args.repeat).items():
+                    results[f"{stage}@{label}"] = r
+            del df
+
+    report = {"meta": meta, "results": results}
+    out = Path(args.out or f"data/bench/{meta['commit'] or 'local'}.json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"[bench] wrote {out}", flush=True)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"[bench] {len(regressions)} regression(s): {', '.join(regressions)}", flush=True)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
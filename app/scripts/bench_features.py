@@ -0,0 +1,141 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.features.engine import IncrementalFeatureEngine
+from app.features.service import compute_features
+
+
+def make_bars(n: int, seed: int = 7) -> pd.DataFrame:
+    """Synthetic 1m OHLCV random walk."""
+    rng = np.random.default_rng(seed)
+    close = 30000.0 + np.cumsum(rng.normal(0.0, 15.0, n))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) + rng.random(n) * 10.0
+    low = np.minimum(open_, close) - rng.random(n) * 10.0
+    return pd.DataFrame({
+        "ts": 1_600_000_000_000 + np.arange(n, dtype=np.int64) * 60_000,
+        "open": open_,
+        "high": high,
+        "low": low,
+        "close": close,
+        "volume": rng.random(n) * 100.0,
+    })
+
+
+def reference_features(df: pd.DataFrame, indicator_cfg: dict, warmup: int) -> pd.DataFrame:
+    """The previous pandas implementation (one rolling pass per window), kept for comparison."""
+    x = df.sort_values("ts").copy()
+    ind = indicator_cfg or {}
+    close = x["close"].astype(float)
+    high = x["high"].astype(float)
+    low = x["low"].astype(float)
+
+    for w in ind.get("ma", {}).get("windows", [5, 10, 20]):
+        x[f"ma_{w}"] = close.rolling(window=w, min_periods=w).mean()
+
+    prev_close = close.shift(1)
+    for w in ind.get("atr", {}).get("windows", [14]):
+        tr = pd.concat([
+            (high - low),
+            (high - prev_close).abs(),
+            (low - prev_close).abs()
+        ], axis=1).max(axis=1)
+        x[f"atr_{w}"] = tr.rolling(window=w, min_periods=w).mean()
+
+    for w in ind.get("rsi", {}).get("windows", [14]):
+        delta = close.diff()
+        gain = delta.clip(lower=0)
+        loss = -delta.clip(upper=0)
+        rs = gain.rolling(w, min_periods=w).mean() / loss.rolling(w, min_periods=w).mean()
+        x[f"rsi_{w}"] = 100 - (100 / (1 + rs))
+
+    macd = ind.get("macd", {})
+    dif = close.ewm(span=macd.get("fast", 12), adjust=False).mean() - \
+        close.ewm(span=macd.get("slow", 26), adjust=False).mean()
+    dea = dif.ewm(span=macd.get("signal", 9), adjust=False).mean()
+    x["macd_dif"] = dif
+    x["macd_dea"] = dea
+    x["macd_hist"] = dif - dea
+
+    x = x.iloc[warmup:].copy()
+    x.replace([np.inf, -np.inf], np.nan, inplace=True)
+    x.dropna(inplace=True)
+    x.reset_index(drop=True, inplace=True)
+    return x
+
+
+def check_incremental(df: pd.DataFrame, indicator_cfg: dict, warmup: int, chunk: int = 1000) -> int:
+    """
+    Feed df through IncrementalFeatureEngine in chunks and compare with
+    compute_features on the same bars. Returns the number of values that
+    are not bit-identical (0 expected).
+    """
+    eng = IncrementalFeatureEngine(indicator_cfg, warmup=warmup)
+    parts = [eng.update("check", "X", "1m", df.iloc[i:i + chunk]) for i in range(0, len(df), chunk)]
+    a = pd.concat([p for p in parts if len(p)], ignore_index=True)
+    b = compute_features(df, indicator_cfg, warmup)
+    if len(a) != len(b) or not np.array_equal(a["ts"].to_numpy(), b["ts"].to_numpy()):
+        return max(len(a), len(b))
+    cols = eng.feature_columns
+    ra = a[cols].to_numpy(dtype=np.float64)
+    rb = b[cols].to_numpy(dtype=np.float64)
+    return int((ra.view(np.int64) != rb.view(np.int64)).sum())
+
+
+def best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark compute_features vs the previous pandas path")
+    ap.add_argument("--rows", default="100000,1000000")
+    ap.add_argument("--windows", type=int, default=12, help="windows per ma/atr/rsi")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--check", action="store_true",
+                    help="also check IncrementalFeatureEngine against compute_features (bit for bit)")
+    ap.add_argument("--check_rows", type=int, default=20000)
+    args = ap.parse_args()
+
+    ws = [5 * (i + 1) for i in range(args.windows)]
+    cfg = {"ma": {"windows": ws}, "atr": {"windows": ws}, "rsi": {"windows": ws}}
+    warmup = max(ws) + 1
+
+    print(f"[bench] windows per indicator={len(ws)} repeat={args.repeat}")
+    for n in [int(x) for x in args.rows.split(",") if x.strip()]:
+        df = make_bars(n)
+
+        t_ref = best_of(lambda: reference_features(df, cfg, warmup), args.repeat)
+        t_new = best_of(lambda: compute_features(df, cfg, warmup), args.repeat)
+
+        a = reference_features(df, cfg, warmup)
+        b = compute_features(df, cfg, warmup)
+        cols = [c for c in a.columns if c != "ts"]
+        ra, rb = a[cols].to_numpy(), b[cols].to_numpy()
+        # abs error scaled by each column's magnitude (RSI near 0 would blow up a plain rel diff)
+        rel = np.abs(ra - rb).max(axis=0) / np.maximum(np.abs(ra).max(axis=0), 1e-12)
+
+        print(
+            f"[bench] rows={n:<9} pandas={t_ref:8.3f}s  kernels={t_new:8.3f}s  "
+            f"speedup={t_ref / t_new:5.1f}x  max_scaled_diff={rel.max():.2e}"
+        )
+
+    if args.check:
+        df = make_bars(args.check_rows)
+        # a few NaN bars too: windows over them must drop out the same way
+        df.loc[df.sample(frac=0.001, random_state=1).index, ["high", "close"]] = np.nan
+        bad = check_incremental(df, cfg, warmup)
+        print(f"[check] incremental vs compute_features rows={args.check_rows} mismatched_values={bad}")
+        if bad:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,74 +1,59 @@
 ﻿from __future__ import annotations
 
+import argparse
 import sys
-from dataclasses import dataclass
-from typing import List, Tuple
+import time
 
 from app.storage.db import load_config, make_conn
+from app.storage.gaps import find_gaps, summarize
 
-MS_1H = 3600000
 
-
-@dataclass(frozen=True)
-class Gap:
-    prev_ts: int
-    next_ts: int
-    diff: int
-
-    @property
-    def missing_bars(self) -> int:
-        # diff=2H => missing 1 bar
-        return max(self.diff // MS_1H - 1, 0)
-
-
-def load_ts(conn, symbol: str, timeframe: str) -> List[int]:
-    sql = """
-    SELECT ts
-    FROM bars
-    WHERE symbol=%s AND timeframe=%s
-    ORDER BY ts ASC;
-    """
-    with conn.cursor() as cur:
-        cur.execute(sql, (symbol, timeframe))
-        return [int(r[0]) for r in cur.fetchall()]
-
-
-def find_gaps(ts_list: List[int], step_ms: int) -> List[Gap]:
-    gaps: List[Gap] = []
-    for a, b in zip(ts_list, ts_list[1:]):
-        diff = b - a
-        if diff != step_ms:
-            gaps.append(Gap(prev_ts=a, next_ts=b, diff=diff))
-    return gaps
+def _split(s: str | None):
+    return [x.strip() for x in (s or "").split(",") if x.strip()] or None
 
 
 def main() -> int:
-    cfg = load_config("app/config/local.yaml")
+    ap = argparse.ArgumentParser(description="Detect gaps in every bars series (one SQL pass)")
+    ap.add_argument("--source", default=None)
+    ap.add_argument("--symbols", default=None, help="default: all symbols")
+    ap.add_argument("--timeframes", default=None, help="default: every timeframe with a known step")
+    ap.add_argument("--start_ts", type=int, default=None)
+    ap.add_argument("--end_ts", type=int, default=None)
+    ap.add_argument("--show", type=int, default=20, help="gaps listed per series")
+    args = ap.parse_args()
+
+    cfg = load_config()
     conn = make_conn(cfg)
 
-    data_cfg = cfg.get("data", {})
-    symbol = data_cfg.get("symbol", "BTC-USDT-SWAP")
-    timeframe = data_cfg.get("timeframe", "1h")
-
-    # 目前只做 1h 检查；后续可以按 timeframe 映射步长
-    step_ms = MS_1H
-
-    ts_list = load_ts(conn, symbol, timeframe)
-    conn.close()
-
-    if len(ts_list) < 2:
-        print(f"[gaps] symbol={symbol} timeframe={timeframe} rows={len(ts_list)} gaps=0 (not enough rows)")
-        return 0
-
-    gaps = find_gaps(ts_list, step_ms)
-
-    print(f"[gaps] symbol={symbol} timeframe={timeframe} rows={len(ts_list)} gaps={len(gaps)} step_ms={step_ms}")
-
-    # 输出前 20 个异常间隔（缺口或异常重复/乱序）
-    for i, g in enumerate(gaps[:20], 1):
-        missing = g.missing_bars
-        kind = "MISSING" if g.diff > step_ms else "ANOMALY"
-        print(f"  {i:02d}. {kind} prev={g.prev_ts} next={g.next_ts} diff={g.diff} missing_bars={missing}")
+    t0 = time.perf_counter()
+    try:
+        gaps = find_gaps(
+            conn,
+            source=args.source,
+            symbols=_split(args.symbols),
+            timeframes=_split(args.timeframes),
+            start_ts=args.start_ts,
+            end_ts=args.end_ts,
+        )
+    finally:
+        conn.close()
+    secs = time.perf_counter() - t0
+
+    stats = summarize(gaps)
+    print(f"[gaps] series_with_gaps={len(stats)} gaps={len(gaps)} scan={secs:.2f}s")
+
+    shown = {}
+    for g in gaps:
+        key = (g.source, g.symbol, g.timeframe)
+        if key not in shown:
+            s = stats[key]
+            print(f"[gaps] source={g.source} symbol={g.symbol} timeframe={g.timeframe} step_ms={g.step_ms} "
+                  f"gaps={s['gaps']} missing_bars={s['missing_bars']} anomalies={s['anomalies']}")
+            shown[key] = 0
+        shown[key] += 1
+        # 输出前 N 个异常间隔（缺口或异常重复/乱序）
+        if shown[key] <= args.show:
+            print(f"  {shown[key]:02d}. {g.kind} prev={g.prev_ts} next={g.next_ts} diff={g.diff} missing_bars={g.missing_bars}")
 
     # 约定：有任何 gap/anomaly => exit code 1
     return 1 if gaps else 0
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import argparse
+import sys
+
+from app.storage.db import load_config, make_conn
+from app.storage.heartbeat_repo import HeartbeatRepository
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Liveness of every service (one query on the heartbeat table)")
+    ap.add_argument("--stale_after", type=int, default=120, help="seconds without a beat before a service is stale")
+    args = ap.parse_args()
+
+    conn = make_conn(load_config())
+    try:
+        rows = HeartbeatRepository(conn).status(stale_after_ms=args.stale_after * 1000)
+    finally:
+        conn.close()
+
+    for r in rows:
+        flag = "STALE" if r.stale else "ok"
+        print(f"[heartbeat] {flag:<5} {r.service:<40} source={r.source} age={r.age_ms / 1000:.0f}s last_seen_ts={r.last_seen_ts}")
+    stale = sum(r.stale for r in rows)
+    print(f"[heartbeat] services={len(rows)} stale={stale}")
+    return 1 if stale else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,107 +1,105 @@
 ﻿from __future__ import annotations
 
-from app.storage.db import load_config, make_conn, migrate
+import argparse
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from app.storage.db import close_pool, get_pool, load_config, migrate
 from app.storage.bar_repo import BarRepository
+from app.storage.gaps import find_gaps, missing_in_ranges
 
 from app.market.okx.client import OKXMarketClient
 from app.market.okx.normalizer import OKXNormalizer
-from app.market.okx.fetcher import MarketFetcher
-
-MS_1H = 3600000
+from app.market.okx.backfill import BackfillEngine, plan_fill_ranges
 
 
-def find_gaps(conn, symbol: str, timeframe: str):
-    sql = """
-    SELECT ts
-    FROM bars
-    WHERE symbol=%s AND timeframe=%s
-    ORDER BY ts ASC;
-    """
-    with conn.cursor() as cur:
-        cur.execute(sql, (symbol, timeframe))
-        ts_list = [int(r[0]) for r in cur.fetchall()]
-
-    gaps = []
-    for a, b in zip(ts_list, ts_list[1:]):
-        diff = b - a
-        if diff > MS_1H:
-            gaps.append((a, b, diff))
-    return gaps
+def _split(s: str | None):
+    return [x.strip() for x in (s or "").split(",") if x.strip()] or None
 
 
 def main():
-    cfg = load_config("app/config/local.yaml")
-
-    conn = make_conn(cfg)
-    migrate(conn)
-    repo = BarRepository(conn)
-
-    market_cfg = cfg.get("market", {})
-    base_url = market_cfg.get("base_url", "https://www.okx.com")
-
+    cfg = load_config()
     data_cfg = cfg.get("data", {})
-    symbol = data_cfg.get("symbol", "BTC-USDT-SWAP")
-    timeframe = data_cfg.get("timeframe", "1h")
-    bar = data_cfg.get("bar", "1H")
-    batch_limit = int(data_cfg.get("limit", 100))
-
-    client = OKXMarketClient(base_url=base_url)
-    normalizer = OKXNormalizer(ts_unit=data_cfg.get("ts_unit", "ms"))
-    fetcher = MarketFetcher(client, normalizer)
-
-    gaps = find_gaps(conn, symbol, timeframe)
-    print(f"[fill] symbol={symbol} timeframe={timeframe} gaps={len(gaps)}")
-
-    # 安全阈值：最多修 50 个缺口，防止误操作跑太久
-    gaps = gaps[:50]
-
-    for idx, (prev_ts, next_ts, diff) in enumerate(gaps, 1):
-        missing = diff // MS_1H - 1
-        print(f"[fill] {idx:02d} prev={prev_ts} next={next_ts} missing={missing}")
-
-        # 我们用 after=next_ts 去拿“早于 next_ts 的数据”，
-        # 然后写入库里，直到 prev_ts 与 next_ts 之间补齐。
-        after_ts = next_ts
-        safety_rounds = 0
-
-        while safety_rounds < 50:
-            safety_rounds += 1
-            bars = fetcher.fetch(
-                symbol=symbol,
-                timeframe=timeframe,
-                bar=bar,
-                limit=batch_limit,
-                after=after_ts,
-                history=True,
-                confirmed_only=True,
-            )
-            if not bars:
-                print("  [fill] no data returned; stop this gap.")
-                break
-
-            repo.upsert_many(bars)
-
-            # 更新 after_ts 继续向过去
-            after_ts = bars[0].ts
-
-            # 判断缺口是否已补齐：库里 prev_ts 和 next_ts 之间是否连续
-            # 轻量做法：只检查“prev_ts + 1H”是否已存在（逐步推进）
-            check_ts = prev_ts + MS_1H
-            with conn.cursor() as cur:
-                cur.execute(
-                    "SELECT 1 FROM bars WHERE symbol=%s AND timeframe=%s AND ts=%s LIMIT 1;",
-                    (symbol, timeframe, check_ts),
-                )
-                ok = cur.fetchone() is not None
-
-            print(f"  [fill] round={safety_rounds} wrote={len(bars)} next_after={after_ts} first_missing_exists={ok}")
-
-            if ok:
-                # 这只是确认缺口开始处有了；完整性再用 check_gaps 复核
-                break
-
-    conn.close()
-    print("[fill] done; run check_gaps to verify.")
+
+    ap = argparse.ArgumentParser(description="Repair gaps in bars from OKX history (planned, concurrent)")
+    ap.add_argument("--source", default="okx")
+    ap.add_argument("--symbols", default=None, help="default: every series with gaps")
+    ap.add_argument("--timeframes", default=None)
+    ap.add_argument("--max_gaps", type=int, default=0, help="per series, 0 = all")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--rate", type=float, default=None, help="requests/s (default: OKX history limit)")
+    ap.add_argument("--dry_run", action="store_true", help="only print the plan")
+    ap.add_argument("--report", default=None, help="write still-missing ranges to this JSON file")
+    args = ap.parse_args()
+
+    pool = get_pool(cfg)
+    migrate(pool)
+    repo = BarRepository(pool)
+
+    try:
+        t0 = time.perf_counter()
+        gaps = find_gaps(pool, source=args.source, symbols=_split(args.symbols), timeframes=_split(args.timeframes))
+
+        by_series = defaultdict(list)
+        anomalies = 0
+        for g in gaps:
+            if g.kind != "MISSING":
+                anomalies += 1
+                continue
+            by_series[(g.symbol, g.timeframe)].append((g.first_missing_ts, g.last_missing_ts))
+        print(f"[fill] series={len(by_series)} gaps={len(gaps) - anomalies} anomalies={anomalies} "
+              f"scan={time.perf_counter() - t0:.2f}s")
+
+        ranges = []
+        plan = {}
+        for (symbol, tf), runs in sorted(by_series.items()):
+            if args.max_gaps:
+                runs = runs[:args.max_gaps]
+            rs = plan_fill_ranges(symbol, tf, runs)
+            plan[(symbol, tf)] = runs
+            ranges.extend(rs)
+            print(f"[fill] plan {symbol} {tf}: gaps={len(runs)} -> requests_ranges={len(rs)}")
+
+        if args.dry_run or not ranges:
+            print("[fill] nothing to fetch" if not ranges else "[fill] dry run, stop.")
+            return
+
+        client = OKXMarketClient.from_config(cfg)
+        engine = BackfillEngine(
+            client, repo,
+            workers=args.workers,
+            rate=args.rate,
+            normalizer=OKXNormalizer(ts_unit=data_cfg.get("ts_unit", "ms")),
+            source=args.source,
+        )
+        progress = engine.run(ranges)
+
+        # ===== verify: one set-based query per series =====
+        report = {}
+        total_left = 0
+        for (symbol, tf), runs in plan.items():
+            left = missing_in_ranges(pool, args.source, symbol, tf, runs)
+            p = progress.get((symbol, tf))
+            n_left = sum(n for _, _, n in left)
+            total_left += n_left
+            print(f"[fill][verify] {symbol} {tf}: inserted={p.inserted if p else 0} still_missing={n_left}"
+                  + (f" ranges={len(left)}" if left else ""))
+            for first, last, n in left[:20]:
+                print(f"  exchange has no data: first={first} last={last} bars={n}")
+            if left:
+                report[f"{symbol}|{tf}"] = [{"first_ts": a, "last_ts": b, "bars": n} for a, b, n in left]
+
+        if args.report:
+            Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+            with open(args.report, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"[fill] report -> {args.report}")
+
+        print(f"[fill] done in {time.perf_counter() - t0:.1f}s; bars the exchange could not supply: {total_left}")
+    finally:
+        close_pool()
 
 
 if __name__ == "__main__":
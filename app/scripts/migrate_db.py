@@ -1,17 +1,47 @@
-from app.storage.db import load_config, make_conn, migrate
+import argparse
+
+from app.storage import migrations
+from app.storage.db import checkout, close_pool, get_pool, load_config, migrate
+from app.storage.partitions import MONTHLY_TIMEFRAMES, MONTHS_AHEAD, drop_bar_partitions_before
+
 
 def main():
+    ap = argparse.ArgumentParser(description="Versioned DB migrations + bars partition maintenance")
+    ap.add_argument("--status", action="store_true", help="list migrations and exit")
+    ap.add_argument("--target", type=int, default=None, help="migrate up to this version (default: latest)")
+    ap.add_argument("--months_ahead", type=int, default=MONTHS_AHEAD, help="bars month partitions to create ahead")
+    ap.add_argument("--drop_before_ts", type=int, default=None,
+                    help="retention: drop bars month partitions that end at or before this ts (ms)")
+    ap.add_argument("--timeframes", default=",".join(MONTHLY_TIMEFRAMES), help="timeframes for --drop_before_ts")
+    args = ap.parse_args()
+
     # 1. 加载配置
     cfg = load_config()
 
-    # 2. 建立数据库连接（用于连通性验证）
-    conn = make_conn(cfg)
+    # 2. 连接池（借出连接时即验证连通性）
+    pool = get_pool(cfg)
+
+    try:
+        if args.status:
+            with checkout(pool) as conn:
+                for version, name, applied_at in migrations.status(conn):
+                    print(f"{version:04d}_{name:<24} {applied_at or 'pending'}")
+            return
 
-    # 3. 执行数据库迁移（migrate 自己处理连接）
-    migrate()
+        # 3. 执行数据库迁移（从池里借连接）
+        migrate(pool, target=args.target, months_ahead=args.months_ahead)
 
-    # 4. 关闭连接
-    conn.close()
+        # 4. 可选：按月整块删除旧分区
+        if args.drop_before_ts is not None:
+            tfs = [x.strip() for x in args.timeframes.split(",") if x.strip()]
+            with checkout(pool) as conn, migrations.locked(conn):
+                with conn.cursor() as cur:
+                    dropped = drop_bar_partitions_before(cur, args.drop_before_ts, tfs)
+                conn.commit()
+            print(f"[migrate] dropped {len(dropped)} partition(s)" + (f": {', '.join(dropped)}" if dropped else ""))
+    finally:
+        # 5. 关闭连接
+        close_pool()
 
     print("DB migrate OK")
 
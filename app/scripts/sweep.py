@@ -0,0 +1,89 @@
+"""
+Parallel parameter sweep.
+
+    python -m app.scripts.sweep --config app/config/sweep.yaml --workers 8
+    python -m app.scripts.sweep --timeframe 1m --metric total_return --out data/sweep/btc_1m.csv
+
+Bars are read once (DB or --bars_csv), placed in shared memory and swept
+over a process pool; see app/strategy/sweep.py.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from app.storage.bar_repo import BarRepository
+from app.storage.db import load_config, make_conn
+from app.strategy.sweep import RESULT_METRICS, ResultTable, expand_grid, load_sweep_config, run_sweep
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Parallel strategy parameter sweep (shared-memory bars, process pool)")
+    ap.add_argument("--config", default="app/config/sweep.yaml")
+    ap.add_argument("--symbol", default=None)
+    ap.add_argument("--timeframe", default=None)
+    ap.add_argument("--start_ts", type=int, default=None)
+    ap.add_argument("--end_ts", type=int, default=None)
+    ap.add_argument("--bars_csv", default=None, help="read bars from CSV instead of the DB")
+    ap.add_argument("--metric", default=None, choices=RESULT_METRICS)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunk", type=int, default=None, help="grid points per task (default: ~4 tasks per worker)")
+    ap.add_argument("--max_columns", type=int, default=32, help="indicator columns cached per worker")
+    ap.add_argument("--out", default=None, help="result CSV (default <out_dir>/<symbol>_<timeframe>_<metric>.csv)")
+    ap.add_argument("--top", type=int, default=20)
+    args = ap.parse_args()
+
+    scfg = load_sweep_config(args.config)
+    symbol = args.symbol or scfg.symbol
+    timeframe = args.timeframe or scfg.timeframe
+    metric = args.metric or scfg.metric
+    start_ts = args.start_ts if args.start_ts is not None else scfg.start_ts
+    end_ts = args.end_ts if args.end_ts is not None else scfg.end_ts
+
+    points, skipped = expand_grid(scfg.strategies)
+    print(f"[sweep] grid points={len(points)} skipped_invalid={skipped} "
+          f"strategies={','.join(scfg.strategies)}", flush=True)
+    if not points:
+        return 1
+
+    t0 = time.perf_counter()
+    if args.bars_csv:
+        bars = pd.read_csv(args.bars_csv)
+    else:
+        conn = make_conn(load_config())
+        try:
+            bars = BarRepository(conn).fetch_bars_df(
+                source=scfg.source, symbol=symbol, timeframe=timeframe,
+                start_ts=start_ts, end_ts=end_ts, asc=True,
+            )
+        finally:
+            conn.close()
+    if bars.empty:
+        print(f"[sweep] no bars. symbol={symbol} timeframe={timeframe}", flush=True)
+        return 1
+    print(f"[sweep] loaded {len(bars)} bars in {time.perf_counter() - t0:.2f}s", flush=True)
+
+    out = args.out or str(Path(scfg.out_dir) / f"{symbol}_{timeframe}_{metric}.csv")
+    table = ResultTable(out, metric=metric, ascending=scfg.ascending, top=args.top)
+    df = run_sweep(
+        bars, points, table, timeframe,
+        bt_cfg=scfg.backtest_config(),
+        warmup=scfg.warmup,
+        workers=args.workers,
+        chunk=args.chunk,
+        max_columns=args.max_columns,
+    )
+
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(df.head(args.top).to_string(index=False, float_format=lambda v: f"{v:.4g}"))
+    print(f"[sweep] -> {out}", flush=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,414 @@
+# app/storage/bar_cache.py
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.common.metrics import REGISTRY
+from app.common.types import BarBatch
+from app.storage.bar_repo import BAR_COLS, BAR_DTYPE, BarRepository, bars_to_columns
+
+CACHE_READS = REGISTRY.counter("quant_bar_cache_reads_total", "Bar cache reads by result (hit / miss)", ("result",))
+CACHE_WARMS = REGISTRY.counter("quant_bar_cache_warms_total", "Series loaded from the DB into the bar cache")
+CACHE_EVICTIONS = REGISTRY.counter("quant_bar_cache_evictions_total", "Series evicted from the bar cache (LRU)")
+CACHE_SERIES = REGISTRY.gauge("quant_bar_cache_series", "Series held in the bar cache")
+
+Key = Tuple[str, str, str]  # (source, symbol, timeframe)
+
+
+def _unique_sorted(cols: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Ascending ts, duplicate ts keep the last occurrence."""
+    ts = cols["ts"]
+    if len(ts) < 2 or (ts[1:] > ts[:-1]).all():
+        return cols
+    order = np.argsort(ts, kind="stable")
+    ts_sorted = ts[order]
+    idx = order[np.r_[ts_sorted[1:] != ts_sorted[:-1], True]]
+    return {c: a[idx] for c, a in cols.items()}
+
+
+def _concat(a: Dict[str, np.ndarray], b: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {c: np.concatenate([a[c], b[c]]) for c in BAR_COLS}
+
+
+def _head(cols: Dict[str, np.ndarray], n: Optional[int]) -> Dict[str, np.ndarray]:
+    return cols if n is None else {c: a[:n] for c, a in cols.items()}
+
+
+def _tail(cols: Dict[str, np.ndarray], n: Optional[int]) -> Dict[str, np.ndarray]:
+    if n is None:
+        return cols
+    return {c: a[len(a) - min(n, len(a)):] for c, a in cols.items()}
+
+
+def _df_columns(df: pd.DataFrame, reverse: bool = False) -> Dict[str, np.ndarray]:
+    step = -1 if reverse else 1
+    return {c: df[c].to_numpy()[::step] for c in BAR_COLS} if len(df) else {
+        "ts": np.empty(0, np.int64), **{c: np.empty(0, np.float64) for c in BAR_COLS[1:]}
+    }
+
+
+class _Ring:
+    """
+    The newest `capacity` bars of one series, ascending ts.
+
+    Rows live in [lo, hi) of arrays sized 2 * capacity. When hi reaches the
+    end, the live window is copied back to the front (once per `capacity`
+    appends), so the window is always one contiguous slice: reads are plain
+    slices and ts lookups a searchsorted, with no wrap-around handling.
+    """
+
+    __slots__ = ("capacity", "cols", "lo", "hi", "warmed", "complete")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.cols = {"ts": np.empty(2 * capacity, np.int64)}
+        for c in BAR_COLS[1:]:
+            self.cols[c] = np.empty(2 * capacity, np.float64)
+        self.lo = self.hi = 0
+        self.warmed = False     # DB tail merged in
+        self.complete = False   # the DB has nothing older than the first cached bar
+
+    def __len__(self) -> int:
+        return self.hi - self.lo
+
+    @property
+    def first_ts(self) -> Optional[int]:
+        return int(self.cols["ts"][self.lo]) if self.hi > self.lo else None
+
+    @property
+    def last_ts(self) -> Optional[int]:
+        return int(self.cols["ts"][self.hi - 1]) if self.hi > self.lo else None
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.cols.values())
+
+    def window(self, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Copy of the cached bars with start_ts <= ts <= end_ts."""
+        ts = self.cols["ts"][self.lo:self.hi]
+        i = 0 if start_ts is None else int(np.searchsorted(ts, start_ts, side="left"))
+        j = len(ts) if end_ts is None else int(np.searchsorted(ts, end_ts, side="right"))
+        return {c: a[self.lo + i:self.lo + j].copy() for c, a in self.cols.items()}
+
+    def put_row(self, ts: int, o: float, h: float, l: float, c: float, v: float) -> None:
+        last = self.last_ts
+        if last is not None and ts < last:
+            self.merge({"ts": np.array([ts], np.int64), "open": np.array([o]), "high": np.array([h]),
+                        "low": np.array([l]), "close": np.array([c]), "volume": np.array([v])})
+            return
+        if last is None or ts > last:
+            self._make_room(1)
+            self.hi += 1
+        i = self.hi - 1
+        cols = self.cols
+        cols["ts"][i] = ts
+        cols["open"][i] = o
+        cols["high"][i] = h
+        cols["low"][i] = l
+        cols["close"][i] = c
+        cols["volume"][i] = v
+
+    def put_many(self, cols: Dict[str, np.ndarray]) -> None:
+        cols = _unique_sorted(cols)
+        n = len(cols["ts"])
+        if n == 0:
+            return
+        last = self.last_ts
+        if last is not None and int(cols["ts"][0]) <= last:
+            self.merge(cols)
+            return
+        if n >= self.capacity:
+            self._reset(_tail(cols, self.capacity), complete=False)
+            return
+        self._make_room(n)
+        for c, a in self.cols.items():
+            a[self.hi:self.hi + n] = cols[c]
+        self.hi += n
+
+    def merge(self, cols: Dict[str, np.ndarray], complete: Optional[bool] = None) -> None:
+        """Slow path: bars older than / overlapping the window. `cols` wins on equal ts."""
+        merged = _unique_sorted(_concat(self.window(), cols))
+        n = len(merged["ts"])
+        keep = min(n, self.capacity)
+        if complete is None:
+            complete = self.complete
+        self._reset(_tail(merged, keep), complete=complete and keep == n)
+
+    def load(self, db_cols: Dict[str, np.ndarray], complete: bool) -> None:
+        """Merge the DB tail under what was put since (cached rows win)."""
+        merged = _unique_sorted(_concat(db_cols, self.window()))
+        n = len(merged["ts"])
+        keep = min(n, self.capacity)
+        self._reset(_tail(merged, keep), complete=complete and keep == n)
+        self.warmed = True
+
+    def _make_room(self, n: int) -> None:
+        cap = self.capacity
+        size = self.hi - self.lo
+        if self.hi + n > 2 * cap:
+            keep = min(size, cap - n)
+            src = self.hi - keep
+            for a in self.cols.values():
+                a[:keep] = a[src:self.hi]
+            self.lo, self.hi = 0, keep
+            if keep < size:
+                self.complete = False
+        elif size + n > cap:
+            self.lo = self.hi + n - cap
+            self.complete = False
+
+    def _reset(self, cols: Dict[str, np.ndarray], complete: bool) -> None:
+        n = len(cols["ts"])
+        for c, a in self.cols.items():
+            a[:n] = cols[c]
+        self.lo, self.hi = 0, n
+        self.complete = complete
+
+
+class BarCache:
+    """
+    In-process cache of the newest bars per (source, symbol, timeframe).
+
+    Each series is a fixed-capacity NumPy ring (`capacity` bars); at most
+    `max_series` series are held, the least recently used one is evicted.
+    Ingest paths put() closed bars as they write them, so reads see bars the
+    write-behind queue has not committed yet.
+
+    Reads are read-through: the first read of a series loads its newest
+    `capacity` bars from the repository; tail and range reads inside the
+    cached window are served from memory, anything older is fetched from the
+    DB and joined with the cached part. get_ts_range / fetch_bars_df /
+    iter_bars_chunks match BarRepository, so the cache can stand in for the
+    repository on the read side (features pipeline, strategies).
+
+    The cache only sees writes made through it; after an out-of-band repair
+    (fill_gaps, backfill) of a cached series call invalidate().
+    """
+
+    def __init__(self, repo: BarRepository, capacity: int = 5_000, max_series: int = 128, source: str = "okx"):
+        if capacity < 1 or max_series < 1:
+            raise ValueError("capacity and max_series must be >= 1")
+        self.repo = repo
+        self.capacity = int(capacity)
+        self.max_series = int(max_series)
+        self.source = source
+        self._series: "OrderedDict[Key, _Ring]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.warms = 0
+        self.evictions = 0
+        CACHE_SERIES.set_function(lambda: len(self._series))
+
+    @classmethod
+    def from_config(cls, repo: BarRepository, cfg: dict, source: str = "okx") -> "BarCache":
+        """local.yaml: cache.capacity / cache.max_series"""
+        c = cfg.get("cache") or {}
+        return cls(repo, capacity=int(c.get("capacity", 5_000)), max_series=int(c.get("max_series", 128)), source=source)
+
+    # ===== writes (ingest) =====
+
+    def put(self, symbol: str, timeframe: str, row, source: Optional[str] = None) -> None:
+        """One bar (ts, open, high, low, close, volume); same ts replaces."""
+        ts, o, h, l, c, v = row[:6]
+        key = (source or self.source, symbol, timeframe)
+        with self._lock:
+            self._ring(key).put_row(int(ts), float(o), float(h), float(l), float(c), float(v))
+
+    def put_many(self, symbol: str, timeframe: str, data: Any, source: Optional[str] = None) -> None:
+        """Bars in any form bars_to_columns accepts (BarBatch, DataFrame, rows ...)."""
+        cols = bars_to_columns(data)
+        if len(cols["ts"]) == 0:
+            return
+        key = (source or self.source, symbol, timeframe)
+        with self._lock:
+            self._ring(key).put_many(cols)
+
+    def invalidate(self, symbol: Optional[str] = None, timeframe: Optional[str] = None,
+                   source: Optional[str] = None) -> int:
+        """Drop matching series (None matches all). Returns series dropped."""
+        with self._lock:
+            keys = [k for k in self._series
+                    if (source is None or k[0] == source)
+                    and (symbol is None or k[1] == symbol)
+                    and (timeframe is None or k[2] == timeframe)]
+            for k in keys:
+                del self._series[k]
+        return len(keys)
+
+    # ===== reads =====
+
+    def tail(self, symbol: str, timeframe: str, n: int, source: Optional[str] = None) -> BarBatch:
+        """Newest n bars, ascending."""
+        key = (source or self.source, symbol, timeframe)
+        return BarBatch.from_columns(symbol, timeframe, self._read(key, None, None, n, newest=True), source=key[0])
+
+    def range(self, symbol: str, timeframe: str, start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+              source: Optional[str] = None) -> BarBatch:
+        """Bars with start_ts <= ts <= end_ts (inclusive, like the repository), ascending."""
+        key = (source or self.source, symbol, timeframe)
+        return BarBatch.from_columns(symbol, timeframe, self._read(key, start_ts, end_ts, None), source=key[0])
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = sum(len(r) for r in self._series.values())
+            nbytes = sum(r.nbytes() for r in self._series.values())
+            series = len(self._series)
+        return {
+            "series": series,
+            "max_series": self.max_series,
+            "capacity": self.capacity,
+            "rows": rows,
+            "mb": round(nbytes / 1e6, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "warms": self.warms,
+            "evictions": self.evictions,
+        }
+
+    # ===== BarRepository-compatible reads =====
+
+    def get_ts_range(self, source: str, symbol: str, timeframe: str) -> Optional[Tuple[int, int]]:
+        ring = self._warm((source, symbol, timeframe))
+        with self._lock:
+            first, last, complete = ring.first_ts, ring.last_ts, ring.complete
+        if last is not None and complete:
+            return first, last
+        have = self.repo.get_ts_range(source, symbol, timeframe)
+        if have is None:
+            return None if last is None else (first, last)
+        return have[0], max(have[1], last if last is not None else have[1])
+
+    def fetch_bars_df(
+        self,
+        source: str,
+        symbol: str,
+        timeframe: str,
+        start_ts: int | None = None,
+        end_ts: int | None = None,
+        limit: int | None = None,
+        asc: bool = True,
+    ):
+        cols = self._read((source, symbol, timeframe), start_ts, end_ts, limit, newest=not asc)
+        if not asc:
+            cols = {c: a[::-1] for c, a in cols.items()}
+        return pd.DataFrame(cols)
+
+    def iter_bars_chunks(
+        self,
+        source: str,
+        symbol: str,
+        timeframe: str,
+        start_ts: int | None = None,
+        end_ts: int | None = None,
+        chunk_rows: int = 500_000,
+        limit: int | None = None,
+        structured: bool = False,
+    ) -> Iterator[Any]:
+        """Same contract as BarRepository.iter_bars_chunks; the part older than the cache streams from the DB."""
+        key = (source, symbol, timeframe)
+        ring = self._warm(key)
+        with self._lock:
+            mem = ring.window(start_ts, end_ts)
+            covered = self._covers(ring, start_ts)
+            first = ring.first_ts
+        self._count(covered)
+
+        sent = 0
+        if not covered:
+            db_end = first - 1 if first is not None else end_ts
+            if end_ts is not None:
+                db_end = min(db_end, end_ts)
+            for chunk in self.repo.iter_bars_chunks(source, symbol, timeframe, start_ts, db_end,
+                                                    chunk_rows=chunk_rows, limit=limit, structured=structured):
+                sent += len(chunk["ts"])
+                yield chunk
+        if limit is not None:
+            mem = _head(mem, max(limit - sent, 0))
+        n = len(mem["ts"])
+        for i in range(0, n, chunk_rows):
+            part = {c: a[i:i + chunk_rows] for c, a in mem.items()}
+            if structured:
+                rec = np.empty(len(part["ts"]), dtype=BAR_DTYPE)
+                for c in BAR_COLS:
+                    rec[c] = part[c]
+                part = rec
+            yield part
+
+    # ===== internals =====
+
+    def _ring(self, key: Key) -> _Ring:
+        """Get or create under the lock; creating may evict the LRU series."""
+        ring = self._series.get(key)
+        if ring is None:
+            ring = self._series[key] = _Ring(self.capacity)
+            while len(self._series) > self.max_series:
+                self._series.popitem(last=False)
+                self.evictions += 1
+                CACHE_EVICTIONS.inc()
+        else:
+            self._series.move_to_end(key)
+        return ring
+
+    def _warm(self, key: Key) -> _Ring:
+        with self._lock:
+            ring = self._series.get(key)
+            if ring is not None and ring.warmed:
+                self._series.move_to_end(key)
+                return ring
+        # DB read outside the lock: ingest keeps putting meanwhile, load() merges under it
+        df = self.repo.fetch_bars_df(source=key[0], symbol=key[1], timeframe=key[2], limit=self.capacity, asc=False)
+        db_cols = _df_columns(df, reverse=True)
+        with self._lock:
+            ring = self._ring(key)
+            if not ring.warmed:
+                ring.load(db_cols, complete=len(df) < self.capacity)
+                self.warms += 1
+                CACHE_WARMS.inc()
+        return ring
+
+    @staticmethod
+    def _covers(ring: _Ring, start_ts: Optional[int]) -> bool:
+        if ring.complete:
+            return True
+        first = ring.first_ts
+        return first is not None and start_ts is not None and start_ts >= first
+
+    def _count(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+            CACHE_READS.inc(1, "hit")
+        else:
+            self.misses += 1
+            CACHE_READS.inc(1, "miss")
+
+    def _read(self, key: Key, start_ts: Optional[int], end_ts: Optional[int], limit: Optional[int],
+              newest: bool = False) -> Dict[str, np.ndarray]:
+        """Ascending columns for [start_ts, end_ts]; `limit` takes the newest (newest=True) or oldest rows."""
+        ring = self._warm(key)
+        with self._lock:
+            mem = ring.window(start_ts, end_ts)
+            covered = self._covers(ring, start_ts)
+            first = ring.first_ts
+        m = len(mem["ts"])
+        if covered or (newest and limit is not None and m >= limit):
+            self._count(True)
+            return _tail(mem, limit) if newest else _head(mem, limit)
+
+        self._count(False)
+        source, symbol, timeframe = key
+        db_end = first - 1 if first is not None else end_ts
+        if end_ts is not None:
+            db_end = min(db_end, end_ts)
+        if newest and limit is not None:
+            df = self.repo.fetch_bars_df(source=source, symbol=symbol, timeframe=timeframe,
+                                         start_ts=start_ts, end_ts=db_end, limit=limit - m, asc=False)
+            return _concat(_df_columns(df, reverse=True), mem)
+        df = self.repo.fetch_bars_df(source=source, symbol=symbol, timeframe=timeframe,
+                                     start_ts=start_ts, end_ts=db_end, limit=limit, asc=True)
+        return _head(_concat(_df_columns(df), mem), limit)
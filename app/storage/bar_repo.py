@@ -1,12 +1,132 @@
 # app/storage/bar_repo.py
 
-from typing import Iterable, Tuple, Optional
+import io
+import struct
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, Tuple, Optional
+
+import numpy as np
 from psycopg2.extras import execute_values
 import pandas as pd
 
+from app.common.types import BAR_FIELDS, BarBatch
+from app.storage.db import ConnectionPool, checkout
+
+BAR_COLS = BAR_FIELDS
+
+
+@dataclass(frozen=True)
+class BulkUpsertResult:
+    rows: int          # distinct ts sent
+    inserted: int
+    updated: int       # existing rows whose values changed
+    unchanged: int     # existing rows with identical values (not rewritten)
+    max_ts: Optional[int]
+
+
+def bars_to_columns(data: Any) -> Dict[str, np.ndarray]:
+    """
+    Normalize bars to column arrays (ts int64, OHLCV float64).
+
+    Accepts a BarBatch (its arrays, no copy), a DataFrame / dict of arrays /
+    structured array with columns ts, open, high, low, close, volume, a 2D
+    array of shape (n, 6) in that order, or an iterable of
+    (ts, open, high, low, close, volume) rows.
+    """
+    if isinstance(data, BarBatch):
+        return data.columns()
+    if isinstance(data, pd.DataFrame):
+        cols = {c: data[c].to_numpy() for c in BAR_COLS}
+    elif isinstance(data, dict):
+        cols = {c: np.asarray(data[c]) for c in BAR_COLS}
+    elif isinstance(data, np.ndarray) and data.dtype.names:
+        cols = {c: data[c] for c in BAR_COLS}
+    else:
+        arr = data if isinstance(data, np.ndarray) else np.array(list(data), dtype=np.float64)
+        if arr.size == 0:
+            arr = arr.reshape(0, len(BAR_COLS))
+        if arr.ndim != 2 or arr.shape[1] < len(BAR_COLS):
+            raise ValueError(f"expected (n, 6) bars, got shape {arr.shape}")
+        cols = {c: arr[:, i] for i, c in enumerate(BAR_COLS)}
+
+    out = {"ts": np.asarray(cols["ts"]).astype(np.int64)}
+    for c in BAR_COLS[1:]:
+        out[c] = np.asarray(cols[c], dtype=np.float64)
+    return out
+
+
+# PostgreSQL binary COPY: header, then per tuple int16 field count and
+# (int32 length, big-endian value) per field, then an int16 -1 trailer.
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack("!h", -1)
+_PGCOPY_ROW = np.dtype([
+    ("nfields", ">i2"),
+    ("ts_len", ">i4"), ("ts", ">i8"),
+    ("open_len", ">i4"), ("open", ">f8"),
+    ("high_len", ">i4"), ("high", ">f8"),
+    ("low_len", ">i4"), ("low", ">f8"),
+    ("close_len", ">i4"), ("close", ">f8"),
+    ("volume_len", ">i4"), ("volume", ">f8"),
+])
+
+
+BAR_DTYPE = np.dtype([
+    ("ts", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+
+
+def _parse_pgcopy(buf) -> np.ndarray:
+    """
+    Parse a binary COPY TO payload of (ts, open, high, low, close, volume) into
+    a big-endian record view over `buf` (no per-row Python objects).
+    """
+    mv = memoryview(buf)
+    if bytes(mv[:11]) != _PGCOPY_HEADER[:11]:
+        raise ValueError("not a binary COPY payload")
+    ext_len = struct.unpack_from("!i", mv, 15)[0]
+    off = 19 + ext_len
+    n, rem = divmod(len(mv) - off - len(_PGCOPY_TRAILER), _PGCOPY_ROW.itemsize)
+    if rem != 0 or bytes(mv[len(mv) - 2:]) != _PGCOPY_TRAILER:
+        raise ValueError("unexpected binary COPY layout (NULLs or other columns?)")
+
+    rec = np.frombuffer(mv, dtype=_PGCOPY_ROW, count=n, offset=off)
+    if n and (rec["nfields"] != len(BAR_COLS)).any():
+        raise ValueError("unexpected field count in binary COPY payload")
+    return rec
+
+
+def _records_to_columns(rec: np.ndarray) -> Dict[str, np.ndarray]:
+    # byte-swap into native contiguous arrays
+    out = {"ts": rec["ts"].astype(np.int64)}
+    for c in BAR_COLS[1:]:
+        out[c] = rec[c].astype(np.float64)
+    return out
+
+
+def _records_to_structured(rec: np.ndarray) -> np.ndarray:
+    out = np.empty(len(rec), dtype=BAR_DTYPE)
+    for c in BAR_COLS:
+        out[c] = rec[c]
+    return out
+
+
+def _pgcopy_payload(cols: Dict[str, np.ndarray]) -> bytes:
+    n = len(cols["ts"])
+    rec = np.empty(n, dtype=_PGCOPY_ROW)
+    rec["nfields"] = len(BAR_COLS)
+    for c in BAR_COLS:
+        rec[f"{c}_len"] = 8
+        rec[c] = cols[c]
+    return _PGCOPY_HEADER + rec.tobytes() + _PGCOPY_TRAILER
+
 class BarRepository:
     def __init__(self, conn):
-        # 这里不再检查 cfg，而是直接接收 conn
+        # 这里不再检查 cfg，而是直接接收 conn（或 ConnectionPool：每次调用借一个连接）
         self.conn = conn
 
     def upsert_bars(
@@ -18,7 +138,7 @@ class BarRepository:
     ):
         """
         rows: iterable of tuples
-          (ts, open, high, low, close, volume)
+          (ts, open, high, low, close, volume), or a BarBatch
         """
         sql = """
         INSERT INTO bars (
@@ -32,21 +152,133 @@ class BarRepository:
             low = EXCLUDED.low,
             close = EXCLUDED.close,
             volume = EXCLUDED.volume,
-            inserted_at = now()
-        RETURNING ts;
+            inserted_at = now();
         """
 
+        if isinstance(rows, BarBatch):
+            rows = rows.rows()
         values = [
             (source, symbol, timeframe, ts, o, h, l, c, v)
             for (ts, o, h, l, c, v) in rows
         ]
+        if not values:
+            return 0, None
 
-        with self.conn.cursor() as cur:
-            execute_values(cur, sql, values)
-            latest = cur.fetchone()
-        self.conn.commit()
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, sql, values)
+            conn.commit()
 
-        return len(values), (latest[0] if latest else None)
+        latest = max(int(v[3]) for v in values)
+        return len(values), latest
+
+    def bulk_upsert_bars(
+        self,
+        symbol: str,
+        timeframe: str,
+        data: Any,
+        source: str = "okx",
+        commit: bool = True,
+    ) -> BulkUpsertResult:
+        """
+        Bulk path for large writes (backfills, aggregations).
+
+        Streams bars with binary COPY into a temp staging table, then merges with
+        one INSERT ... ON CONFLICT. Rows whose values did not change are not
+        rewritten. Duplicate ts in `data` keep the last occurrence.
+
+        data: DataFrame / dict of arrays / structured or (n, 6) ndarray, see bars_to_columns
+        commit=False leaves the transaction open for the caller, so it needs a
+        plain connection rather than a pool.
+        """
+        if not commit and isinstance(self.conn, ConnectionPool):
+            raise ValueError("commit=False needs a connection, not a pool")
+        cols = bars_to_columns(data)
+        n = len(cols["ts"])
+        if n == 0:
+            return BulkUpsertResult(0, 0, 0, 0, None)
+
+        # dedupe on ts, keep last (ON CONFLICT can't touch the same row twice)
+        order = np.argsort(cols["ts"], kind="stable")
+        ts_sorted = cols["ts"][order]
+        last = np.r_[ts_sorted[1:] != ts_sorted[:-1], True]
+        if not last.all() or not (order == np.arange(n)).all():
+            idx = order[last]
+            cols = {c: a[idx] for c, a in cols.items()}
+            n = len(idx)
+
+        merge_sql = """
+        WITH up AS (
+            INSERT INTO bars (
+                source, symbol, timeframe,
+                ts, open, high, low, close, volume
+            )
+            SELECT %s, %s, %s, ts, open, high, low, close, volume
+            FROM bars_stage
+            ON CONFLICT (source, symbol, timeframe, ts)
+            DO UPDATE SET
+                open = EXCLUDED.open,
+                high = EXCLUDED.high,
+                low = EXCLUDED.low,
+                close = EXCLUDED.close,
+                volume = EXCLUDED.volume,
+                inserted_at = now()
+            WHERE (bars.open, bars.high, bars.low, bars.close, bars.volume)
+                IS DISTINCT FROM
+                  (EXCLUDED.open, EXCLUDED.high, EXCLUDED.low, EXCLUDED.close, EXCLUDED.volume)
+            RETURNING (xmax = 0) AS is_insert
+        )
+        SELECT
+            count(*) FILTER (WHERE is_insert),
+            count(*) FILTER (WHERE NOT is_insert)
+        FROM up;
+        """
+
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                CREATE TEMP TABLE IF NOT EXISTS bars_stage (
+                    ts BIGINT NOT NULL,
+                    open DOUBLE PRECISION NOT NULL,
+                    high DOUBLE PRECISION NOT NULL,
+                    low DOUBLE PRECISION NOT NULL,
+                    close DOUBLE PRECISION NOT NULL,
+                    volume DOUBLE PRECISION NOT NULL
+                ) ON COMMIT DELETE ROWS;
+                """)
+                cur.execute("TRUNCATE bars_stage;")
+                cur.copy_expert(
+                    "COPY bars_stage (ts, open, high, low, close, volume) FROM STDIN WITH (FORMAT binary)",
+                    io.BytesIO(_pgcopy_payload(cols)),
+                )
+                cur.execute(merge_sql, (source, symbol, timeframe))
+                inserted, updated = cur.fetchone()
+            if commit:
+                conn.commit()
+
+        return BulkUpsertResult(
+            rows=n,
+            inserted=int(inserted),
+            updated=int(updated),
+            unchanged=n - int(inserted) - int(updated),
+            max_ts=int(cols["ts"].max()),
+        )
+
+    def get_ts_range(self, source: str, symbol: str, timeframe: str) -> Optional[Tuple[int, int]]:
+        """(min ts, max ts) of one series, or None when empty. Two PK index probes."""
+        sql = """
+        SELECT
+            (SELECT ts FROM bars WHERE source = %s AND symbol = %s AND timeframe = %s ORDER BY ts ASC LIMIT 1),
+            (SELECT ts FROM bars WHERE source = %s AND symbol = %s AND timeframe = %s ORDER BY ts DESC LIMIT 1);
+        """
+        key = (source, symbol, timeframe)
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, key + key)
+                lo, hi = cur.fetchone()
+        if lo is None:
+            return None
+        return int(lo), int(hi)
 
     def fetch_bars_df(
         self,
@@ -83,5 +315,77 @@ class BarRepository:
             sql += " LIMIT %s"
             params.append(limit)
 
-        df = pd.read_sql(sql, self.conn, params=params)
-        return df
\ No newline at end of file
+        return pd.DataFrame(self._copy_select(sql, params))
+
+    def _copy_select(self, sql: str, params) -> Dict[str, np.ndarray]:
+        """Run a SELECT of BAR_COLS through binary COPY TO and return column arrays."""
+        return _records_to_columns(self._copy_select_records(sql, params))
+
+    def _copy_select_records(self, sql: str, params) -> np.ndarray:
+        buf = io.BytesIO()
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                q = cur.mogrify(sql, params).decode("utf-8")
+                cur.copy_expert(f"COPY ({q}) TO STDOUT WITH (FORMAT binary)", buf)
+        return _parse_pgcopy(buf.getbuffer())
+
+    def iter_bars_chunks(
+        self,
+        source: str,
+        symbol: str,
+        timeframe: str,
+        start_ts: int | None = None,
+        end_ts: int | None = None,
+        chunk_rows: int = 500_000,
+        limit: int | None = None,
+        structured: bool = False,
+    ) -> Iterator[Any]:
+        """
+        Stream bars in ascending ts, at most `chunk_rows` per chunk.
+
+        Each chunk is one keyset-paginated query (ts > last ts of the previous
+        chunk) read through binary COPY TO, so memory stays bounded by the chunk
+        size and no transaction / server-side cursor is held between chunks.
+
+        Yields dicts of column arrays (ts int64, OHLCV float64), or structured
+        arrays of BAR_DTYPE when structured=True.
+        """
+        after = None
+        sent = 0
+        while True:
+            n = chunk_rows if limit is None else min(chunk_rows, limit - sent)
+            if n <= 0:
+                return
+
+            sql = """
+            SELECT
+                ts, open, high, low, close, volume
+            FROM bars
+            WHERE source = %s
+              AND symbol = %s
+              AND timeframe = %s
+            """
+            params = [source, symbol, timeframe]
+            if after is not None:
+                sql += " AND ts > %s"
+                params.append(after)
+            elif start_ts is not None:
+                sql += " AND ts >= %s"
+                params.append(start_ts)
+            if end_ts is not None:
+                sql += " AND ts <= %s"
+                params.append(end_ts)
+            sql += " ORDER BY ts ASC LIMIT %s"
+            params.append(n)
+
+            rec = self._copy_select_records(sql, params)
+            k = len(rec)
+            if k == 0:
+                return
+
+            after = int(rec["ts"][-1])
+            sent += k
+            yield _records_to_structured(rec) if structured else _records_to_columns(rec)
+
+            if k < n:
+                return
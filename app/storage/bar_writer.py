@@ -0,0 +1,294 @@
+# app/storage/bar_writer.py
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import psycopg2
+
+from app.common.metrics import INGEST_LATENCY, REGISTRY, SIZE_BUCKETS
+from app.common.time import now_ms, timeframe_ms
+from app.storage.bar_repo import BarRepository
+from app.storage.db import ConnectionPool
+
+WRITER_BATCH_ROWS = REGISTRY.histogram("quant_writer_batch_rows", "Rows per write-behind flush", ("writer",), buckets=SIZE_BUCKETS)
+WRITER_FLUSH_MS = REGISTRY.histogram("quant_writer_flush_ms", "Write-behind flush duration (ms)", ("writer",))
+WRITER_QUEUE = REGISTRY.gauge("quant_writer_queue_depth", "Rows waiting in the write-behind queue", ("writer",))
+WRITER_ROWS = REGISTRY.counter("quant_writer_rows_total", "Rows by state (enqueued / written)", ("writer", "state"))
+WRITER_DROPPED = REGISTRY.counter("quant_writer_dropped_total", "Rows dropped by reason (full / rejected / unflushed)", ("writer", "reason"))
+WRITER_ERRORS = REGISTRY.counter("quant_writer_errors_total", "Failed flush attempts", ("writer",))
+
+_STOP = object()
+
+
+def _is_connection_error(e: Exception) -> bool:
+    # OperationalError covers lost connections and PoolError (no connection within timeout)
+    return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+
+class BarWriter:
+    """
+    Write-behind stage for bar upserts.
+
+    put() only enqueues; a dedicated thread drains the bounded queue in
+    micro-batches (everything queued while the previous flush ran, at most
+    `batch_rows`), groups rows per (symbol, timeframe) and upserts each
+    group with one statement.
+
+    put() never blocks the event loop: when the queue is full the oldest
+    queued row is dropped to make room (stats()["dropped_full"]): a writer
+    that is behind should lose stale rows, not stall ws.recv().
+
+    A failing batch is retried `max_retries` times with backoff. After that
+    it is split in halves and each half written on its own, down to single
+    rows; a row that still fails is dead-lettered (kept in `dead_letter`,
+    counted in stats()["rejected"]) so one bad row cannot stop the stream.
+    Connection-level failures (DB down, restart, failover) are never
+    dropped: the batch is retried with capped backoff until it goes through
+    or close() gives up; meanwhile put() keeps shedding the oldest rows.
+    close() drains what it can within `timeout` and reports what was left.
+
+    Metrics go to the process registry under writer=`name`; rows put with a
+    recv_ts_ms also feed the recv_to_commit / close_to_commit latency stages.
+    """
+
+    def __init__(
+        self,
+        repo: BarRepository,
+        source: str = "okx",
+        max_queue: int = 100_000,
+        batch_rows: int = 5_000,
+        flush_interval: float = 0.2,
+        name: str = "bars",
+        max_retries: int = 3,
+        dead_letter_size: int = 1_000,
+    ):
+        self.repo = repo
+        self.source = source
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.q: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self.dead_letter: "deque[tuple]" = deque(maxlen=dead_letter_size)  # (symbol, tf, row, error)
+
+        self._thread: Optional[threading.Thread] = None
+        self._closing = threading.Event()
+
+        # metrics
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped_full = 0
+        self.rejected = 0
+        self.unflushed = 0
+        self.high_water = 0
+        self.last_batch_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_lag_ms = 0.0     # enqueue -> commit, worst in the last batch
+
+        self.name = name
+        WRITER_QUEUE.set_function(self.q.qsize, name)
+        WRITER_ROWS.set_function(lambda: self.enqueued, name, "enqueued")
+        WRITER_ROWS.set_function(lambda: self.written, name, "written")
+        WRITER_DROPPED.set_function(lambda: self.dropped_full, name, "full")
+        WRITER_DROPPED.set_function(lambda: self.rejected, name, "rejected")
+        WRITER_DROPPED.set_function(lambda: self.unflushed, name, "unflushed")
+        WRITER_ERRORS.set_function(lambda: self.errors, name)
+        self._step_ms: Dict[str, int] = {}
+
+    def start(self) -> "BarWriter":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="bar-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    # ===== producer side (event loop) =====
+
+    def put(self, symbol: str, timeframe: str, row, recv_ts_ms: Optional[int] = None) -> None:
+        item = (symbol, timeframe, tuple(row), time.monotonic(), recv_ts_ms)
+        while True:
+            try:
+                self.q.put_nowait(item)
+                break
+            except queue.Full:
+                # drop-oldest: the writer is behind, keep the freshest rows
+                try:
+                    self.q.get_nowait()
+                    self.dropped_full += 1
+                except queue.Empty:
+                    pass
+        self.enqueued += 1
+        depth = self.q.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+
+    def stats(self) -> dict:
+        return {
+            "queue": self.q.qsize(),
+            "max_queue": self.q.maxsize,
+            "high_water": self.high_water,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "last_batch_rows": self.last_batch_rows,
+            "last_flush_ms": round(self.last_flush_ms, 1),
+            "max_lag_ms": round(self.max_lag_ms, 1),
+            "dropped_full": self.dropped_full,
+            "rejected": self.rejected,
+            "unflushed": self.unflushed,
+            "errors": self.errors,
+        }
+
+    def close(self, timeout: float = 10.0) -> int:
+        """
+        Flush what was queued, then stop the thread. Gives up after `timeout`
+        seconds (e.g. DB down) and returns the number of rows left unflushed.
+        """
+        if self._thread is None:
+            return 0
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.q.put(_STOP, timeout=0.1)
+                break
+            except queue.Full:
+                if time.monotonic() >= deadline:
+                    break
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            # stop retrying; the batch in flight and the queue are lost
+            self._closing.set()
+            self._thread.join(1.0)
+            self.unflushed = self.enqueued - self.written - self.rejected - self.dropped_full
+            print(f"[writer] close timed out after {timeout:g}s, unflushed={self.unflushed}", flush=True)
+        self._thread = None
+        return self.unflushed
+
+    # ===== writer thread =====
+
+    def _loop(self) -> None:
+        stop = False
+        while not stop and not self._closing.is_set():
+            batch: List[tuple] = []
+            try:
+                item = self.q.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            # whatever piled up while the last flush ran becomes one batch
+            while item is not None:
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_rows:
+                    break
+                try:
+                    item = self.q.get_nowait()
+                except queue.Empty:
+                    item = None
+            self._flush(batch)
+
+    def _flush(self, batch: List[tuple]) -> None:
+        if not batch:
+            return
+
+        t0 = time.monotonic()
+        delay = 0.5
+        attempt = 0
+        while True:
+            try:
+                if attempt <= self.max_retries:
+                    self._write(batch)
+                    written = batch
+                else:
+                    written = self._write_split(batch)
+                break
+            except Exception as e:
+                self._error(e, len(batch))
+                if self._closing.is_set():
+                    return
+                if not _is_connection_error(e):
+                    # row-level / data error: after max_retries, bisect instead
+                    attempt += 1
+                    if attempt > self.max_retries:
+                        continue
+                # DB down / restarting: keep the batch and retry until close()
+                print(f"[writer] retry in {delay:.1f}s (batch={len(batch)} queue={self.q.qsize()})", flush=True)
+                if self._closing.wait(delay):
+                    return
+                delay = min(delay * 2, 10.0)
+
+        now = time.monotonic()
+        self.last_flush_ms = (now - t0) * 1000
+        self.written += len(written)
+        self.last_batch_rows = len(batch)
+        self.batches += 1
+        self.max_lag_ms = (now - min(b[3] for b in batch)) * 1000
+        WRITER_BATCH_ROWS.observe(len(batch), self.name)
+        WRITER_FLUSH_MS.observe(self.last_flush_ms, self.name)
+        self._observe_latency(written)
+
+    def _write(self, batch: List[tuple]) -> None:
+        groups: Dict[Tuple[str, str], Dict[int, tuple]] = {}
+        for symbol, tf, row, _, _ in batch:
+            # same ts twice in one statement would fail ON CONFLICT: keep the last
+            groups.setdefault((symbol, tf), {})[int(row[0])] = row
+        for (symbol, tf), rows in groups.items():
+            self.repo.upsert_bars(symbol, tf, list(rows.values()), source=self.source)
+
+    def _write_split(self, batch: List[tuple]) -> List[tuple]:
+        """Bisect a failing batch; single rows that still fail go to the dead letter. Returns rows written."""
+        if self._closing.is_set():
+            return []
+        if len(batch) == 1:
+            try:
+                self._write(batch)
+                return batch
+            except Exception as e:
+                if _is_connection_error(e):
+                    raise
+                self._error(e, 1, log=False)
+                symbol, tf, row, _, _ = batch[0]
+                self.rejected += 1
+                self.dead_letter.append((symbol, tf, row, f"{type(e).__name__}: {e}"))
+                print(f"[writer] dead-letter {symbol} {tf} ts={row[0]}: {type(e).__name__}: {e}", flush=True)
+                return []
+        mid = len(batch) // 2
+        out = []
+        for half in (batch[:mid], batch[mid:]):
+            try:
+                self._write(half)
+                out.extend(half)
+            except Exception as e:
+                if _is_connection_error(e):
+                    raise  # not the rows' fault: _flush retries the whole batch (upserts are idempotent)
+                self._error(e, len(half), log=False)
+                out.extend(self._write_split(half))
+        return out
+
+    def _error(self, e: Exception, rows: int, log: bool = True) -> None:
+        self.errors += 1
+        if log:
+            print(f"[writer] ERROR {type(e).__name__}: {e} (rows={rows})", flush=True)
+        # a plain connection stays in the aborted transaction until rolled back
+        conn = self.repo.conn
+        if not isinstance(conn, ConnectionPool):
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+
+    def _observe_latency(self, batch: List[tuple]) -> None:
+        committed = now_ms()
+        for symbol, tf, row, _, recv_ts in batch:
+            if recv_ts is None:
+                continue
+            step = self._step_ms.get(tf)
+            if step is None:
+                step = self._step_ms[tf] = timeframe_ms(tf)
+            INGEST_LATENCY.observe(committed - recv_ts, "recv_to_commit", symbol)
+            INGEST_LATENCY.observe(committed - (int(row[0]) + step), "close_to_commit", symbol)
@@ -1,6 +1,13 @@
 ﻿import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import yaml
 import psycopg2
+import psycopg2.extensions
 
 def _find_cfg_path() -> str:
     # Keep your existing behavior: prefer app/config/local.yaml first
@@ -42,9 +49,8 @@ def get_db_cfg(cfg: dict) -> dict:
 
     raise KeyError(f"config missing 'database' or 'db'. keys={list(cfg.keys())}")
 
-def make_conn(cfg: dict):
-    db = get_db_cfg(cfg)
-    return psycopg2.connect(
+def _connect_kwargs(db: dict) -> dict:
+    return dict(
         host=db.get("host", "127.0.0.1"),
         port=int(db.get("port", 5432)),
         user=db.get("user", "postgres"),
@@ -53,16 +59,275 @@ def make_conn(cfg: dict):
         application_name="quant-app",
     )
 
-def migrate():
-    cfg = load_config()
-    conn = make_conn(cfg)
-    try:
-        here = os.path.dirname(__file__)
-        schema_path = os.path.join(here, "schema.sql")
-        with open(schema_path, "r", encoding="utf-8") as f:
-            sql = f.read()
-        with conn.cursor() as cur:
-            cur.execute(sql)
-        conn.commit()
-    finally:
-        conn.close()
\ No newline at end of file
+def make_conn(cfg: dict):
+    return psycopg2.connect(**_connect_kwargs(get_db_cfg(cfg)))
+
+
+# ===== connection pool =====
+
+class PoolError(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    - getconn() blocks up to `timeout` seconds for a free connection
+      (psycopg2.pool raises immediately when exhausted).
+    - A connection idle for more than `idle_check` seconds is probed with
+      SELECT 1 before it is handed out; dead or expired (`max_lifetime`)
+      connections are dropped and replaced.
+    - Connects that fail back off exponentially (with jitter), shared by all
+      threads, so a DB restart doesn't cause a reconnect storm.
+    - putconn() rolls back whatever transaction the borrower left open.
+    """
+
+    def __init__(
+        self,
+        db_cfg: dict,
+        minconn: int = 1,
+        maxconn: int = 8,
+        timeout: float = 30.0,
+        idle_check: float = 30.0,
+        max_lifetime: float = 3600.0,
+        max_backoff: float = 30.0,
+    ):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError(f"bad pool size: min={minconn} max={maxconn}")
+        self.kwargs = _connect_kwargs(db_cfg)
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.max_lifetime = max_lifetime
+        self.max_backoff = max_backoff
+
+        self.pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = deque()      # (conn, last_used, created), LIFO
+        self._created = {}        # conn -> created (monotonic)
+        self._size = 0            # idle + checked out + connecting
+        self._waiting = 0
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._closed = False
+        self.connects = 0
+        self.connect_failures = 0
+
+        for _ in range(minconn):
+            self._size += 1
+            conn = self._connect()
+            self._idle.append((conn, time.monotonic(), self._created[conn]))
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(**self.kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self.connect_failures += 1
+                self._backoff = min(self.max_backoff, self._backoff * 2 if self._backoff else 0.5)
+                self._retry_at = time.monotonic() + self._backoff * random.uniform(0.5, 1.0)
+                self._cond.notify_all()
+            raise
+        with self._cond:
+            self.connects += 1
+            self._backoff = 0.0
+            self._retry_at = 0.0
+            self._created[conn] = time.monotonic()
+        return conn
+
+    def _usable(self, conn, last_used: float, created: float) -> bool:
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if self.max_lifetime and now - created > self.max_lifetime:
+            return False
+        if now - last_used > self.idle_check:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _drop(self, conn) -> None:
+        with self._cond:
+            self._created.pop(conn, None)
+            self._size -= 1
+            self._cond.notify()
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout: float | None = None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        last_err = None
+        while True:
+            item = None
+            with self._cond:
+                self._waiting += 1
+                try:
+                    while True:
+                        if self._closed:
+                            raise PoolError("connection pool is closed")
+                        if self._idle:
+                            item = self._idle.pop()
+                            break
+                        now = time.monotonic()
+                        if self._size < self.maxconn and now >= self._retry_at:
+                            self._size += 1
+                            break
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            msg = f"no connection within {timeout}s (size={self._size} max={self.maxconn})"
+                            if last_err is not None:
+                                msg += f", last connect error: {last_err}"
+                            raise PoolError(msg)
+                        if self._size < self.maxconn:
+                            remaining = min(remaining, self._retry_at - now)
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+
+            if item is not None:
+                if self._usable(*item):
+                    return item[0]
+                self._drop(item[0])
+                continue
+
+            try:
+                return self._connect()
+            except psycopg2.OperationalError as e:
+                last_err = str(e).strip().splitlines()[0]
+                print(f"[db][pool] connect failed, retry in {self._backoff:.1f}s: {last_err}", flush=True)
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+
+        if discard or conn.closed or self._closed:
+            self._drop(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic(), self._created[conn]))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: float | None = None):
+        """Borrow a connection; it is discarded if the block raised a connection-level error."""
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "waiting": self._waiting,
+                "max": self.maxconn,
+                "connects": self.connects,
+                "connect_failures": self.connect_failures,
+            }
+
+    def closeall(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle = [c for c, _, _ in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._drop(conn)
+
+
+def make_pool(cfg: dict) -> ConnectionPool:
+    """
+    Pool sized from database.pool in local.yaml:
+      pool: {min: 1, max: 8, timeout: 30, idle_check: 30, max_lifetime: 3600}
+    """
+    db = get_db_cfg(cfg)
+    p = db.get("pool") or {}
+    return ConnectionPool(
+        db,
+        minconn=int(p.get("min", 1)),
+        maxconn=int(p.get("max", 8)),
+        timeout=float(p.get("timeout", 30)),
+        idle_check=float(p.get("idle_check", 30)),
+        max_lifetime=float(p.get("max_lifetime", 3600)),
+    )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(cfg: dict | None = None) -> ConnectionPool:
+    """Process-wide pool (created on first use; a forked child gets its own)."""
+    global _pool
+    with _pool_lock:
+        # never reuse sockets inherited across fork
+        if _pool is None or _pool.closed or _pool.pid != os.getpid():
+            _pool = make_pool(cfg if cfg is not None else load_config())
+        return _pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+@contextmanager
+def checkout(conn_or_pool):
+    """Repositories accept a plain connection or a ConnectionPool; this yields a connection either way."""
+    if isinstance(conn_or_pool, ConnectionPool):
+        with conn_or_pool.connection() as conn:
+            yield conn
+    else:
+        yield conn_or_pool
+
+
+def migrate(conn=None, target=None, months_ahead=None):
+    """
+    Apply pending versioned migrations (app/storage/migrations), then make
+    sure the bars month partitions exist ahead of time. Both run under the
+    migration advisory lock, so services starting together at a month
+    rollover don't race on the same partition.
+    """
+    from app.storage import migrations
+    from app.storage.partitions import MONTHS_AHEAD, ensure_bar_partitions
+
+    with checkout(conn if conn is not None else get_pool()) as c:
+        with migrations.locked(c):
+            migrations.run(c, target=target)
+            with c.cursor() as cur:
+                created = ensure_bar_partitions(cur, months_ahead=MONTHS_AHEAD if months_ahead is None else months_ahead)
+            c.commit()
+    if created:
+        moved = sum(n for _, n in created)
+        print(f"[migrate] bars partitions created={len(created)} rows_moved={moved}", flush=True)
@@ -0,0 +1,190 @@
+# app/storage/gaps.py
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.common.time import TIMEFRAME_MS
+from app.storage.db import checkout
+
+
+@dataclass(frozen=True)
+class Gap:
+    """Two consecutive stored bars of one series that are not exactly one step apart."""
+    source: str
+    symbol: str
+    timeframe: str
+    prev_ts: int
+    next_ts: int
+    step_ms: int
+
+    @property
+    def diff(self) -> int:
+        return self.next_ts - self.prev_ts
+
+    @property
+    def kind(self) -> str:
+        # MISSING: whole bars absent; ANOMALY: off-grid or sub-step spacing
+        if self.diff > self.step_ms and self.diff % self.step_ms == 0:
+            return "MISSING"
+        return "ANOMALY"
+
+    @property
+    def missing_bars(self) -> int:
+        return max(self.diff // self.step_ms - 1, 0)
+
+    @property
+    def first_missing_ts(self) -> int:
+        return self.prev_ts + self.step_ms
+
+    @property
+    def last_missing_ts(self) -> int:
+        return self.next_ts - self.step_ms
+
+
+def _steps_values(tfs: List[str]) -> Tuple[str, list]:
+    sql = ", ".join(["(%s, %s::bigint)"] * len(tfs))
+    params = [x for tf in tfs for x in (tf, TIMEFRAME_MS[tf])]
+    return sql, params
+
+
+def find_gaps(
+    conn,
+    source: Optional[str] = None,
+    symbols: Optional[Iterable[str]] = None,
+    timeframes: Optional[Iterable[str]] = None,
+    start_ts: Optional[int] = None,
+    end_ts: Optional[int] = None,
+) -> List[Gap]:
+    """
+    Scan every (source, symbol, timeframe) series in one pass.
+
+    lead(ts) over the PK order is evaluated inside Postgres (an index-only
+    scan, no sort), and only the rows where the next bar is not exactly one
+    step later come back, so the result is proportional to the number of gaps,
+    not bars. Timeframes outside TIMEFRAME_MS are not scanned.
+
+    conn may be a connection or a ConnectionPool.
+    """
+    tfs = list(timeframes) if timeframes else list(TIMEFRAME_MS)
+    unknown = [tf for tf in tfs if tf not in TIMEFRAME_MS]
+    if unknown:
+        raise ValueError(f"unknown timeframe(s): {unknown}")
+
+    # plain array filters keep the planner on the PK index (a semi-join on the
+    # steps table made it seq-scan + sort)
+    where = ["b.timeframe = ANY(%s)"]
+    params: list = [tfs]
+    if source is not None:
+        where.append("b.source = %s")
+        params.append(source)
+    if symbols:
+        where.append("b.symbol = ANY(%s)")
+        params.append(list(symbols))
+    if start_ts is not None:
+        where.append("b.ts >= %s")
+        params.append(start_ts)
+    if end_ts is not None:
+        where.append("b.ts <= %s")
+        params.append(end_ts)
+
+    steps_sql, steps_params = _steps_values(tfs)
+    sql = f"""
+    WITH d AS (
+        SELECT
+            b.source, b.symbol, b.timeframe, b.ts,
+            lead(b.ts) OVER (PARTITION BY b.source, b.symbol, b.timeframe ORDER BY b.ts) AS next_ts
+        FROM bars b
+        WHERE {" AND ".join(where)}
+    )
+    SELECT d.source, d.symbol, d.timeframe, d.ts, d.next_ts, s.step
+    FROM d
+    JOIN (VALUES {steps_sql}) AS s(timeframe, step) ON s.timeframe = d.timeframe
+    WHERE d.next_ts - d.ts <> s.step
+    ORDER BY d.source, d.symbol, d.timeframe, d.ts;
+    """
+    with checkout(conn) as c:
+        with c.cursor() as cur:
+            cur.execute(sql, params + steps_params)
+            rows = cur.fetchall()
+    return [Gap(src, sym, tf, int(a), int(b), int(step)) for src, sym, tf, a, b, step in rows]
+
+
+def gap_bounds(ts: np.ndarray, step_ms: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized variant for bars already in memory: ascending ts -> (prev_ts, next_ts)
+    of every pair not exactly one step apart.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    if len(ts) < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    idx = np.flatnonzero(np.diff(ts) != step_ms)
+    return ts[idx], ts[idx + 1]
+
+
+def summarize(gaps: Iterable[Gap]) -> dict:
+    """(source, symbol, timeframe) -> {"gaps": n, "missing_bars": n, "anomalies": n}"""
+    out = {}
+    for g in gaps:
+        s = out.setdefault((g.source, g.symbol, g.timeframe), {"gaps": 0, "missing_bars": 0, "anomalies": 0})
+        s["gaps"] += 1
+        if g.kind == "MISSING":
+            s["missing_bars"] += g.missing_bars
+        else:
+            s["anomalies"] += 1
+    return out
+
+
+def missing_in_ranges(
+    conn,
+    source: str,
+    symbol: str,
+    timeframe: str,
+    ranges: Iterable[Tuple[int, int]],
+) -> List[Tuple[int, int, int]]:
+    """
+    Bars still absent inside [first_ts, last_ts] ranges of one series, in one query.
+
+    Expected ts are generated on the step grid, anti-joined against bars
+    (PK lookups), and collapsed back into runs.
+    Returns [(first_missing_ts, last_missing_ts, n_bars), ...] ascending.
+    """
+    ranges = list(ranges)
+    if not ranges:
+        return []
+    step = TIMEFRAME_MS[timeframe]
+    sql = """
+    WITH r AS (
+        SELECT * FROM unnest(%s::bigint[], %s::bigint[]) AS r(first_ts, last_ts)
+    ),
+    m AS (
+        SELECT g.ts
+        FROM r
+        CROSS JOIN LATERAL generate_series(r.first_ts, r.last_ts, %s::bigint) AS g(ts)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM bars b
+            WHERE b.source = %s AND b.symbol = %s AND b.timeframe = %s AND b.ts = g.ts
+        )
+    ),
+    runs AS (
+        -- consecutive missing ts share (ts - step * rank)
+        SELECT ts, ts - %s::bigint * row_number() OVER (ORDER BY ts) AS grp
+        FROM m
+    )
+    SELECT min(ts), max(ts), count(*)
+    FROM runs
+    GROUP BY grp
+    ORDER BY 1;
+    """
+    params = (
+        [int(a) for a, _ in ranges], [int(b) for _, b in ranges], step,
+        source, symbol, timeframe, step,
+    )
+    with checkout(conn) as c:
+        with c.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+    return [(int(a), int(b), int(n)) for a, b, n in rows]
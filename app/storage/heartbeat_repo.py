@@ -1,34 +1,201 @@
 ﻿from dataclasses import dataclass
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional, Tuple
+import threading
 import time
 
+from psycopg2.extras import execute_values
+
+from app.storage.db import checkout
+
+# heartbeat_history 的降采样粒度
+HISTORY_BUCKET_MS = 5 * 60_000
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+@dataclass(frozen=True)
+class ServiceStatus:
+    service: str
+    source: str
+    last_seen_ts: int
+    age_ms: int
+    stale: bool
+
+
 @dataclass
 class HeartbeatRepository:
-    conn: Any
+    """
+    heartbeat: one row per service (last_seen_ts, beats), updated in place.
+    heartbeat_history: one row per service per HISTORY_BUCKET_MS bucket.
+    Neither grows with the beat rate.
+    """
+    conn: Any  # connection or ConnectionPool
     source: str = "okx"
+    history_bucket_ms: int = HISTORY_BUCKET_MS
 
     def beat(self, service: str, ts_ms: Optional[int] = None) -> None:
         if ts_ms is None:
-            ts_ms = int(time.time() * 1000)
+            ts_ms = _now_ms()
+        self.beat_many({service: (ts_ms, ts_ms, 1)})
+
+    def beat_many(self, beats: Dict[str, Tuple[int, int, int]]) -> None:
+        """{service: (first ts_ms, last ts_ms, beats) since the last flush} -> one round trip."""
+        if not beats:
+            return
+        rows = [(svc, self.source, int(last), int(n)) for svc, (_, last, n) in beats.items()]
+        hist = [
+            (svc, int(last) - int(last) % self.history_bucket_ms, int(first), int(last), int(n))
+            for svc, (first, last, n) in beats.items()
+        ]
 
         sql = """
-        INSERT INTO heartbeats (source, service, ts)
-        VALUES (%s, %s, %s)
-        ON CONFLICT (source, service, ts) DO NOTHING;
+        INSERT INTO heartbeat (service_name, source, last_seen_ts, beats)
+        VALUES %s
+        ON CONFLICT (service_name) DO UPDATE SET
+            source = EXCLUDED.source,
+            last_seen_ts = GREATEST(heartbeat.last_seen_ts, EXCLUDED.last_seen_ts),
+            beats = heartbeat.beats + EXCLUDED.beats,
+            updated_at = now();
         """
-        with self.conn.cursor() as cur:
-            cur.execute(sql, (self.source, service, ts_ms))
-        self.conn.commit()
+        sql_hist = """
+        INSERT INTO heartbeat_history (service_name, bucket_ts, first_seen_ts, last_seen_ts, beats)
+        VALUES %s
+        ON CONFLICT (service_name, bucket_ts) DO UPDATE SET
+            last_seen_ts = GREATEST(heartbeat_history.last_seen_ts, EXCLUDED.last_seen_ts),
+            beats = heartbeat_history.beats + EXCLUDED.beats;
+        """
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, sql, rows)
+                execute_values(cur, sql_hist, hist)
+            conn.commit()
 
     def latest(self, service: str) -> Optional[int]:
+        sql = "SELECT last_seen_ts FROM heartbeat WHERE service_name = %s;"
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (service,))
+                row = cur.fetchone()
+        return int(row[0]) if row else None
+
+    def status(self, stale_after_ms: int = 120_000, now_ms: Optional[int] = None) -> List[ServiceStatus]:
+        """Every service with its age and stale flag, in one query."""
+        now_ms = _now_ms() if now_ms is None else int(now_ms)
         sql = """
-        SELECT ts
-        FROM heartbeats
-        WHERE source = %s AND service = %s
-        ORDER BY ts DESC
-        LIMIT 1;
+        SELECT service_name, source, last_seen_ts,
+               %s - last_seen_ts AS age_ms,
+               %s - last_seen_ts > %s AS stale
+        FROM heartbeat
+        ORDER BY service_name;
         """
-        with self.conn.cursor() as cur:
-            cur.execute(sql, (self.source, service))
-            row = cur.fetchone()
-        return int(row[0]) if row else None
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (now_ms, now_ms, int(stale_after_ms)))
+                rows = cur.fetchall()
+        return [ServiceStatus(r[0], r[1], int(r[2]), int(r[3]), bool(r[4])) for r in rows]
+
+    def history(self, service: str, start_ts: Optional[int] = None, end_ts: Optional[int] = None) -> List[Tuple[int, int, int, int]]:
+        """[(bucket_ts, first_seen_ts, last_seen_ts, beats), ...] ascending."""
+        sql = """
+        SELECT bucket_ts, first_seen_ts, last_seen_ts, beats
+        FROM heartbeat_history
+        WHERE service_name = %s
+          AND (%s::bigint IS NULL OR bucket_ts >= %s)
+          AND (%s::bigint IS NULL OR bucket_ts < %s)
+        ORDER BY bucket_ts;
+        """
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (service, start_ts, start_ts, end_ts, end_ts))
+                return [tuple(int(x) for x in r) for r in cur.fetchall()]
+
+    def prune_history(self, older_than_ts: int) -> int:
+        with checkout(self.conn) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM heartbeat_history WHERE bucket_ts < %s;", (int(older_than_ts),))
+                n = cur.rowcount
+            conn.commit()
+        return n
+
+
+class HeartbeatService:
+    """
+    In-memory liveness with a background flush.
+
+    beat() only updates a dict (safe to call per message, from any thread or
+    the event loop); a daemon thread writes the services that beat since the
+    last flush every `flush_seconds` with one HeartbeatRepository.beat_many()
+    round trip, and prunes history older than `history_days` once a day.
+    close() does a final flush.
+    """
+
+    def __init__(self, repo: HeartbeatRepository, flush_seconds: float = 15.0, history_days: float = 30.0):
+        self.repo = repo
+        self.flush_seconds = flush_seconds
+        self.history_days = history_days
+        self._last: Dict[str, int] = {}
+        self._pending: Dict[str, Tuple[int, int, int]] = {}   # service -> (first, last, beats)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pruned_at = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def start(self) -> "HeartbeatService":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="heartbeat", daemon=True)
+            self._thread.start()
+        return self
+
+    def beat(self, service: str, ts_ms: Optional[int] = None) -> None:
+        ts = _now_ms() if ts_ms is None else int(ts_ms)
+        with self._lock:
+            self._last[service] = ts
+            cur = self._pending.get(service)
+            self._pending[service] = (cur[0], ts, cur[2] + 1) if cur else (ts, ts, 1)
+
+    def alive(self, service: str, stale_after_ms: int = 120_000) -> bool:
+        ts = self._last.get(service)
+        return ts is not None and _now_ms() - ts <= stale_after_ms
+
+    def flush(self) -> int:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            self.repo.beat_many(pending)
+        except Exception:
+            # put them back (merged with anything newer) for the next round
+            with self._lock:
+                for svc, (first, last, n) in pending.items():
+                    cur = self._pending.get(svc)
+                    self._pending[svc] = (first, max(last, cur[1]), n + cur[2]) if cur else (first, last, n)
+            raise
+        self.flushes += 1
+        return len(pending)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+                now = _now_ms()
+                if self.history_days and now - self._pruned_at > 86_400_000:
+                    self.repo.prune_history(now - int(self.history_days * 86_400_000))
+                    self._pruned_at = now
+            except Exception as e:
+                self.errors += 1
+                print(f"[heartbeat] ERROR {type(e).__name__}: {e}", flush=True)
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[heartbeat] final flush failed {type(e).__name__}: {e}", flush=True)
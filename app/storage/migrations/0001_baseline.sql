@@ -1,4 +1,4 @@
--- app/storage/schema.sql
+-- 0001: schema as it was before versioned migrations (IF NOT EXISTS: existing DBs pass through)
 
 CREATE TABLE IF NOT EXISTS bars (
   symbol       TEXT        NOT NULL,
@@ -11,12 +11,13 @@ CREATE TABLE IF NOT EXISTS bars (
   volume       DOUBLE PRECISION NOT NULL,
   source       TEXT        NOT NULL DEFAULT 'okx',
   inserted_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
-  PRIMARY KEY (symbol, timeframe, ts)
+  PRIMARY KEY (source, symbol, timeframe, ts)
 );
 
 CREATE INDEX IF NOT EXISTS idx_bars_symbol_tf_ts
 ON bars(symbol, timeframe, ts);
--- heartbeat: service liveness indicator
+
+-- heartbeat: service liveness indicator（每个 service 一行，后台定时 upsert）
 CREATE TABLE IF NOT EXISTS heartbeat (
   service_name TEXT PRIMARY KEY,
   last_seen_ts BIGINT NOT NULL,
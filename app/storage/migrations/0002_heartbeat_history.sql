@@ -0,0 +1,14 @@
+-- 0002: heartbeat source / beat count + downsampled history
+
+ALTER TABLE heartbeat ADD COLUMN IF NOT EXISTS source TEXT NOT NULL DEFAULT 'okx';
+ALTER TABLE heartbeat ADD COLUMN IF NOT EXISTS beats  BIGINT NOT NULL DEFAULT 0;
+
+-- 降采样历史：每个 service 每个 bucket（默认 5 分钟）一行
+CREATE TABLE IF NOT EXISTS heartbeat_history (
+  service_name TEXT   NOT NULL,
+  bucket_ts    BIGINT NOT NULL,
+  first_seen_ts BIGINT NOT NULL,
+  last_seen_ts BIGINT NOT NULL,
+  beats        BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (service_name, bucket_ts)
+);
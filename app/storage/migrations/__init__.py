@@ -0,0 +1,132 @@
+"""
+Versioned schema migrations.
+
+Each migration is a file in this package named NNNN_<name>.sql or
+NNNN_<name>.py (a module with `up(cur)`). Versions are applied in order,
+each in its own transaction together with its schema_migrations row, so a
+failure leaves the DB at the previous version. Runs are serialized with an
+advisory lock (locked()), so several services starting at once is safe;
+other schema maintenance (bars partitions) takes the same lock.
+
+There are no down migrations: roll forward with a new version.
+"""
+from __future__ import annotations
+
+import importlib
+import re
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+HERE = Path(__file__).resolve().parent
+_NAME = re.compile(r"^(\d{4})_(\w+)\.(sql|py)$")
+
+# pg_advisory_lock key: "quant-migrate"
+LOCK_KEY = 0x71756D69
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    path: Path
+
+    def apply(self, cur) -> None:
+        if self.path.suffix == ".sql":
+            cur.execute(self.path.read_text(encoding="utf-8-sig"))
+        else:
+            mod = importlib.import_module(f"{__name__}.{self.path.stem}")
+            mod.up(cur)
+
+
+def discover() -> List[Migration]:
+    out = {}
+    for p in sorted(HERE.iterdir()):
+        m = _NAME.match(p.name)
+        if not m:
+            continue
+        v = int(m.group(1))
+        if v in out:
+            raise RuntimeError(f"duplicate migration version {v}: {out[v].path.name}, {p.name}")
+        out[v] = Migration(v, m.group(2), p)
+    return [out[v] for v in sorted(out)]
+
+
+def _ensure_table(cur) -> None:
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+      version     INT PRIMARY KEY,
+      name        TEXT NOT NULL,
+      applied_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+      duration_ms DOUBLE PRECISION NOT NULL
+    )
+    """)
+
+
+def applied_versions(conn) -> dict:
+    """{version: (name, applied_at)}; empty when the DB was never migrated."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return {}
+        cur.execute("SELECT version, name, applied_at FROM schema_migrations ORDER BY version")
+        rows = {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+    conn.rollback()
+    return rows
+
+
+def status(conn) -> List[tuple]:
+    """[(version, name, applied_at or None)] for every known migration."""
+    done = applied_versions(conn)
+    return [(m.version, m.name, done.get(m.version, (None, None))[1]) for m in discover()]
+
+
+@contextmanager
+def locked(conn):
+    """
+    Hold the migration advisory lock (session level, re-entrant) around a
+    block of schema changes. Whatever the block left uncommitted is rolled
+    back before the lock is released.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+            conn.commit()
+
+
+def run(conn, target: Optional[int] = None) -> List[Migration]:
+    """Apply pending migrations up to `target` (default: latest). Returns what was applied."""
+    migrations = [m for m in discover() if target is None or m.version <= target]
+    applied = []
+    with locked(conn), conn.cursor() as cur:
+        _ensure_table(cur)
+        conn.commit()
+        cur.execute("SELECT version FROM schema_migrations")
+        done = {r[0] for r in cur.fetchall()}
+        for m in migrations:
+            if m.version in done:
+                continue
+            t0 = time.perf_counter()
+            try:
+                m.apply(cur)
+                ms = (time.perf_counter() - t0) * 1000
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, name, duration_ms) VALUES (%s, %s, %s)",
+                    (m.version, m.name, ms),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                print(f"[migrate] FAILED {m.version:04d}_{m.name}", flush=True)
+                raise
+            print(f"[migrate] applied {m.version:04d}_{m.name} ({ms:.0f} ms)", flush=True)
+            applied.append(m)
+    return applied
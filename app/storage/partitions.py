@@ -0,0 +1,168 @@
+"""
+bars partition layout and maintenance.
+
+    bars                      PARTITION BY LIST (timeframe)
+      bars_1m                 PARTITION BY RANGE (ts), one partition per UTC month
+        bars_1m_202401        [2024-01-01, 2024-02-01)
+        bars_1m_default       rows outside every month partition
+      bars_4h                 plain partition (coarse timeframes stay small)
+      bars_default            timeframes without a partition of their own
+
+Month partitions are created ahead of time by ensure_bar_partitions() (run by
+every migrate()); rows that land in a *_default partition are moved into the
+month partition the next time it runs. Retention is a DETACH + DROP of whole
+months (drop_bar_partitions_before), no DELETE / vacuum.
+"""
+from __future__ import annotations
+
+import re
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.common.time import TIMEFRAME_MS
+
+# timeframes split by month; the rest get one partition each
+MONTHLY_TIMEFRAMES = ("1m", "3m", "5m", "15m", "30m", "1h")
+MONTHS_AHEAD = 3
+
+BAR_COLUMNS = "symbol, timeframe, ts, open, high, low, close, volume, source, inserted_at"
+
+
+def tf_partition(timeframe: str) -> str:
+    return "bars_" + re.sub(r"[^0-9a-z]", "_", timeframe.lower())
+
+
+def month_start_ms(ts_ms: int) -> int:
+    d = datetime.fromtimestamp(ts_ms / 1000, tz=timezone.utc)
+    return int(datetime(d.year, d.month, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def add_months(month_ms: int, n: int) -> int:
+    d = datetime.fromtimestamp(month_ms / 1000, tz=timezone.utc)
+    y, m = divmod(d.month - 1 + n, 12)
+    return int(datetime(d.year + y, m + 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def month_partition(timeframe: str, month_ms: int) -> str:
+    d = datetime.fromtimestamp(month_ms / 1000, tz=timezone.utc)
+    return f"{tf_partition(timeframe)}_{d.year:04d}{d.month:02d}"
+
+
+def months_between(start_ts: int, end_ts: int) -> List[int]:
+    """Month starts covering [start_ts, end_ts] (inclusive)."""
+    out = []
+    m = month_start_ms(start_ts)
+    while m <= end_ts:
+        out.append(m)
+        m = add_months(m, 1)
+    return out
+
+
+def is_partitioned(cur) -> bool:
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('bars')")
+    row = cur.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+def list_partitions(cur, parent: str) -> Dict[str, Optional[str]]:
+    """{child name: bound expression} of one partitioned table."""
+    cur.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        (parent,),
+    )
+    return {r[0]: r[1] for r in cur.fetchall()}
+
+
+def create_timeframe_partition(cur, timeframe: str) -> None:
+    name = tf_partition(timeframe)
+    if timeframe in MONTHLY_TIMEFRAMES:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF bars FOR VALUES IN (%s) PARTITION BY RANGE (ts)", (timeframe,))
+        cur.execute(f"CREATE TABLE {name}_default PARTITION OF {name} DEFAULT")
+    else:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF bars FOR VALUES IN (%s)", (timeframe,))
+
+
+def create_month_partition(cur, timeframe: str, month_ms: int) -> int:
+    """
+    Create one month partition; rows of that month sitting in the timeframe's
+    default partition are moved into it first. Returns rows moved.
+    """
+    parent = tf_partition(timeframe)
+    name = month_partition(timeframe, month_ms)
+    end = add_months(month_ms, 1)
+    cur.execute(f"CREATE TABLE {name} (LIKE bars INCLUDING DEFAULTS)")
+    cur.execute(
+        f"""
+        WITH moved AS (
+            DELETE FROM {parent}_default WHERE ts >= %s AND ts < %s
+            RETURNING {BAR_COLUMNS}
+        )
+        INSERT INTO {name} ({BAR_COLUMNS}) SELECT {BAR_COLUMNS} FROM moved
+        """,
+        (month_ms, end),
+    )
+    moved = cur.rowcount
+    cur.execute(f"ALTER TABLE {parent} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (month_ms, end))
+    return moved
+
+
+def ensure_bar_partitions(cur, months_ahead: int = MONTHS_AHEAD, now_ms: Optional[int] = None) -> List[Tuple[str, int]]:
+    """
+    Every known timeframe gets its partition; every monthly timeframe gets
+    month partitions up to `months_ahead` months past now, plus one for each
+    month found in its default partition. Returns [(partition, rows moved)].
+    """
+    if not is_partitioned(cur):
+        return []
+    now_ms = now_ms if now_ms is not None else int(datetime.now(timezone.utc).timestamp() * 1000)
+    created = []
+
+    have_tf = set(list_partitions(cur, "bars"))
+    for tf in TIMEFRAME_MS:
+        if tf_partition(tf) not in have_tf:
+            create_timeframe_partition(cur, tf)
+            created.append((tf_partition(tf), 0))
+
+    cur_month = month_start_ms(now_ms)
+    ahead = [add_months(cur_month, i) for i in range(months_ahead + 1)]
+    for tf in MONTHLY_TIMEFRAMES:
+        parent = tf_partition(tf)
+        existing = set(list_partitions(cur, parent))
+        # months that spilled into the default partition (normally none)
+        cur.execute(
+            f"""
+            SELECT DISTINCT (extract(epoch FROM date_trunc('month', to_timestamp(ts / 1000.0) AT TIME ZONE 'UTC')) * 1000)::bigint
+            FROM {parent}_default
+            """
+        )
+        spilled = [int(r[0]) for r in cur.fetchall()]
+        for m in sorted(set(ahead) | set(spilled)):
+            name = month_partition(tf, m)
+            if name in existing:
+                continue
+            created.append((name, create_month_partition(cur, tf, m)))
+    return created
+
+
+def drop_bar_partitions_before(cur, before_ts: int, timeframes: Iterable[str] = MONTHLY_TIMEFRAMES) -> List[str]:
+    """Retention: detach and drop whole month partitions that end at or before before_ts."""
+    dropped = []
+    for tf in timeframes:
+        if tf not in MONTHLY_TIMEFRAMES:
+            raise ValueError(f"{tf} is not partitioned by month")
+        parent = tf_partition(tf)
+        for name in sorted(list_partitions(cur, parent)):
+            m = re.fullmatch(rf"{parent}_(\d{{4}})(\d{{2}})", name)
+            if not m:
+                continue
+            start = int(datetime(int(m.group(1)), int(m.group(2)), 1, tzinfo=timezone.utc).timestamp() * 1000)
+            if add_months(start, 1) <= before_ts:
+                cur.execute(f"ALTER TABLE {parent} DETACH PARTITION {name}")
+                cur.execute(f"DROP TABLE {name}")
+                dropped.append(name)
+    return dropped
@@ -0,0 +1,99 @@
+"""
+Strategy interface for the vectorized backtest engine (app/strategy/engine.py).
+
+A strategy turns a whole feature frame (compute_features output: ts, OHLCV
+and indicator columns) into one target-position array in a single pass of
+array operations; there is no per-bar callback.
+
+    target[i] = position wanted after bar i closes (-1 short ... 0 flat ... 1 long)
+    NaN       = no opinion, keep the previous target
+
+NaN lets entry/exit style rules stay vectorized: write 1 where the entry
+fires, 0 where the exit fires, NaN elsewhere, and the engine carries the
+position forward. The engine fills the target at the next bar's open, so a
+strategy can use everything up to and including bar i's close.
+"""
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Mapping
+
+import numpy as np
+
+
+Features = Mapping[str, np.ndarray]  # column -> array; a DataFrame works too
+
+
+@dataclass(frozen=True)
+class Strategy(ABC):
+    """
+    Base class. Subclasses are frozen dataclasses whose fields are the
+    parameters, so instances are hashable and sweeps can build them from dicts.
+    A subclass without signals() cannot be instantiated.
+    """
+
+    name = "base"
+
+    def indicators(self) -> Dict[str, Any]:
+        """indicator_cfg fragment (features.yaml `indicators` shape) the strategy reads."""
+        return {}
+
+    def columns(self) -> List[str]:
+        """Feature columns signals() reads."""
+        return ["close"]
+
+    def validate(self) -> None:
+        """Raise ValueError for parameter combinations that make no sense (sweeps skip them)."""
+
+    @abstractmethod
+    def signals(self, f: Features) -> np.ndarray:
+        """Target position per bar (float64, NaN = keep previous)."""
+
+    def params(self) -> Dict[str, Any]:
+        return asdict(self)
+
+    def label(self) -> str:
+        p = ",".join(f"{k}={v}" for k, v in self.params().items())
+        return f"{self.name}({p})"
+
+
+def col(f: Features, name: str) -> np.ndarray:
+    """One feature column as a float64 array (DataFrame or dict input)."""
+    try:
+        a = f[name]
+    except KeyError:
+        raise KeyError(f"feature column {name!r} missing; add it to the strategy's indicators()") from None
+    return np.asarray(a, dtype=np.float64)
+
+
+def crossed_above(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a crosses above b at bar i (a <= b at i-1, a > b at i)."""
+    out = np.zeros(len(a), dtype=bool)
+    out[1:] = (a[1:] > b[1:]) & (a[:-1] <= b[:-1])
+    return out
+
+
+def crossed_below(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    out = np.zeros(len(a), dtype=bool)
+    out[1:] = (a[1:] < b[1:]) & (a[:-1] >= b[:-1])
+    return out
+
+
+def merge_indicators(*cfgs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Union of indicator_cfg fragments: windows lists are merged, scalar
+    parameters (macd fast/slow/signal) must agree.
+    """
+    out: Dict[str, Any] = {}
+    for cfg in cfgs:
+        for ind, spec in (cfg or {}).items():
+            dst = out.setdefault(ind, {})
+            for k, v in (spec or {}).items():
+                if k == "windows":
+                    dst[k] = sorted(set(dst.get(k, [])) | {int(w) for w in v})
+                elif k in dst and dst[k] != v:
+                    raise ValueError(f"conflicting {ind}.{k}: {dst[k]} vs {v}")
+                else:
+                    dst[k] = v
+    return out
@@ -0,0 +1,248 @@
+"""
+Vectorized backtest engine.
+
+Every step is an array operation over the whole series: the strategy's
+target positions are forward-filled, shifted one bar (decided at bar i's
+close, filled at bar i+1's open), and equity is a single cumprod of the
+per-bar growth factors
+
+    growth[i] = (1 + prev[i] * gap[i]) * (1 - cost[i]) * (1 + pos[i] * intra[i])
+
+    gap[i]   = open[i] / close[i-1] - 1     old position over the bar boundary
+    cost[i]  = |pos[i] - prev[i]| * (fee_bps + slippage_bps) / 1e4
+    intra[i] = close[i] / open[i] - 1       new position over the bar
+
+Positions are fractions of equity (1 = fully long, -1 = fully short);
+fees and slippage are charged on the traded notional at the fill. The last
+position is marked to market, not closed.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.common.time import timeframe_ms
+from app.features.service import compute_features
+from app.strategy.base import Features, Strategy, col, merge_indicators
+
+YEAR_MS = 365 * 86_400_000  # crypto trades every day
+
+
+@dataclass(frozen=True)
+class BacktestConfig:
+    fee_bps: float = 5.0             # per side on traded notional (OKX swap taker 0.05%)
+    slippage_bps: float = 1.0        # adverse fill vs the open, per side
+    initial_capital: float = 10_000.0
+    allow_short: bool = True
+    max_position: float = 1.0        # |target| is clipped to this; > 1 is leverage
+
+
+@dataclass(frozen=True)
+class BacktestResult:
+    label: str
+    ts: np.ndarray
+    position: np.ndarray    # held during bar i (after the open fill)
+    returns: np.ndarray     # net equity return of bar i
+    equity: np.ndarray
+    costs: np.ndarray       # fees + slippage paid in bar i (currency)
+    trades: pd.DataFrame
+    stats: Dict[str, float]
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "ts": self.ts,
+            "position": self.position,
+            "returns": self.returns,
+            "equity": self.equity,
+            "costs": self.costs,
+        })
+
+
+def ffill_target(target: np.ndarray) -> np.ndarray:
+    """NaN keeps the previous value; leading NaN is flat."""
+    t = np.asarray(target, dtype=np.float64)
+    nan = np.isnan(t)
+    if not nan.any():
+        return t
+    idx = np.where(nan, 0, np.arange(len(t)))
+    np.maximum.accumulate(idx, out=idx)
+    out = t[idx]
+    out[np.isnan(out)] = 0.0
+    return out
+
+
+def bars_per_year(ts: np.ndarray, timeframe: Optional[str] = None) -> float:
+    if timeframe:
+        return YEAR_MS / timeframe_ms(timeframe)
+    if len(ts) < 2:
+        return 0.0
+    return YEAR_MS / float(np.median(np.diff(ts)))
+
+
+def prepare_features(bars, strategies: Iterable[Strategy], indicator_cfg: Optional[dict] = None,
+                     warmup: int = 26) -> pd.DataFrame:
+    """compute_features with every indicator the strategies read (plus indicator_cfg)."""
+    cfg = merge_indicators(indicator_cfg or {}, *[s.indicators() for s in strategies])
+    return compute_features(bars, indicator_cfg=cfg, warmup=warmup)
+
+
+def bar_returns(open_: np.ndarray, close: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(gap, intra) per bar; they only depend on the bars, so sweeps compute them once."""
+    n = len(close)
+    gap = np.empty(n)
+    if n:
+        gap[0] = 0.0
+        np.divide(open_[1:], close[:-1], out=gap[1:])
+        gap[1:] -= 1.0
+    intra = np.divide(close, open_)
+    intra -= 1.0
+    return gap, intra
+
+
+def backtest(
+    f: Features,
+    target: np.ndarray,
+    cfg: Optional[BacktestConfig] = None,
+    timeframe: Optional[str] = None,
+    label: str = "",
+    returns: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+) -> BacktestResult:
+    """
+    Run one target-position array over the bars in `f` (ts, open, close).
+    `returns` is a precomputed bar_returns() of the same rows.
+    """
+    cfg = cfg or BacktestConfig()
+    ts = np.asarray(f["ts"], dtype=np.int64)
+    n = len(ts)
+    if len(target) != n:
+        raise ValueError(f"target has {len(target)} rows, features {n}")
+    gap, intra = returns if returns is not None else bar_returns(col(f, "open"), col(f, "close"))
+
+    tgt = ffill_target(target)
+    if not cfg.allow_short:
+        tgt = np.maximum(tgt, 0.0)
+    tgt = np.clip(tgt, -cfg.max_position, cfg.max_position)
+
+    # target decided at bar i's close is held from bar i+1's open
+    pos = np.empty(n)
+    prev = np.empty(n)
+    if n:
+        pos[0] = 0.0
+        pos[1:] = tgt[:-1]
+        prev[0] = 0.0
+        prev[1:] = pos[:-1]
+
+    c = (cfg.fee_bps + cfg.slippage_bps) / 1e4
+    traded = np.subtract(pos, prev)
+    np.abs(traded, out=traded)
+    g_gap = np.multiply(prev, gap)
+    g_gap += 1.0
+    g_intra = np.multiply(pos, intra)
+    g_intra += 1.0
+    growth = np.multiply(traded, -c)
+    growth += 1.0
+    growth *= g_gap
+    growth *= g_intra
+
+    equity = np.cumprod(growth)
+    equity *= cfg.initial_capital
+    # costs: equity at the fill (after the gap) * traded * rate
+    costs = np.empty(n)
+    if n:
+        costs[0] = cfg.initial_capital
+        costs[1:] = equity[:-1]
+    costs *= g_gap
+    costs *= traded
+    costs *= c
+
+    trades = _trades(ts, pos, g_gap, g_intra, c)
+    growth -= 1.0  # per-bar net return from here on
+    stats = _stats(growth, equity, pos, float(traded.sum()), costs, trades, cfg, bars_per_year(ts, timeframe))
+    return BacktestResult(label, ts, pos, growth, equity, costs, trades, stats)
+
+
+def run_backtest(
+    f: Features,
+    strategy: Strategy,
+    cfg: Optional[BacktestConfig] = None,
+    timeframe: Optional[str] = None,
+) -> BacktestResult:
+    return backtest(f, strategy.signals(f), cfg, timeframe, label=strategy.label())
+
+
+def _trades(ts: np.ndarray, pos: np.ndarray, g_gap: np.ndarray, g_intra: np.ndarray, c: float) -> pd.DataFrame:
+    """
+    One row per run of constant non-zero position. A trade's return covers its
+    bars' intrabar moves, the bar-boundary gaps it was exposed to and one fee
+    per side on |position|; an open last trade has no exit fee and no exit_ts.
+    """
+    n = len(pos)
+    if n == 0:
+        return pd.DataFrame(columns=["entry_ts", "exit_ts", "side", "bars", "return"])
+    change = np.flatnonzero(pos[1:] != pos[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [n]))
+    side = pos[starts]
+    keep = side != 0
+    starts, ends, side = starts[keep], ends[keep], side[keep]
+
+    # cumulative log growth with a leading 0, so a run's sum is cb[end] - cb[start]
+    cb = np.empty(n + 1)
+    cg = np.empty(n + 1)
+    cb[0] = cg[0] = 0.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.log(g_intra, out=cb[1:])
+        np.log(g_gap, out=cg[1:])
+        np.cumsum(cb[1:], out=cb[1:])
+        np.cumsum(cg[1:], out=cg[1:])
+        closed = ends < n
+        fee = np.log1p(-np.abs(side) * c)
+        log_ret = (cb[ends] - cb[starts]) + (cg[np.minimum(ends + 1, n)] - cg[starts + 1]) + fee + np.where(closed, fee, 0.0)
+
+    return pd.DataFrame({
+        "entry_ts": ts[starts],
+        "exit_ts": np.where(closed, ts[np.minimum(ends, n - 1)], -1),
+        "side": side,
+        "bars": ends - starts,
+        "return": np.expm1(log_ret),
+    })
+
+
+def _stats(returns, equity, pos, turnover: float, costs, trades, cfg: BacktestConfig, bpy: float) -> Dict[str, float]:
+    n = len(returns)
+    if n == 0:
+        return {"bars": 0}
+    final = float(equity[-1])
+    years = n / bpy if bpy > 0 else 0.0
+    total = final / cfg.initial_capital - 1.0
+
+    mean = float(returns.mean())
+    std = float(returns.std())
+    neg = np.minimum(returns, 0.0)
+    downside = float(np.sqrt(np.dot(neg, neg) / n))
+    ann = float(np.sqrt(bpy)) if bpy > 0 else float("nan")
+
+    dd = np.maximum.accumulate(equity)
+    np.divide(equity, dd, out=dd)
+
+    tr = trades["return"].to_numpy()
+    return {
+        "bars": n,
+        "years": years,
+        "final_equity": final,
+        "total_return": total,
+        "cagr": (final / cfg.initial_capital) ** (1.0 / years) - 1.0 if years > 0 and final > 0 else float("nan"),
+        "volatility": std * ann,
+        "sharpe": mean / std * ann if std > 0 else float("nan"),
+        "sortino": mean / downside * ann if downside > 0 else float("nan"),
+        "max_drawdown": float(dd.min()) - 1.0,
+        "exposure": float(np.count_nonzero(pos)) / n,
+        "turnover": turnover,
+        "fees": float(costs.sum()),
+        "trades": int(len(tr)),
+        "win_rate": float(np.mean(tr > 0)) if len(tr) else float("nan"),
+        "avg_trade": float(tr.mean()) if len(tr) else float("nan"),
+    }
@@ -0,0 +1,14 @@
+from app.strategy.strategies.ma_cross import MACross
+from app.strategy.strategies.macd_cross import MACDCross
+from app.strategy.strategies.rsi_reversion import RSIReversion
+
+# name -> class, for CLIs and parameter sweeps
+STRATEGIES = {cls.name: cls for cls in (MACross, RSIReversion, MACDCross)}
+
+
+def make_strategy(name: str, **params):
+    try:
+        cls = STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f"unknown strategy {name!r}; known: {', '.join(sorted(STRATEGIES))}") from None
+    return cls(**params)
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.strategy.base import Features, Strategy, col
+
+
+@dataclass(frozen=True)
+class MACross(Strategy):
+    """Long while ma_fast > ma_slow, short (or flat with long_only) otherwise."""
+
+    fast: int = 10
+    slow: int = 50
+    long_only: bool = False
+
+    name = "ma_cross"
+
+    def indicators(self):
+        return {"ma": {"windows": [self.fast, self.slow]}}
+
+    def columns(self):
+        return [f"ma_{self.fast}", f"ma_{self.slow}"]
+
+    def validate(self) -> None:
+        if self.fast >= self.slow:
+            raise ValueError(f"fast ({self.fast}) must be < slow ({self.slow})")
+
+    def signals(self, f: Features) -> np.ndarray:
+        self.validate()
+        up = col(f, f"ma_{self.fast}") > col(f, f"ma_{self.slow}")
+        return np.where(up, 1.0, 0.0 if self.long_only else -1.0)
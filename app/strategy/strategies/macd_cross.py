@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.strategy.base import Features, Strategy, col
+
+
+@dataclass(frozen=True)
+class MACDCross(Strategy):
+    """Long while the MACD histogram is above `threshold`, short (or flat) below -threshold, else hold."""
+
+    fast: int = 12
+    slow: int = 26
+    signal: int = 9
+    threshold: float = 0.0
+    long_only: bool = False
+
+    name = "macd_cross"
+
+    def indicators(self):
+        return {"macd": {"fast": self.fast, "slow": self.slow, "signal": self.signal}}
+
+    def columns(self):
+        return ["macd_hist"]
+
+    def validate(self) -> None:
+        if self.fast >= self.slow:
+            raise ValueError(f"fast ({self.fast}) must be < slow ({self.slow})")
+
+    def signals(self, f: Features) -> np.ndarray:
+        self.validate()
+        hist = col(f, "macd_hist")
+        out = np.full(len(hist), np.nan)
+        out[hist > self.threshold] = 1.0
+        out[hist < -self.threshold] = 0.0 if self.long_only else -1.0
+        return out
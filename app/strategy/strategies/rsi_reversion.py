@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from app.strategy.base import Features, Strategy, col
+
+
+@dataclass(frozen=True)
+class RSIReversion(Strategy):
+    """
+    Mean reversion on RSI: long below `lower`, short above `upper`, flat
+    again once RSI crosses back over `exit`; otherwise hold (NaN).
+    """
+
+    window: int = 14
+    lower: float = 30.0
+    upper: float = 70.0
+    exit: float = 50.0
+    long_only: bool = False
+
+    name = "rsi_reversion"
+
+    def indicators(self):
+        return {"rsi": {"windows": [self.window]}}
+
+    def columns(self):
+        return [f"rsi_{self.window}"]
+
+    def validate(self) -> None:
+        if not self.lower < self.exit < self.upper:
+            raise ValueError(f"need lower < exit < upper, got {self.lower} / {self.exit} / {self.upper}")
+
+    def signals(self, f: Features) -> np.ndarray:
+        self.validate()
+        rsi = col(f, f"rsi_{self.window}")
+        out = np.full(len(rsi), np.nan)
+        prev = np.r_[np.nan, rsi[:-1]]
+        # exits first: an entry on the same bar wins
+        out[(prev < self.exit) & (rsi >= self.exit)] = 0.0
+        out[(prev > self.exit) & (rsi <= self.exit)] = 0.0
+        out[rsi < self.lower] = 1.0
+        if not self.long_only:
+            out[rsi > self.upper] = -1.0
+        return out
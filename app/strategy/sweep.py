@@ -0,0 +1,452 @@
+"""
+Parallel parameter sweep over the backtest engine.
+
+    sweep.yaml (features.yaml-style)          grid points
+    strategies:                               ma_cross(fast=5,slow=50)
+      ma_cross:                               ma_cross(fast=5,slow=100)
+        fast: [5, 10, 20]             ->      ...
+        slow: {start: 50, stop: 200, step: 50}
+
+- Bars are loaded once and copied into one shared memory block
+  (SharedBars); pool workers map the columns without copying.
+- Each worker keeps an LRU cache of indicator columns (IndicatorCache), so
+  ma_20 is computed once per worker, not once per grid point; the prefix
+  sums behind MA / ATR / RSI and the MACD EMAs are shared too. Grid points
+  are dispatched in contiguous chunks of the expanded grid, so neighbouring
+  points (same fast window, ...) hit the same worker's cache.
+- Every grid point runs on the same rows: indicators are computed over the
+  whole history and the backtest starts after the longest warmup in the
+  grid, so metrics are comparable across points.
+- Results stream into a CSV as chunks finish (ResultTable) and are sorted
+  by the chosen metric at the end.
+"""
+from __future__ import annotations
+
+import csv
+import heapq
+import itertools
+import math
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from app.common.types import BAR_FIELDS
+from app.features import kernels
+from app.features.service import _ema, indicator_params
+from app.storage.bar_repo import bars_to_columns
+from app.strategy.engine import BacktestConfig, backtest, bar_returns
+from app.strategy.strategies import make_strategy
+
+# compact result row: these stats, besides strategy / params / seconds
+RESULT_METRICS = (
+    "total_return", "cagr", "sharpe", "sortino", "max_drawdown",
+    "exposure", "trades", "win_rate", "avg_trade", "fees",
+)
+
+GridPoint = Tuple[str, Dict[str, Any]]  # (strategy name, params)
+
+
+# ===== config =====
+
+@dataclass(frozen=True)
+class SweepConfig:
+    symbol: str
+    timeframe: str
+    strategies: Dict[str, Dict[str, Any]]
+    source: str = "okx"
+    metric: str = "sharpe"
+    ascending: bool = False
+    warmup: int = 26
+    fee_bps: float = 5.0
+    slippage_bps: float = 1.0
+    allow_short: bool = True
+    start_ts: Optional[int] = None
+    end_ts: Optional[int] = None
+    out_dir: str = "data/sweep"
+
+    def backtest_config(self) -> BacktestConfig:
+        return BacktestConfig(fee_bps=self.fee_bps, slippage_bps=self.slippage_bps, allow_short=self.allow_short)
+
+
+def load_sweep_config(path: str = "app/config/sweep.yaml") -> SweepConfig:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        raw = yaml.safe_load(f) or {}
+    sw = raw.get("sweep", raw)
+    if not sw.get("strategies"):
+        raise ValueError(f"{path}: sweep.strategies is empty")
+    unknown = set(sw) - set(SweepConfig.__dataclass_fields__)
+    if unknown:
+        raise ValueError(f"{path}: unknown sweep keys {sorted(unknown)}")
+    return SweepConfig(**sw)
+
+
+def _values(spec) -> List[Any]:
+    """[a, b, c] | scalar | {start, stop, step} (stop inclusive)."""
+    if isinstance(spec, dict):
+        start, stop, step = spec["start"], spec["stop"], spec.get("step", 1)
+        n = int(math.floor((stop - start) / step + 1e-9)) + 1
+        vals = [start + i * step for i in range(max(n, 0))]
+        return [int(v) if isinstance(start, int) and isinstance(step, int) else float(v) for v in vals]
+    if isinstance(spec, (list, tuple)):
+        return list(spec)
+    return [spec]
+
+
+def expand_grid(strategies: Dict[str, Dict[str, Any]]) -> Tuple[List[GridPoint], int]:
+    """
+    Cartesian product per strategy, in config order (first parameter
+    outermost, so neighbours share their leading windows). Returns
+    (valid points, invalid points skipped).
+    """
+    points: List[GridPoint] = []
+    skipped = 0
+    for name, grid in strategies.items():
+        keys = list(grid or {})
+        for combo in itertools.product(*[_values(grid[k]) for k in keys]):
+            params = dict(zip(keys, combo))
+            try:
+                make_strategy(name, **params).validate()
+            except ValueError:
+                skipped += 1
+                continue
+            points.append((name, params))
+    return points, skipped
+
+
+def start_row(points: Sequence[GridPoint], warmup: int) -> int:
+    """First row every grid point can trade: past warmup and every indicator's NaN prefix."""
+    start = int(warmup)
+    for name, params in points:
+        ind = make_strategy(name, **params).indicators()
+        start = max(start, *[int(w) - 1 for w in (ind.get("ma") or {}).get("windows", [])], 0)
+        start = max(start, *[int(w) - 1 for w in (ind.get("atr") or {}).get("windows", [])], 0)
+        start = max(start, *[int(w) for w in (ind.get("rsi") or {}).get("windows", [])], 0)
+    return start
+
+
+# ===== shared bars =====
+
+class SharedBars:
+    """ts + OHLCV columns (8 bytes each) back to back in one shared memory block."""
+
+    def __init__(self, shm: shared_memory.SharedMemory, n: int, owner: bool):
+        self.shm = shm
+        self.n = n
+        self.owner = owner
+        self.cols: Dict[str, np.ndarray] = {}
+        for i, c in enumerate(BAR_FIELDS):
+            dtype = np.int64 if c == "ts" else np.float64
+            self.cols[c] = np.ndarray((n,), dtype=dtype, buffer=shm.buf, offset=i * n * 8)
+
+    @classmethod
+    def create(cls, bars) -> "SharedBars":
+        cols = bars_to_columns(bars)
+        ts = cols["ts"]
+        if len(ts) > 1 and not (ts[1:] > ts[:-1]).all():
+            order = np.argsort(ts, kind="stable")
+            cols = {c: a[order] for c, a in cols.items()}
+        n = len(ts)
+        shm = shared_memory.SharedMemory(create=True, size=max(8, n * 8 * len(BAR_FIELDS)))
+        out = cls(shm, n, owner=True)
+        for c in BAR_FIELDS:
+            out.cols[c][:] = cols[c]
+        return out
+
+    @classmethod
+    def attach(cls, spec: Tuple[str, int]) -> "SharedBars":
+        name, n = spec
+        # pool workers share the parent's resource tracker: the block stays registered
+        # once, and only the creating process unlinks it
+        return cls(shared_memory.SharedMemory(name=name), n, owner=False)
+
+    def spec(self) -> Tuple[str, int]:
+        return self.shm.name, self.n
+
+    def close(self) -> None:
+        self.cols = {}
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # views still alive in this process; the mapping goes with it
+        if self.owner:
+            self.shm.unlink()
+
+
+# ===== indicator cache =====
+
+class IndicatorCache:
+    """
+    Indicator columns over the full bar history, keyed by (kind, *params) and
+    evicted LRU beyond `max_columns`. The per-series intermediates (prefix sums
+    of close / true range / gains / losses) are built once and kept.
+    """
+
+    def __init__(self, bars: Dict[str, np.ndarray], max_columns: int = 32):
+        self.bars = bars
+        self.max_columns = max_columns
+        self._cols: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._base: Dict[str, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _shared(self, name: str):
+        v = self._base.get(name)
+        if v is None:
+            b = self.bars
+            if name == "close":
+                v = kernels.PrefixSum(b["close"])
+            elif name == "tr":
+                v = kernels.PrefixSum(kernels.true_range(b["high"], b["low"], b["close"]), center=False)
+            elif name in ("gain", "loss"):
+                gain, loss = kernels.gains_losses(b["close"])
+                self._base["gain"] = kernels.PrefixSum(gain, center=False)
+                self._base["loss"] = kernels.PrefixSum(loss, center=False)
+                return self._base[name]
+            self._base[name] = v
+        return v
+
+    def get(self, key: tuple) -> np.ndarray:
+        v = self._cols.get(key)
+        if v is not None:
+            self._cols.move_to_end(key)
+            self.hits += 1
+            return v
+        self.misses += 1
+        v = self._compute(key)
+        self._cols[key] = v
+        while len(self._cols) > self.max_columns:
+            self._cols.popitem(last=False)
+        return v
+
+    def _compute(self, key: tuple) -> np.ndarray:
+        kind = key[0]
+        if kind == "ma":
+            return self._shared("close").window_mean(key[1])
+        if kind == "atr":
+            return kernels.atr_window(self._shared("tr"), key[1])
+        if kind == "rsi":
+            return kernels.rsi_window(self._shared("gain"), self._shared("loss"), key[1])
+        if kind == "ema":
+            return _ema(kernels.as_f64(self.bars["close"]), key[1])
+        if kind == "macd_dif":
+            return self.get(("ema", key[1])) - self.get(("ema", key[2]))
+        if kind == "macd_dea":
+            return _ema(self.get(("macd_dif",) + key[1:3]), key[3])
+        if kind == "macd_hist":
+            return self.get(("macd_dif",) + key[1:3]) - self.get(("macd_dea",) + key[1:])
+        raise KeyError(f"unknown indicator {key}")
+
+
+class FeatureView(Mapping):
+    """
+    compute_features-shaped columns for one strategy, resolved lazily through
+    the cache and sliced from `start`. macd_* use the strategy's MACD params.
+    """
+
+    def __init__(self, cache: IndicatorCache, start: int, indicator_cfg: Optional[dict] = None):
+        self.cache = cache
+        self.start = start
+        p = indicator_params(indicator_cfg)
+        self._macd = (p.macd_fast, p.macd_slow, p.macd_signal)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name in self.cache.bars:
+            return self.cache.bars[name][self.start:]
+        kind, _, w = name.rpartition("_")
+        if kind in ("ma", "atr", "rsi") and w.isdigit():
+            return self.cache.get((kind, int(w)))[self.start:]
+        if name in ("macd_dif", "macd_dea", "macd_hist"):
+            key = (name,) + (self._macd[:2] if name == "macd_dif" else self._macd)
+            return self.cache.get(key)[self.start:]
+        raise KeyError(name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(BAR_FIELDS)
+
+    def __len__(self) -> int:
+        return len(BAR_FIELDS)
+
+
+# ===== worker =====
+
+_worker: Dict[str, Any] = {}
+
+
+def _init_worker(bars_spec, start: int, bt_cfg: BacktestConfig, timeframe: str, max_columns: int):
+    """Pool initializer (also used in-process): map the shared bars and set up the cache."""
+    bars = bars_spec if isinstance(bars_spec, SharedBars) else SharedBars.attach(bars_spec)
+    _worker.update(
+        bars=bars,
+        cache=IndicatorCache(bars.cols, max_columns=max_columns),
+        returns=bar_returns(bars.cols["open"][start:], bars.cols["close"][start:]),
+        start=start,
+        bt_cfg=bt_cfg,
+        timeframe=timeframe,
+    )
+
+
+def run_point(name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    strategy = make_strategy(name, **params)
+    f = FeatureView(_worker["cache"], _worker["start"], strategy.indicators())
+    res = backtest(f, strategy.signals(f), _worker["bt_cfg"], _worker["timeframe"],
+                   label=strategy.label(), returns=_worker["returns"])
+    row = {"strategy": name, "params": ",".join(f"{k}={v}" for k, v in params.items())}
+    for k in RESULT_METRICS:
+        row[k] = res.stats.get(k)
+    row["seconds"] = round(time.perf_counter() - t0, 4)
+    return row
+
+
+def _run_chunk(points: List[GridPoint]) -> Tuple[List[Dict[str, Any]], int, int]:
+    """Returns (result rows, cache hits, cache misses) for one chunk."""
+    cache = _worker["cache"]
+    h0, m0 = cache.hits, cache.misses
+    rows = []
+    for name, params in points:
+        try:
+            rows.append(run_point(name, params))
+        except Exception as e:
+            print(f"[sweep][fail] {name} {params}: {type(e).__name__}: {e}", flush=True)
+    return rows, cache.hits - h0, cache.misses - m0
+
+
+# ===== results =====
+
+class ResultTable:
+    """
+    Rows are appended to `<path>.partial` (flushed per chunk, so a crashed run
+    keeps its results); finish() writes `path` sorted by `metric` and prints
+    the top rows. A small heap tracks the running best for progress lines.
+    """
+
+    COLUMNS = ("strategy", "params") + RESULT_METRICS + ("seconds",)
+
+    def __init__(self, path: str, metric: str = "sharpe", ascending: bool = False, top: int = 20):
+        if metric not in RESULT_METRICS:
+            raise ValueError(f"unknown metric {metric!r}; one of {', '.join(RESULT_METRICS)}")
+        self.path = Path(path)
+        self.partial = self.path.with_name(self.path.name + ".partial")
+        self.metric = metric
+        self.ascending = ascending
+        self.top = top
+        self.rows = 0
+        self._best: List[tuple] = []
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.partial, "w", newline="", encoding="utf-8")
+        self._w = csv.DictWriter(self._f, fieldnames=self.COLUMNS)
+        self._w.writeheader()
+
+    def _score(self, row) -> float:
+        v = row.get(self.metric)
+        if v is None or (isinstance(v, float) and math.isnan(v)):
+            return -math.inf
+        return -v if self.ascending else v
+
+    def add(self, rows: List[Dict[str, Any]]) -> None:
+        for r in rows:
+            self._w.writerow(r)
+            item = (self._score(r), self.rows, r)
+            if len(self._best) < self.top:
+                heapq.heappush(self._best, item)
+            else:
+                heapq.heappushpop(self._best, item)
+            self.rows += 1
+        self._f.flush()
+
+    def best(self) -> Optional[Dict[str, Any]]:
+        return max(self._best)[2] if self._best else None
+
+    def finish(self) -> pd.DataFrame:
+        self._f.close()
+        df = pd.read_csv(self.partial)
+        df = df.sort_values(self.metric, ascending=self.ascending, na_position="last", kind="stable").reset_index(drop=True)
+        df.to_csv(self.path, index=False, float_format="%.6g")
+        os.remove(self.partial)
+        return df
+
+
+# ===== driver =====
+
+def _chunks(points: List[GridPoint], size: int) -> List[List[GridPoint]]:
+    return [points[i:i + size] for i in range(0, len(points), size)]
+
+
+def run_sweep(
+    bars,
+    points: List[GridPoint],
+    table: ResultTable,
+    timeframe: str,
+    bt_cfg: Optional[BacktestConfig] = None,
+    warmup: int = 26,
+    workers: int = 1,
+    chunk: Optional[int] = None,
+    max_columns: int = 32,
+    progress_every: float = 5.0,
+) -> pd.DataFrame:
+    """Run every grid point over `bars`; returns the sorted result table."""
+    bt_cfg = bt_cfg or BacktestConfig()
+    start = start_row(points, warmup)
+    shared = SharedBars.create(bars)
+    if shared.n <= start + 1:
+        shared.close()
+        raise ValueError(f"not enough bars: {shared.n} <= start row {start}")
+
+    workers = max(1, min(workers, len(points)))
+    chunk = chunk or max(1, math.ceil(len(points) / (workers * 4)))
+    chunks = _chunks(points, chunk)
+    print(f"[sweep] bars={shared.n} start_row={start} points={len(points)} chunks={len(chunks)} "
+          f"workers={workers} shm={shared.n * 48 / 1e6:.1f}MB", flush=True)
+
+    t0 = time.perf_counter()
+    last = t0
+    hits = misses = 0
+
+    def collect(out):
+        nonlocal last, hits, misses
+        rows, h, m = out
+        hits += h
+        misses += m
+        table.add(rows)
+        now = time.perf_counter()
+        if now - last >= progress_every:
+            last = now
+            best = table.best() or {}
+            print(f"[sweep] {table.rows}/{len(points)} {table.rows / (now - t0):.1f} points/s "
+                  f"best {table.metric}={best.get(table.metric)} {best.get('strategy')}({best.get('params')})", flush=True)
+
+    try:
+        if workers == 1:
+            _init_worker(shared, start, bt_cfg, timeframe, max_columns)
+            try:
+                for c in chunks:
+                    collect(_run_chunk(c))
+            finally:
+                _worker.clear()
+        else:
+            # same Pool pattern as features.batch_runner
+            with multiprocessing.Pool(
+                processes=workers,
+                initializer=_init_worker,
+                initargs=(shared.spec(), start, bt_cfg, timeframe, max_columns),
+            ) as pool:
+                for out in pool.imap_unordered(_run_chunk, chunks):
+                    collect(out)
+    finally:
+        shared.close()
+
+    wall = time.perf_counter() - t0
+    total = hits + misses
+    print(f"[sweep] done points={table.rows} wall={wall:.2f}s ({table.rows / max(wall, 1e-9):.1f} points/s) "
+          f"indicator_cache hit={hits / total if total else 0:.1%} computed={misses}", flush=True)
+    return table.finish()